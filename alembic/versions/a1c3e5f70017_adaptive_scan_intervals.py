@@ -0,0 +1,38 @@
+"""adaptive scan intervals
+
+Revision ID: a1c3e5f70017
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c3e5f70017'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('TaskTemplate', sa.Column('scan_interval_min', sa.Integer(), nullable=True))
+    op.add_column('TaskTemplate', sa.Column('scan_interval_max', sa.Integer(), nullable=True))
+    for table in ('RotationsInfo', 'SheetsInfo'):
+        op.add_column(table, sa.Column('last_change', sa.DateTime(timezone=True), nullable=True))
+        op.add_column(table, sa.Column('change_interval_ewma', sa.Float(), nullable=True))
+        op.add_column(table, sa.Column('effective_scan_interval', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('RotationsInfo', 'SheetsInfo'):
+        op.drop_column(table, 'effective_scan_interval')
+        op.drop_column(table, 'change_interval_ewma')
+        op.drop_column(table, 'last_change')
+    op.drop_column('TaskTemplate', 'scan_interval_max')
+    op.drop_column('TaskTemplate', 'scan_interval_min')
@@ -0,0 +1,32 @@
+"""task leases
+
+Revision ID: b2d4f6a80018
+Revises: a1c3e5f70017
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a80018'
+down_revision: Union[str, None] = 'a1c3e5f70017'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ('RotationsInfo', 'SheetsInfo'):
+        op.add_column(table, sa.Column('lease_owner', sa.String(), nullable=True))
+        op.add_column(table, sa.Column('lease_expires_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('RotationsInfo', 'SheetsInfo'):
+        op.drop_column(table, 'lease_expires_at')
+        op.drop_column(table, 'lease_owner')
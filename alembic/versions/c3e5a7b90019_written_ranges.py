@@ -0,0 +1,39 @@
+"""written ranges
+
+Revision ID: c3e5a7b90019
+Revises: b2d4f6a80018
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e5a7b90019'
+down_revision: Union[str, None] = 'b2d4f6a80018'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'WrittenRanges',
+        sa.Column('spreadsheet_id', sa.Text(), nullable=False),
+        sa.Column('sheet_name', sa.Text(), nullable=False),
+        sa.Column('start_row', sa.Integer(), nullable=False),
+        sa.Column('start_col', sa.Integer(), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=True),
+        sa.Column('cols', sa.Integer(), nullable=True),
+        sa.Column('hash', sa.String(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('spreadsheet_id', 'sheet_name', 'start_row', 'start_col'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('WrittenRanges')
@@ -0,0 +1,28 @@
+"""written ranges full write
+
+Revision ID: d4f6b8c10020
+Revises: c3e5a7b90019
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f6b8c10020'
+down_revision: Union[str, None] = 'c3e5a7b90019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('WrittenRanges', sa.Column('full_written_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('WrittenRanges', 'full_written_at')
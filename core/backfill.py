@@ -0,0 +1,230 @@
+# core/backfill.py
+
+"""
+Ретро-прогон сканеров за диапазон дат.
+
+Диапазон режется на слоты (дата + смена), слоты группируются по related_month и месяцы
+раздаются пулу потоков. Слоты одного месяца пишут в одни и те же листы, поэтому внутри
+месяца они идут строго по порядку дат; параллельны только разные месяцы. У каждого потока
+свои часы TimeProvider, общий пул токенов CredentialPool и один doc_id_map на весь прогон.
+Вкладки всех дат месяца читаются заранее одним планом (batchGet на документ, с делением
+только по лимитам API), scan_phase слотов берёт значения из него;
+темп запросов всех потоков держит общий rate_limiter.
+
+Выполненные слоты пишутся в JSON-чекпоинт: перезапуск продолжает с того же места.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from core.config import BACKFILL_WORKERS, BACKFILL_CHECKPOINT_DIR
+from core.data import get_related_month
+from core.time_provider import TimeProvider
+from database.session import get_session
+from utils.credential_pool import CredentialPool
+from utils.db_orm import TaskWriteBuffer
+from utils.logger import log_info, log_success, log_warning, log_error, log_section, log_separator
+from scanners.fetch_planner import prefetch_values, use_prefetched
+
+# Смены слота: (час начала, название)
+DAY_SHIFT = (12, "Дневная")
+NIGHT_SHIFT = (0, "Ночная")
+SLOT_ATTEMPTS = 2
+
+
+def backfill_slots(start_date, end_date):
+    """Слоты прогона: для первой даты — только дневная смена, дальше ночная и дневная."""
+    slots = []
+    d = start_date
+    while d <= end_date:
+        shifts = [DAY_SHIFT] if d == start_date else [NIGHT_SHIFT, DAY_SHIFT]
+        for shift_hour, shift_name in shifts:
+            slots.append((datetime.combine(d, datetime.min.time()).replace(hour=shift_hour), shift_name))
+        d += timedelta(days=1)
+    return slots
+
+
+class BackfillCheckpoint:
+    """Множество выполненных слотов в JSON-файле; запись атомарная (tmp + os.replace)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._done = set(json.load(f).get("done", []))
+
+    @staticmethod
+    def slot_key(scan_datetime):
+        return scan_datetime.strftime("%Y-%m-%dT%H:%M")
+
+    def is_done(self, scan_datetime):
+        return self.slot_key(scan_datetime) in self._done
+
+    def mark_done(self, scan_datetime):
+        with self._lock:
+            self._done.add(self.slot_key(scan_datetime))
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"done": sorted(self._done)}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._done)
+
+
+def _load_slot_tasks(scanner, session):
+    from scanners.sheetsinfo_scanner import SheetsInfoScanner
+
+    # Интервалы сканирования в прошлом не действуют: грузим все активные задачи слота
+    if isinstance(scanner, SheetsInfoScanner):
+        scanner.load_tasks(session, only_ready=False)
+    else:
+        scanner.load_tasks(session)
+    for task in scanner.tasks:
+        task.run_requested = True
+
+
+def _prepare_slot(scanner_cls, token_map, log_file, service, doc_id_map, scan_datetime, shift_name):
+    """Сканер слота с задачами, загруженными в часах слота. Returns: сканер или None при ошибке загрузки."""
+    label = f"{scan_datetime} ({shift_name} смена)"
+    TimeProvider.set_time(scan_datetime)
+    try:
+        scanner = scanner_cls(token_map, log_file=log_file)
+        scanner.service = service
+        scanner.token_name = "+".join(service.names)
+        scanner.doc_id_map = doc_id_map
+
+        log_separator(log_file, "load_tasks")
+        try:
+            log_info(log_file, "load_tasks", None, "start", f"[RETRO] Старт этапа load_tasks для {label}")
+            with get_session() as session:
+                _load_slot_tasks(scanner, session)
+            log_success(log_file, "load_tasks", None, "finish", f"[RETRO] Этап load_tasks завершён для {label}\n")
+        except Exception as e:
+            log_error(log_file, "load_tasks", None, "fail", f"[RETRO] Ошибка на этапе load_tasks для {label}", exc=e)
+            return None
+        return scanner
+    finally:
+        TimeProvider.reset()
+
+
+def _run_slot(scanner, log_file, scan_datetime, shift_name):
+    """Фазы scan/process/update слота в часах текущего потока. Returns: True, если все фазы прошли без ошибок."""
+    label = f"{scan_datetime} ({shift_name} смена)"
+    TimeProvider.set_time(scan_datetime)
+    try:
+        ok = True
+        with get_session() as session:
+            for phase_name, method in [
+                ("scan_phase", lambda: scanner.scan_phase(session)),
+                ("process_phase", lambda: scanner.process_phase(session)),
+                ("update_phase", lambda: scanner.update_phase(session)),
+            ]:
+                log_separator(log_file, phase_name)
+                try:
+                    log_info(log_file, phase_name, None, "start", f"[RETRO] Старт этапа {phase_name} для {label}")
+                    with TaskWriteBuffer(session, log_file):
+                        method()
+                    log_success(log_file, phase_name, None, "finish", f"[RETRO] Этап {phase_name} завершён для {label}\n")
+                except Exception as e:
+                    ok = False
+                    log_error(log_file, phase_name, None, "fail", f"[RETRO] Ошибка на этапе {phase_name} для {label}", exc=e)
+        return ok
+    finally:
+        TimeProvider.reset()
+
+
+def _group_by_month(slots):
+    """{related_month: [слоты по порядку дат]} — слоты месяца пишут в одни и те же листы."""
+    months = {}
+    for scan_datetime, shift_name in sorted(slots):
+        months.setdefault(get_related_month(scan_datetime), []).append((scan_datetime, shift_name))
+    return months
+
+
+def run_backfill(scanner_cls, token_map, log_file, start_date, end_date, stop_event=None,
+                 workers=BACKFILL_WORKERS, checkpoint_path=None):
+    """
+    Ретро-прогон scanner_cls за [start_date, end_date] в workers потоков.
+
+    Returns:
+        tuple: (выполнено слотов, всего слотов).
+    """
+    checkpoint_path = checkpoint_path or os.path.join(
+        BACKFILL_CHECKPOINT_DIR, f"{scanner_cls.__name__}_{start_date}_{end_date}.json"
+    )
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+    slots = [(dt, name) for dt, name in backfill_slots(start_date, end_date) if not checkpoint.is_done(dt)]
+    total = len(slots) + len(checkpoint)
+    log_section(log_file, "backfill", f"⏪ Ретро-прогон {scanner_cls.__name__}: {start_date} — {end_date}, "
+                                      f"слотов {total}, уже выполнено {len(checkpoint)}, потоков {workers} (по месяцам)")
+    if not slots:
+        return len(checkpoint), total
+
+    # Токены и карта документов — одни на весь прогон
+    service = CredentialPool(token_map, log_file)
+    with get_session() as session:
+        from core.data import return_tracked_tables
+        doc_id_map = return_tracked_tables(session)
+
+    def stopped():
+        return stop_event is not None and stop_event.is_set()
+
+    def run_with_retry(scanner, scan_datetime, shift_name):
+        for attempt in range(1, SLOT_ATTEMPTS + 1):
+            if stopped():
+                return False
+            if scanner is None:
+                scanner = _prepare_slot(scanner_cls, token_map, log_file, service, doc_id_map, scan_datetime, shift_name)
+            if scanner is not None and _run_slot(scanner, log_file, scan_datetime, shift_name):
+                return True
+            scanner = None  # повтор начинается с чистой загрузки задач
+            log_warning(log_file, "backfill", None, "retry",
+                        f"⚠️ Слот {scan_datetime} ({shift_name}) завершился с ошибками, попытка {attempt}/{SLOT_ATTEMPTS}")
+        return False
+
+    def run_month(related_month, month_slots):
+        """Слоты месяца по порядку дат; вкладки всех дат читаются заранее одним планом."""
+        prepared = []
+        for scan_datetime, shift_name in month_slots:
+            if stopped():
+                return
+            prepared.append((scan_datetime, shift_name, _prepare_slot(
+                scanner_cls, token_map, log_file, service, doc_id_map, scan_datetime, shift_name)))
+
+        tasks = [task for _, _, scanner in prepared if scanner is not None
+                 for task in scanner.tasks if task.source_doc_id]
+        TimeProvider.set_time(month_slots[0][0])
+        try:
+            log_info(log_file, "backfill", None, "prefetch",
+                     f"📦 {related_month:%Y-%m}: чтение вкладок {len(prepared)} слотов одним планом, задач {len(tasks)}")
+            cache = prefetch_values(service, tasks, log_file, "+".join(service.names)) if tasks else {}
+        finally:
+            TimeProvider.reset()
+
+        with use_prefetched(cache):
+            for scan_datetime, shift_name, scanner in prepared:
+                try:
+                    if run_with_retry(scanner, scan_datetime, shift_name):
+                        checkpoint.mark_done(scan_datetime)
+                except Exception as e:
+                    log_error(log_file, "backfill", None, "slot_fail", f"❌ Слот {scan_datetime} упал", exc=e)
+
+    months = _group_by_month(slots)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(months))), thread_name_prefix="backfill") as executor:
+        futures = {executor.submit(run_month, month, month_slots): month for month, month_slots in months.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                log_error(log_file, "backfill", None, "month_fail", f"❌ Месяц {futures[future]:%Y-%m} упал", exc=e)
+
+    log_success(log_file, "backfill", None, "finish",
+                f"✅ Ретро-прогон {scanner_cls.__name__}: выполнено слотов {len(checkpoint)} из {total}")
+    return len(checkpoint), total
@@ -2,10 +2,11 @@
 
 from datetime import datetime, timedelta
 from core.task_model import Task
-from sqlalchemy import text
+from sqlalchemy import text, literal, select, values, column, true, String, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from database.db_models import TrackedTables, TaskTemplate, RotationsInfo, SheetsInfo
-from core.task_model import Task
+from core.task_model import Task, TASK_COLUMNS
 from database.session import get_session
 from core.time_provider import TimeProvider
 from utils.logger import (
@@ -61,34 +62,70 @@ def parse_datetime(value):
         return value.replace(tzinfo=tz)
     return value
 
+def task_columns(model):
+    """Колонки задачи без тяжёлого values_json: он читается позже и только если нужен (Task.values_json)."""
+    return [getattr(model, column) for column in TASK_COLUMNS if column != "values_json"]
+
+# Колонки задачи, которые копируются из TaskTemplate при создании
+TEMPLATE_COLUMNS = (
+    "name_of_process", "source_table_type", "source_page_area", "scan_group", "scan_interval",
+    "process_data_method", "target_table_type", "target_page_area", "update_group",
+)
+# Начальные значения новой задачи; last_scan, last_update, hash, values_json — NULL
+NEW_TASK_DEFAULTS = (
+    ("is_active", 1), ("scan_quantity", 0), ("scan_failures", 0),
+    ("update_quantity", 0), ("update_failures", 0),
+)
+
+def _instantiate_tasks(session, model, constraint, columns, select_stmt, returning):
+    """
+    INSERT INTO model (...) SELECT ... FROM TaskTemplate ON CONFLICT ON CONSTRAINT ... DO NOTHING RETURNING:
+    один запрос вместо проверки существования, bulk_save_objects и повторной выборки,
+    параллельные сканеры не падают на уникальном ключе. Returns: созданные строки (returning).
+    """
+    stmt = (
+        pg_insert(model)
+        .from_select([name for name, _ in columns], select_stmt)
+        .on_conflict_do_nothing(constraint=constraint)
+        .returning(*returning)
+    )
+    return session.execute(stmt).all()
+
+def _template_columns(related_month, source_page, target_page):
+    return [(name, getattr(TaskTemplate, name)) for name in TEMPLATE_COLUMNS] + [
+        ("source_page_name", source_page),
+        ("target_page_name", target_page),
+        ("related_month", literal(related_month, Date)),
+    ] + [(name, literal(value)) for name, value in NEW_TASK_DEFAULTS]
+
+def instantiate_rotations_tasks(session, related_month, active_tabs):
+    """Создаёт недостающие задачи RotationsInfo (шаблон × активная смена). Returns: [(name_of_process, смена)]."""
+    if not active_tabs:
+        return []
+    tabs = values(column("tab", String), name="active_tabs").data([(tab,) for tab in active_tabs])
+    columns = _template_columns(related_month, tabs.c.tab, tabs.c.tab)
+    select_stmt = (
+        select(*[expr for _, expr in columns])
+        .select_from(TaskTemplate)
+        .join(tabs, true())
+        .where(TaskTemplate.source_table == "RotationsInfo")
+    )
+    return _instantiate_tasks(session, RotationsInfo, "uq_rotations_month_name_page", columns, select_stmt,
+                              (RotationsInfo.name_of_process, RotationsInfo.source_page_name))
+
+def instantiate_sheets_tasks(session, related_month):
+    """Создаёт недостающие задачи SheetsInfo (по одной на шаблон в месяц). Returns: [(name_of_process,)]."""
+    columns = _template_columns(related_month, TaskTemplate.source_page_name, TaskTemplate.target_page_name)
+    select_stmt = (
+        select(*[expr for _, expr in columns])
+        .where(TaskTemplate.source_table == "SheetsInfo")
+    )
+    return _instantiate_tasks(session, SheetsInfo, "uq_sheets_month_name", columns, select_stmt,
+                              (SheetsInfo.name_of_process,))
+
 def build_task(row, now, source_table):
     """Создает задачу на основе строки данных и источника таблицы"""
-    task = Task({
-        "id": row.id,
-        "is_active": row.is_active,
-        "related_month": row.related_month,
-        "name_of_process": row.name_of_process,
-        "source_table_type": row.source_table_type,
-        "source_page_name": getattr(row, "source_page_name", None),
-        "source_page_area": row.source_page_area,
-        "scan_group": row.scan_group,
-        "last_scan": row.last_scan,
-        "scan_interval": row.scan_interval,
-        "scan_quantity": row.scan_quantity,
-        "scan_failures": row.scan_failures,
-        "hash": row.hash,
-        "process_data_method": row.process_data_method,
-        "values_json": row.values_json,
-        "target_table_type": row.target_table_type,
-        "target_page_name": row.target_page_name,
-        "target_page_area": row.target_page_area,
-        "update_group": row.update_group,
-        "last_update": row.last_update,
-        "update_quantity": row.update_quantity,
-        "update_failures": row.update_failures
-    })
-    task.source_table = source_table
-    return task
+    return Task.from_row(row, source_table)
 
 def get_related_month(now_time=None):
     """
@@ -114,64 +151,16 @@ def load_rotationsinfo_tasks(session, log_file):
     try:
         templates = session.query(TaskTemplate).filter_by(source_table="RotationsInfo").all()
         template_names = [tmpl.name_of_process for tmpl in templates]
+        interval_bounds = {tmpl.name_of_process: (tmpl.scan_interval_min, tmpl.scan_interval_max) for tmpl in templates}
         log_info(log_file, "define_tasks", None, "templates", f"📚 Количество шаблонов: {len(templates)}")
 
-        all_tasks = session.query(RotationsInfo).filter(
-            RotationsInfo.related_month == related_month,
-            RotationsInfo.name_of_process.in_(template_names),
-            RotationsInfo.source_page_name.in_(active_tabs)
-        ).all()
-        log_info(log_file, "define_tasks", None, "db_tasks", f"📦 Количество задач в БД для related_month={related_month}, active_tabs={active_tabs}: {len(all_tasks)}")
-
-        existing = {
-            (t.name_of_process, t.source_page_name): t
-            for t in all_tasks
-        }
-
-        new_tasks = []
-        created_count = 0
-        for tmpl in templates:
-            for tab in active_tabs:
-                key = (tmpl.name_of_process, tab)
-                if key not in existing:
-                    try:
-                        new_task = RotationsInfo(
-                            name_of_process=tmpl.name_of_process,
-                            source_table_type=tmpl.source_table_type,
-                            source_page_name=tab,
-                            source_page_area=tmpl.source_page_area,
-                            scan_group=tmpl.scan_group,
-                            scan_interval=tmpl.scan_interval,
-                            process_data_method=tmpl.process_data_method,
-                            target_table_type=tmpl.target_table_type,
-                            target_page_name=tab,
-                            target_page_area=tmpl.target_page_area,
-                            update_group=tmpl.update_group,
-                            is_active=1,
-                            related_month=related_month,
-                            scan_quantity=0,
-                            scan_failures=0,
-                            update_quantity=0,
-                            update_failures=0,
-                            last_scan=None,
-                            last_update=None,
-                            hash=None,
-                            values_json=None
-                        )
-                        new_tasks.append(new_task)
-                        existing[key] = new_task
-                        created_count += 1
-                        log_success(log_file, "define_tasks", tmpl.name_of_process, "created", f"Задача '{tmpl.name_of_process}' для смены '{tab}' создана.")
-                    except Exception as e:
-                        log_error(log_file, "define_tasks", tmpl.name_of_process, "fail", f"Ошибка при создании задачи: {e}")
-        log_info(log_file, "define_tasks", None, "new_tasks", f"Создано новых задач: {created_count}")
-
-        if new_tasks:
-            session.bulk_save_objects(new_tasks)
-            session.commit()
-            log_success(log_file, "define_tasks", None, "saved", f"📥 Сохранено новых задач: {len(new_tasks)}")
+        created = instantiate_rotations_tasks(session, related_month, active_tabs)
+        session.commit()
+        for name_of_process, tab in created:
+            log_success(log_file, "define_tasks", name_of_process, "created", f"Задача '{name_of_process}' для смены '{tab}' создана.")
+        log_info(log_file, "define_tasks", None, "new_tasks", f"Создано новых задач: {len(created)}")
 
-        active_tasks = session.query(RotationsInfo).filter(
+        active_tasks = session.query(*task_columns(RotationsInfo)).filter(
             RotationsInfo.related_month == related_month,
             RotationsInfo.name_of_process.in_(template_names),
             RotationsInfo.source_page_name.in_(active_tabs),
@@ -182,18 +171,20 @@ def load_rotationsinfo_tasks(session, log_file):
         tasks = []
         for task in active_tasks:
             try:
+                built_task = build_task(task, now_time, "RotationsInfo")
+                built_task.set_interval_bounds(*interval_bounds.get(task.name_of_process, (None, None)))
+                interval = built_task.current_scan_interval()
                 last_scan = parse_datetime(task.last_scan)
-                next_scan = last_scan + timedelta(seconds=task.scan_interval)
+                next_scan = last_scan + timedelta(seconds=interval)
                 minutes_left = int((next_scan - now_time).total_seconds() / 60)
                 log_info(log_file, "define_tasks", task.name_of_process, "ready",
                     f"[✅READY] Task '{task.name_of_process} {task.source_page_name}' | "
                     f"Last scan: {last_scan:%Y-%m-%d %H:%M:%S} | "
-                    f"Interval: {task.scan_interval // 60} min | "
+                    f"Interval: {interval // 60} min | "
                     f"In: {minutes_left} min | "
                     f"Next scan at: {next_scan:%Y-%m-%d %H:%M} | "
                     f"Now: {now_time:%Y-%m-%d %H:%M:%S}"
                 )
-                built_task = build_task(task, now_time, "RotationsInfo")
                 # Проверка assign_doc_ids (если используется)
                 if hasattr(built_task, 'assign_doc_ids'):
                     doc_id_map = getattr(task, 'doc_id_map', None)
@@ -211,10 +202,10 @@ def load_rotationsinfo_tasks(session, log_file):
     finally:
         session.close()
         
-def load_sheetsinfo_tasks(session, log_file):
+def load_sheetsinfo_tasks(session, log_file, only_ready=True):
     """
     Загружает задачи из SheetsInfo, создаёт недостающие на основе шаблонов, фильтрует по времени сканирования.
-    Возвращает список Task-объектов, готовых к выполнению.
+    Возвращает список Task-объектов, готовых к выполнению (only_ready=False — все активные, для планировщика).
     """
     log_section(log_file, "define_tasks", "🔼 Фаза определения задач (SheetsInfo)")
     now_time = TimeProvider.now()
@@ -225,71 +216,24 @@ def load_sheetsinfo_tasks(session, log_file):
         # Шаг 1: получаем шаблоны
         templates = session.query(TaskTemplate).filter_by(source_table="SheetsInfo").all()
         template_names = [tmpl.name_of_process for tmpl in templates]
+        interval_bounds = {tmpl.name_of_process: (tmpl.scan_interval_min, tmpl.scan_interval_max) for tmpl in templates}
         log_info(log_file, "define_tasks", None, "templates", f"📚 Количество шаблонов: {len(templates)}")
 
-        # Шаг 2: получаем задачи из БД
-        all_tasks = session.query(SheetsInfo).filter(
-            SheetsInfo.related_month == related_month,
-            SheetsInfo.name_of_process.in_(template_names)
-        ).all()
-        log_info(log_file, "define_tasks", None, "db_tasks",
-                f"📦 Количество задач в БД для related_month={related_month}: {len(all_tasks)}")
-
-        existing = {t.name_of_process: t for t in all_tasks}
-        new_tasks = []
-        created_count = 0
-
-        # Шаг 3: создаём недостающие задачи
-        for tmpl in templates:
-            if tmpl.name_of_process not in existing:
-                try:
-                    new_task = SheetsInfo(
-                        name_of_process=tmpl.name_of_process,
-                        source_table_type=tmpl.source_table_type,
-                        source_page_name=tmpl.source_page_name,
-                        source_page_area=tmpl.source_page_area,
-                        scan_group=tmpl.scan_group,
-                        scan_interval=tmpl.scan_interval,
-                        process_data_method=tmpl.process_data_method,
-                        target_table_type=tmpl.target_table_type,
-                        target_page_name=tmpl.target_page_name,
-                        target_page_area=tmpl.target_page_area,
-                        update_group=tmpl.update_group,
-                        is_active=1,
-                        related_month=related_month,
-                        scan_quantity=0,
-                        scan_failures=0,
-                        update_quantity=0,
-                        update_failures=0,
-                        last_scan=None,
-                        last_update=None,
-                        hash=None,
-                        values_json=None
-                    )
-                    new_tasks.append(new_task)
-                    existing[tmpl.name_of_process] = new_task
-                    created_count += 1
-                    log_success(log_file, "define_tasks", tmpl.name_of_process, "created",
-                                f"Задача '{tmpl.name_of_process}' создана.")
-                except Exception as e:
-                    log_error(log_file, "define_tasks", getattr(tmpl, 'name_of_process', None),
-                            "fail", "Ошибка при создании задачи", exc=e)
-
-        log_info(log_file, "define_tasks", None, "new_tasks", f"Создано новых задач: {created_count}")
-
-        if new_tasks:
-            try:
-                session.bulk_save_objects(new_tasks, return_defaults=True)
-                session.commit()
-                log_success(log_file, "define_tasks", None, "saved",
-                            f"📥 Сохранено новых задач: {len(new_tasks)}")
-            except Exception as e:
-                session.rollback()
-                log_error(log_file, "define_tasks", None, "db_commit",
-                        "Ошибка при сохранении новых задач", exc=e)
-
-        # Шаг 4: фильтрация только активных
-        active_tasks = session.query(SheetsInfo).filter(
+        # Шаг 2: создаём недостающие задачи месяца (конфликт с существующими — пропуск)
+        try:
+            created = instantiate_sheets_tasks(session, related_month)
+            session.commit()
+            for (name_of_process,) in created:
+                log_success(log_file, "define_tasks", name_of_process, "created",
+                            f"Задача '{name_of_process}' создана.")
+            log_info(log_file, "define_tasks", None, "new_tasks", f"Создано новых задач: {len(created)}")
+        except Exception as e:
+            session.rollback()
+            log_error(log_file, "define_tasks", None, "db_commit",
+                    "Ошибка при создании новых задач", exc=e)
+
+        # Шаг 3: фильтрация только активных
+        active_tasks = session.query(*task_columns(SheetsInfo)).filter(
             SheetsInfo.related_month == related_month,
             SheetsInfo.name_of_process.in_(template_names),
             SheetsInfo.is_active == 1
@@ -297,14 +241,15 @@ def load_sheetsinfo_tasks(session, log_file):
         log_info(log_file, "define_tasks", None, "active",
                 f"✅ Количество активных задач: {len(active_tasks)}")
 
-        # Шаг 5: отбор по интервалу + формирование Task
+        # Шаг 4: отбор по интервалу + формирование Task
         tasks = []
         for task_obj in active_tasks:
             try:
-                built_task = Task(task_obj.__dict__)
+                built_task = Task.from_row(task_obj, "SheetsInfo")
+                built_task.set_interval_bounds(*interval_bounds.get(built_task.name_of_process, (None, None)))
 
-                if not built_task.is_ready_to_scan():
-                    next_scan = built_task.last_scan + timedelta(seconds=built_task.scan_interval)
+                if only_ready and not built_task.is_ready_to_scan():
+                    next_scan = built_task.last_scan + timedelta(seconds=built_task.current_scan_interval())
                     minutes_left = int((next_scan - now_time).total_seconds() / 60)
                     log_info(log_file, "define_tasks", built_task.name_of_process, "skip",
                             f"[⏳SKIP] Слишком рано. Next scan at: {next_scan:%Y-%m-%d %H:%M}, in {minutes_left} min.")
@@ -313,7 +258,7 @@ def load_sheetsinfo_tasks(session, log_file):
                 log_info(log_file, "define_tasks", built_task.name_of_process, "ready",
                         f"[✅READY] Task '{built_task.name_of_process} {built_task.source_page_name}' | "
                         f"Last scan: {built_task.last_scan} | "
-                        f"Interval: {built_task.scan_interval // 60} min")
+                        f"Interval: {built_task.current_scan_interval() // 60} min")
 
                 tasks.append(built_task)
 
@@ -23,16 +23,22 @@ from core.config import (
     SHEETSINFO_TOKEN,
     ROTATIONSINFO_TOKEN_1,
     ROTATIONSINFO_TOKEN_2,
+    ROTATIONSINFO_EXTRA_TOKENS,
+    SHEETSINFO_EXTRA_TOKENS,
 )
-from database.session import get_session, SessionLocal, engine
-from core.data import return_tracked_tables
+from database.session import SessionLocal, engine
 from scanners.rotationsinfo_scanner import RotationsInfoScanner
 from scanners.sheetsinfo_scanner import SheetsInfoScanner
 from core.timezone import now
 from core.time_provider import TimeProvider
+from core.scheduler import wake_scheduler
+from core.task_notify import TaskRunListener
+from core.backfill import run_backfill
+from core import process_pool
 
 rotation_tokens = {
-    "RotationsInfo_scanner_1": ROTATIONSINFO_TOKEN_1
+    "RotationsInfo_scanner_1": ROTATIONSINFO_TOKEN_1,
+    **ROTATIONSINFO_EXTRA_TOKENS
 }
 
 rotation_retro_tokens = {
@@ -40,7 +46,8 @@ rotation_retro_tokens = {
 }
 
 sheet_tokens = {
-    "RotationsInfo_scanner_2": ROTATIONSINFO_TOKEN_2
+    "RotationsInfo_scanner_2": ROTATIONSINFO_TOKEN_2,
+    **SHEETSINFO_EXTRA_TOKENS
 }
 
 stop_event = threading.Event()
@@ -72,56 +79,13 @@ def signal_handler(sig, frame):
     log_section(MAIN_LOG, "main", "🛑 Скрипт остановлен пользователем.")
     stop_event.set()
 
+def wake_handler(sig, frame):
+    # kill -USR1 <pid>: сканеры перечитывают задачи и запускают готовые без ожидания
+    log_info(MAIN_LOG, "main", None, "wake", "⏰ Получен сигнал пробуждения планировщиков")
+    wake_scheduler(reload=True)
+
 def run_retro_scanner(scanner_cls, token_map, log_path, start_date, end_date):
-    from datetime import datetime, timedelta
-    import time
-    from utils.utils import load_credentials
-    d = start_date
-    first = True
-    while d <= end_date and not stop_event.is_set():
-        if first:
-            # Только дневная смена для первой даты
-            scan_times = [(12, "Дневная")]
-            first = False
-        else:
-            # Ночная смена (00:00) и дневная (12:00) для остальных дат
-            scan_times = [(0, "Ночная"), (12, "Дневная")]
-        for shift_hour, shift_name in scan_times:
-            scan_datetime = datetime.combine(d, datetime.min.time()).replace(hour=shift_hour)
-            TimeProvider.set_time(scan_datetime)
-            try:
-                print(f"▶️ Ретро-сканирование {scanner_cls.__name__} на дату: {scan_datetime} ({shift_name} смена)")
-
-                scanner = scanner_cls(token_map, log_file=log_path)
-                with get_session() as session:
-                    scanner.service = None
-                    token_name = list(scanner.token_map.keys())[0]
-                    token_path = scanner.token_map[token_name]
-                    scanner.token_name = token_name
-                    scanner.service = scanner.service or load_credentials(token_path, log_path)
-                    scanner.doc_id_map = return_tracked_tables(session)
-                    phase_methods = [
-                        ("load_tasks", lambda: scanner.load_tasks(session)),
-                        ("scan_phase", lambda: scanner.scan_phase(session)),
-                        ("process_phase", lambda: scanner.process_phase(session)),
-                        ("update_phase", lambda: scanner.update_phase(session)),
-                    ]
-                    for phase_name, method in list(phase_methods):
-                        try:
-                            from utils.logger import log_separator, log_info, log_success
-                            log_separator(scanner.log_file, phase_name)
-                            log_info(scanner.log_file, phase_name, None, "start", f"[RETRO] Старт этапа {phase_name} для {scan_datetime} ({shift_name} смена)")
-                            method()
-                            log_success(scanner.log_file, phase_name, None, "finish", f"[RETRO] Этап {phase_name} завершён для {scan_datetime} ({shift_name} смена)\n")
-                        except Exception as e:
-                            from utils.logger import log_error
-                            log_error(scanner.log_file, phase_name, None, "fail", f"[RETRO] Ошибка на этапе {phase_name} для {scan_datetime} ({shift_name} смена): {e}")
-            except Exception as e:
-                print(f"[RETRO][{scanner_cls.__name__}] Ошибка на {scan_datetime} ({shift_name} смена): {e}")
-            finally:
-                TimeProvider.reset()
-        d += timedelta(days=1)
-        time.sleep(2)
+    run_backfill(scanner_cls, token_map, log_path, start_date, end_date, stop_event=stop_event)
 
 def parse_date_arg(val):
     from datetime import datetime
@@ -137,6 +101,8 @@ async def main():
     print("🚀 Инициализация...")
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, wake_handler)
 
     bot_thread = threading.Thread(target=run_bot, daemon=True)
     bot_thread.start()
@@ -152,6 +118,11 @@ async def main():
         t.start()
         scanner_threads.append(t)
 
+    # Кнопка «Run» в боте -> NOTIFY -> внеочередной запуск задачи
+    listener = TaskRunListener(engine, stop_event)
+    listener.start()
+    scanner_threads.append(listener)
+
     # --- Обработка даты для сканеров ---
     scan_date = None
     scan_start = None
@@ -180,13 +151,13 @@ async def main():
         
         # Запуск ретро-потоков
 
-        # t1 = threading.Thread(target=run_retro_scanner, args=(RotationsInfoScanner, rotation_retro_tokens, ROTATIONSINFO_RETRO_LOG, start, end), daemon=True)
-        # t1.start()
-        # scanner_threads.append(t1)
+        t1 = threading.Thread(target=run_retro_scanner, args=(RotationsInfoScanner, rotation_retro_tokens, ROTATIONSINFO_RETRO_LOG, start, end), daemon=True)
+        t1.start()
+        scanner_threads.append(t1)
 
-        # t2 = threading.Thread(target=run_retro_scanner, args=(SheetsInfoScanner, sheet_tokens, SHEETSINFO_RETRO_LOG, start, end), daemon=True)
-        # t2.start()
-        # scanner_threads.append(t2)
+        t2 = threading.Thread(target=run_retro_scanner, args=(SheetsInfoScanner, sheet_tokens, SHEETSINFO_RETRO_LOG, start, end), daemon=True)
+        t2.start()
+        scanner_threads.append(t2)
 
     else:
         TimeProvider.reset()
@@ -204,6 +175,9 @@ async def main():
                 print(f"⚠️ Поток {t.name} не завершился корректно.")
                 log_warning(MAIN_LOG, "main", t.name, "not_stopped", f"⚠️ Поток {t.name} не завершился корректно.")
 
+        # Остановка пула процессов обработки (если был запущен)
+        process_pool.shutdown()
+
         # 👇 Закрытие всех сессий и соединений
         try:
             print("🔌 Завершение всех SQLAlchemy-сессий и соединений...")
@@ -1,6 +1,7 @@
 # core/methods.py
 
-from typing import List
+from itertools import chain
+from typing import Iterable, List
 import re
 
 # QA columns config (floor/game category)
@@ -108,12 +109,15 @@ def process_permits(values: List[List], source_page_area=None) -> List[dict]:
 
     return result
 
-def process_qa_list_in_db(values: List[List], source_page_area=None) -> List[dict]:
-    if len(values) < 3:
+def process_qa_list_in_db(values: Iterable[List], source_page_area=None) -> List[dict]:
+    # Один проход по строкам: values может быть потоком окон batchGet
+    rows = iter(values)
+    raw_header = next(rows, None)
+    next(rows, None)
+    if raw_header is None:
         return []
 
-    raw_header = values[0]
-    data_rows = values[2:]
+    data_rows = rows
     header = ["name" if normalize_cell(h).lower().startswith("dealer name") else normalize_cell(h) for h in raw_header]
 
     result = []
@@ -164,12 +168,15 @@ def process_feedbacks_status(values: List[List], source_page_area=None) -> List[
     return result
 
 
-def process_feedbacks(values: List[List], source_page_area=None) -> List[dict]:
-    if len(values) < 2:
+def process_feedbacks(values: Iterable[List], source_page_area=None) -> List[dict]:
+    rows = iter(values)
+    next(rows, None)
+    header_row = next(rows, None)
+    if header_row is None:
         return []
 
-    header = [normalize_cell(h) for h in values[1]]
-    data_rows = values[2:]
+    header = [normalize_cell(h) for h in header_row]
+    data_rows = rows
 
     result = []
     for row in data_rows:
@@ -179,16 +186,19 @@ def process_feedbacks(values: List[List], source_page_area=None) -> List[dict]:
     return result
 
 
-def process_mistake_in_db(values: List[List], source_page_area=None) -> List[dict]:
-    if len(values) < 2:
+def process_mistake_in_db(values: Iterable[List], source_page_area=None) -> List[dict]:
+    rows = iter(values)
+    header_row = next(rows, None)
+    first_row = next(rows, None)
+    if header_row is None or first_row is None:
         return []
 
-    header = [normalize_cell(h) for h in values[0]]
+    header = [normalize_cell(h) for h in header_row]
     if any(h == "" for h in header):
         raise ValueError("Некорректные заголовки: пустые ячейки")
 
     result = []
-    for row in values[1:]:
+    for row in chain([first_row], rows):
         if any(normalize_cell(cell) for cell in row):
             entry = {
                 col: normalize_cell(row[i]) if i < len(row) else None
@@ -396,4 +406,11 @@ PROCESSORS = {
     "process_feedbacks": process_feedbacks,
     "process_qa_list_in_db": process_qa_list_in_db,
     "process_sm_schedule": process_sm_schedule,
-}
\ No newline at end of file
+}
+
+# Обработчики, которые читают строки за один проход и принимают поток окон batchGet
+STREAMING_PROCESSORS = {
+    "process_mistake_in_db",
+    "process_feedbacks",
+    "process_qa_list_in_db",
+}
@@ -0,0 +1,76 @@
+# core/pipeline.py
+
+import queue
+import threading
+
+from core.time_provider import TimeProvider
+from utils.logger import log_error
+
+_STOP = object()
+
+
+class StagedPipeline:
+    """
+    Конвейер этапов с ограниченными очередями между ними: элемент (например, группа задач)
+    переходит к следующему этапу сразу, как только готов, не дожидаясь остальных.
+
+    Обратное давление — размер очередей: быстрый этап блокируется на put(), пока
+    медленный не заберёт элемент; темп запросов к API дополнительно держит rate_limiter.
+
+    Args:
+        stages: [(имя, функция item -> item | None, число потоков)]; None — элемент дальше не идёт.
+        queue_size: Ёмкость очереди перед каждым этапом.
+    """
+
+    def __init__(self, stages, queue_size, log_file=None, phase="pipeline"):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.log_file = log_file
+        self.phase = phase
+
+    def _worker(self, name, func, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                return
+            try:
+                result = func(item)
+            except Exception as e:
+                log_error(self.log_file, self.phase, None, f"{name}_fail", f"❌ Ошибка на этапе {name}", exc=e)
+                continue
+            if result is not None:
+                out_queue.put(result)
+
+    def run(self, items):
+        """Прогоняет элементы через все этапы и возвращает результаты последнего этапа."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = queue.Queue()
+        outputs = queues[1:] + [results]
+
+        workers = []
+        for (name, func, count), in_queue, out_queue in zip(self.stages, queues, outputs):
+            # Потоки этапа видят то же время, что и сканер (ретро-прогоны)
+            target = TimeProvider.bind(self._worker)
+            threads = [
+                threading.Thread(target=target, args=(name, func, in_queue, out_queue),
+                                 name=f"pipeline-{name}-{i}", daemon=True)
+                for i in range(max(1, count))
+            ]
+            for thread in threads:
+                thread.start()
+            workers.append(threads)
+
+        for item in items:
+            queues[0].put(item)
+
+        # Останавливаем этапы по порядку: этап завершается, когда выработал свою очередь
+        for in_queue, threads in zip(queues, workers):
+            for _ in threads:
+                in_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        collected = []
+        while not results.empty():
+            collected.append(results.get())
+        return collected
@@ -0,0 +1,112 @@
+# core/process_pool.py
+
+"""
+Необязательный пул процессов для чистых CPU-функций: обработчики PROCESSORS,
+хэш values_json и сборка repeatCell-запросов форматирования.
+
+В одном интерпретаторе с ботом и потоками сканеров эти функции конкурируют за GIL;
+в пуле они считаются в отдельных процессах. Обработчик передаётся по имени
+(лямбды из PROCESSORS не сериализуются), а хэш считается там же, где значения,
+чтобы родительскому процессу не сериализовать их повторно.
+
+PROCESS_POOL_WORKERS=0 — пул выключен, всё выполняется в вызывающем потоке.
+Небольшие таблицы (меньше PROCESS_POOL_MIN_CELLS ячеек) тоже считаются на месте:
+передача в процесс дороже самой обработки.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.config import PROCESS_POOL_WORKERS, PROCESS_POOL_MIN_CELLS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # В процессе уже работают потоки (бот, сканеры) — fork небезопасен
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _executor = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown():
+    _reset_executor()
+
+
+def _cell_count(values):
+    if not isinstance(values, list):
+        return 0
+    return sum(len(row) for row in values if isinstance(row, list))
+
+
+def _use_pool(values):
+    return PROCESS_POOL_WORKERS > 0 and _cell_count(values) >= PROCESS_POOL_MIN_CELLS
+
+
+def _submit(func, *args):
+    """Выполняет func в пуле; при падении пула пересоздаёт его и считает на месте."""
+    try:
+        return _get_executor().submit(func, *args).result()
+    except BrokenProcessPool:
+        _reset_executor()
+        return func(*args)
+
+
+##################################################################################
+# Функции, выполняемые в рабочих процессах
+##################################################################################
+
+def _process_and_hash(method_name, values, source_page_area):
+    from core.methods import PROCESSORS
+    from core.task_model import compute_values_hash
+
+    processed = PROCESSORS[method_name](values, source_page_area)
+    return processed, compute_values_hash(processed)
+
+
+def _build_formatting_requests(values, sheet_id, start_row, start_col):
+    from utils.formatting_utils import build_formatting_requests
+
+    return build_formatting_requests(values, sheet_id, start_row, start_col)
+
+
+##################################################################################
+# Публичный интерфейс
+##################################################################################
+
+def process_values(method_name, values, source_page_area=None):
+    """
+    Обрабатывает сырые значения обработчиком method_name.
+
+    Returns:
+        tuple: (processed_values, hash | None). Хэш считается только в пуле,
+            на месте он вычисляется позже в Task.check_for_update.
+    """
+    if _use_pool(values):
+        return _submit(_process_and_hash, method_name, values, source_page_area)
+
+    from core.methods import PROCESSORS
+    return PROCESSORS[method_name](values, source_page_area), None
+
+
+def build_formatting_requests(values, sheet_id, start_row=0, start_col=3):
+    if _use_pool(values):
+        return _submit(_build_formatting_requests, values, sheet_id, start_row, start_col)
+
+    from utils.formatting_utils import build_formatting_requests as build
+    return build(values, sheet_id, start_row, start_col)
@@ -0,0 +1,178 @@
+# core/scheduler.py
+
+import heapq
+import itertools
+import threading
+from datetime import timedelta
+
+from core.time_provider import TimeProvider
+
+# Зарегистрированные планировщики сканеров: имя -> DueScheduler (для внешнего пробуждения)
+_schedulers = {}
+_registry_lock = threading.Lock()
+
+
+class DueScheduler:
+    """
+    Планировщик задач по времени следующего скана: min-heap (next_due, task),
+    next_due = last_scan + current_scan_interval() (адаптивный или шаблонный интервал).
+
+    Сканер спит ровно до ближайшей задачи (или до перезагрузки списка задач из БД),
+    выполняет только наступившие задачи и возвращает их в кучу. wake() будит его досрочно.
+    """
+
+    def __init__(self, name, reload_interval, retry_delay, min_sleep=1.0, max_sleep=600.0):
+        self.name = name
+        self.reload_interval = reload_interval
+        self.retry_delay = retry_delay
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._entries = {}  # key -> (due, seq): актуальная запись задачи в куче
+        self._tasks = {}
+        self._run_requested = set()  # ключи задач, запрошенных к запуску, пока их не было в куче
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._reload_requested = True
+        self._next_reload = None
+
+        with _registry_lock:
+            _schedulers[name] = self
+
+    @staticmethod
+    def task_key(task):
+        return task.id if task.id is not None else (task.name_of_process, task.source_page_name)
+
+    def _due_time(self, task, now):
+        if not task.last_scan:
+            return now
+        return task.last_scan + timedelta(seconds=task.current_scan_interval())
+
+    def _push(self, task, due):
+        key = self.task_key(task)
+        if key in self._run_requested:
+            # Запуск запросили, пока задача выполнялась или ещё не была загружена
+            self._run_requested.discard(key)
+            task.run_requested = True
+            due = min(due, TimeProvider.now())
+        seq = next(self._seq)
+        self._tasks[key] = task
+        self._entries[key] = (due, seq)
+        heapq.heappush(self._heap, (due, seq, key))
+
+    # --- набор задач ---
+
+    def needs_reload(self):
+        with self._lock:
+            now = TimeProvider.now()
+            return self._reload_requested or self._next_reload is None or now >= self._next_reload
+
+    def rebuild(self, tasks):
+        """Заменяет набор задач свежим списком из БД (новые смены, шаблоны, is_active)."""
+        now = TimeProvider.now()
+        with self._lock:
+            self._heap.clear()
+            self._entries.clear()
+            self._tasks.clear()
+            for task in tasks:
+                self._push(task, self._due_time(task, now))
+            # Запросы к задачам, которых нет в свежем списке (неактивны или удалены), не копим
+            self._run_requested.clear()
+            self._reload_requested = False
+            self._next_reload = now + timedelta(seconds=self.reload_interval)
+
+    def pop_due(self):
+        """Снимает с кучи все задачи, время которых наступило."""
+        now = TimeProvider.now()
+        due_tasks = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, seq, key = heapq.heappop(self._heap)
+                if self._entries.get(key) != (due, seq):
+                    continue  # устаревшая запись после reschedule
+                del self._entries[key]
+                due_tasks.append(self._tasks.pop(key))
+        return due_tasks
+
+    def peek(self, task_filter):
+        """Задачи в куче, подходящие под task_filter; из кучи не снимаются."""
+        with self._lock:
+            return [self._tasks[key] for key in self._entries if task_filter(self._tasks[key])]
+
+    def reschedule(self, task):
+        """Возвращает задачу в кучу: после успешного скана — по интервалу, после ошибки — через retry_delay."""
+        now = TimeProvider.now()
+        due = self._due_time(task, now)
+        if due <= now:
+            due = now + timedelta(seconds=self.retry_delay)
+        with self._lock:
+            self._push(task, due)
+
+    # --- ожидание ---
+
+    def seconds_until_next(self):
+        now = TimeProvider.now()
+        with self._lock:
+            candidates = []
+            while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][:2]:
+                heapq.heappop(self._heap)
+            if self._heap:
+                candidates.append((self._heap[0][0] - now).total_seconds())
+            if self._next_reload is not None:
+                candidates.append((self._next_reload - now).total_seconds())
+        if not candidates:
+            return self.min_sleep
+        return min(max(min(candidates), self.min_sleep), self.max_sleep)
+
+    def wait(self):
+        """Спит до ближайшей задачи, перезагрузки или wake(). Возвращает True, если разбудили."""
+        timeout = self.seconds_until_next()
+        woken = self._wake_event.wait(timeout)
+        self._wake_event.clear()
+        return woken
+
+    def wake(self, reload=False, task_filter=None, run_ids=None):
+        """
+        Досрочное пробуждение.
+
+        Args:
+            reload: Перечитать задачи из БД до следующего запуска.
+            task_filter: Функция task -> bool; подходящие задачи в куче становятся готовыми сразу
+                (run_requested — без проверки scan_interval).
+            run_ids: Ключи задач, которых нет в куче (выполняются или ещё не загружены):
+                запрос запуска запоминается и применяется, когда задача вернётся в кучу
+                через rebuild() или reschedule().
+        """
+        with self._lock:
+            if reload:
+                self._reload_requested = True
+            if run_ids:
+                now = TimeProvider.now()
+                for key in run_ids:
+                    if key in self._entries:
+                        self._tasks[key].run_requested = True
+                        self._push(self._tasks[key], now)
+                    else:
+                        self._run_requested.add(key)
+            if task_filter is not None:
+                now = TimeProvider.now()
+                for key in list(self._entries):
+                    task = self._tasks[key]
+                    if task_filter(task):
+                        task.run_requested = True
+                        self._push(task, now)
+        self._wake_event.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def wake_scheduler(name=None, reload=False, task_filter=None, run_ids=None):
+    """Будит планировщик сканера по имени или все зарегистрированные."""
+    with _registry_lock:
+        targets = list(_schedulers.values()) if name is None else [s for n, s in _schedulers.items() if n == name]
+    for scheduler in targets:
+        scheduler.wake(reload=reload, task_filter=task_filter, run_ids=run_ids)
+    return len(targets)
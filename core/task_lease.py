@@ -0,0 +1,112 @@
+# core/task_lease.py
+
+"""
+Аренда задач RotationsInfo/SheetsInfo в Postgres: любое число процессов сканеров
+на любых хостах берут наступившие задачи без двойного сканирования.
+
+Захват — SELECT ... FOR UPDATE SKIP LOCKED по свободным строкам (lease_owner пуст,
+аренда своя или просрочена) и запись lease_owner/lease_expires_at в той же транзакции.
+Строку, которую прямо сейчас захватывает другой воркер, пропускаем, а не ждём.
+Аренда упавшего воркера истекает через TASK_LEASE_SECONDS и забирается автоматически.
+Время аренды — время БД (now()), а не TimeProvider: часы воркеров могут расходиться.
+"""
+
+import os
+import socket
+from datetime import timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import load_only
+
+from core.config import TASK_LEASE_SECONDS, TASK_LEASE_OWNER
+from utils.db_orm import get_model_by_table_name
+from utils.logger import log_info, log_error
+
+WORKER_ID = TASK_LEASE_OWNER or f"{socket.gethostname()}:{os.getpid()}"
+
+# Поля, которые другой воркер мог изменить с момента загрузки задачи в планировщик
+REFRESHED_FIELDS = (
+    "last_scan", "scan_quantity", "scan_failures", "hash",
+    "last_update", "update_quantity", "update_failures",
+    "last_change", "change_interval_ewma", "effective_scan_interval",
+)
+DATETIME_FIELDS = {"last_scan", "last_update", "last_change"}
+
+
+def _refresh_task(task, row):
+    for field in REFRESHED_FIELDS:
+        value = getattr(row, field)
+        setattr(task, field, task._parse_datetime(value) if field in DATETIME_FIELDS else value)
+
+
+def claim_tasks(session, tasks, table_name, log_file=None, lease_seconds=TASK_LEASE_SECONDS):
+    """
+    Берёт в аренду задачи из списка и обновляет их состояние из БД.
+
+    Returns:
+        tuple: (claimed, skipped). skipped — задачи, занятые другим воркером
+            или уже отсканированные им (по свежему last_scan ещё не готовы).
+    """
+    ids = [task.id for task in tasks if task.id is not None]
+    if not ids:
+        return list(tasks), []
+    model = get_model_by_table_name(table_name)
+
+    try:
+        rows = session.query(model).filter(
+            model.id.in_(ids),
+            or_(
+                model.lease_owner.is_(None),
+                model.lease_owner == WORKER_ID,
+                model.lease_expires_at.is_(None),
+                model.lease_expires_at < func.now(),
+            )
+        ).options(
+            load_only(*[getattr(model, field) for field in REFRESHED_FIELDS])
+        ).with_for_update(skip_locked=True).all()
+
+        rows_by_id = {row.id: row for row in rows}
+        claimed, skipped = [], []
+        for task in tasks:
+            row = rows_by_id.get(task.id)
+            if row is None:
+                skipped.append(task)
+                continue
+            _refresh_task(task, row)
+            if task.is_ready_to_scan():
+                claimed.append(task)
+            else:
+                skipped.append(task)
+
+        if claimed:
+            session.query(model).filter(model.id.in_([task.id for task in claimed])).update({
+                "lease_owner": WORKER_ID,
+                "lease_expires_at": func.now() + timedelta(seconds=lease_seconds),
+            }, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        log_error(log_file, "lease", None, "claim_fail", "❌ Ошибка захвата аренды задач", exc=e)
+        return [], list(tasks)
+
+    if skipped:
+        log_info(log_file, "lease", None, "skipped",
+                 f"🔒 Пропущено задач (заняты другим воркером или уже отсканированы): {len(skipped)}")
+    return claimed, skipped
+
+
+def release_tasks(session, tasks, table_name, log_file=None):
+    """Снимает свою аренду; чужую (перехваченную после истечения) не трогает."""
+    ids = [task.id for task in tasks if task.id is not None]
+    if not ids:
+        return
+    model = get_model_by_table_name(table_name)
+    try:
+        session.query(model).filter(
+            model.id.in_(ids),
+            model.lease_owner == WORKER_ID
+        ).update({"lease_owner": None, "lease_expires_at": None}, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        log_error(log_file, "lease", None, "release_fail", "❌ Ошибка снятия аренды задач", exc=e)
@@ -5,11 +5,98 @@ import hashlib
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from core.methods import PROCESSORS
-from core.config import TIMEZONE
+from core.process_pool import process_values
+from core.config import TIMEZONE, ADAPTIVE_EWMA_ALPHA, ADAPTIVE_INTERVAL_FRACTION
 from core.time_provider import TimeProvider
 
 
+# Хэши BLAKE2b хранятся с префиксом; хэш без префикса — старый MD5 той же сериализации
+HASH_PREFIX = "b2:"
+
+
+def iter_values_chunks(values_json):
+    """
+    🔒 Стабильная сериализация по строкам таблицы, без одной большой строки:
+    b"".join(...) == json.dumps(values_json, separators=(",", ":"), ensure_ascii=False).encode()
+    """
+    if not isinstance(values_json, list):
+        yield json.dumps(values_json, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return
+    yield b"["
+    for index, row in enumerate(values_json):
+        if index:
+            yield b","
+        yield json.dumps(row, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    yield b"]"
+
+
+def hash_values(values_json, with_legacy=False, keep_serialized=False):
+    """
+    Потоковый хэш обработанных значений.
+
+    Returns:
+        tuple: (hash, legacy_md5 | None, serialized | None). legacy_md5 — для сравнения
+            с хэшем, сохранённым до перехода на BLAKE2b; serialized — та же сериализация
+            строкой, чтобы не строить её повторно при записи в текстовую колонку.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    legacy = hashlib.md5() if with_legacy else None
+    chunks = [] if keep_serialized else None
+    for chunk in iter_values_chunks(values_json):
+        hasher.update(chunk)
+        if legacy is not None:
+            legacy.update(chunk)
+        if chunks is not None:
+            chunks.append(chunk)
+    return (
+        HASH_PREFIX + hasher.hexdigest(),
+        legacy.hexdigest() if legacy is not None else None,
+        b"".join(chunks).decode("utf-8") if chunks is not None else None,
+    )
+
+
+def compute_values_hash(values_json):
+    """Хэш обработанных значений по стабильной сериализации (общий для Task и пула процессов)."""
+    return hash_values(values_json)[0]
+
+
+def is_legacy_hash(value):
+    return bool(value) and not value.startswith(HASH_PREFIX)
+
+
+_TZ = ZoneInfo(TIMEZONE)
+
+# values_json не выбирался из БД: читается отдельным запросом при первом обращении
+NOT_LOADED = object()
+
+# Колонки RotationsInfo/SheetsInfo, из которых строится задача (без служебного состояния ORM)
+TASK_COLUMNS = (
+    "id", "is_active", "related_month", "name_of_process",
+    "source_table_type", "source_page_name", "source_page_area", "scan_group",
+    "last_scan", "scan_interval", "scan_quantity", "scan_failures", "hash",
+    "process_data_method", "values_json",
+    "target_table_type", "target_page_name", "target_page_area", "update_group",
+    "last_update", "update_quantity", "update_failures",
+    "last_change", "change_interval_ewma", "effective_scan_interval",
+)
+
+
 class Task:
+    # Задачи всех смен живут в планировщике между циклами — без __dict__ на каждую
+    __slots__ = (
+        "id", "is_active", "related_month", "name_of_process",
+        "source_table_type", "source_page_name", "source_page_area", "scan_group",
+        "last_scan", "scan_interval", "scan_quantity", "scan_failures", "hash",
+        "process_data_method", "_values_json", "_values_json_raw",
+        "target_table_type", "target_page_name", "target_page_area", "update_group",
+        "last_update", "update_quantity", "update_failures",
+        "last_change", "change_interval_ewma", "effective_scan_interval",
+        "scan_interval_min", "scan_interval_max", "run_requested",
+        "source_table", "target_table", "source_doc_id", "target_doc_id",
+        "raw_values_json", "_values_hash", "serialized_values", "hash_upgraded",
+        "scanned", "proceed", "changed", "uploaded",
+    )
+
     def __init__(self, data):
         self.id = data.get("id")
         self.is_active = data.get("is_active", 1)
@@ -26,15 +113,14 @@ class Task:
         self.hash = data.get("hash")
         self.process_data_method = data.get("process_data_method", "process_default")
 
-        # 🔽 Блок для безопасного чтения values_json из базы
-        raw_values = data.get("values_json")
-        if isinstance(raw_values, str):
-            try:
-                self.values_json = json.loads(raw_values)
-            except json.JSONDecodeError:
-                self.values_json = None  # или [] если нужно по умолчанию
+        # 🔽 values_json из базы: строка (или невыбранная колонка) разбирается при первом обращении
+        raw_values = data.get("values_json", NOT_LOADED)
+        if isinstance(raw_values, str) or raw_values is NOT_LOADED:
+            self._values_json = None
+            self._values_json_raw = raw_values
         else:
-            self.values_json = raw_values
+            self._values_json = raw_values
+            self._values_json_raw = None
 
         self.target_table_type = data.get("target_table_type")
         self.target_page_name = data.get("target_page_name")
@@ -44,6 +130,15 @@ class Task:
         self.update_quantity = data.get("update_quantity", 0)
         self.update_failures = data.get("update_failures", 0)
 
+        # Адаптивный интервал сканирования (границы задаются шаблоном, см. set_interval_bounds)
+        self.last_change = self._parse_datetime(data.get("last_change"))
+        self.change_interval_ewma = data.get("change_interval_ewma")
+        self.effective_scan_interval = data.get("effective_scan_interval")
+        self.scan_interval_min = None
+        self.scan_interval_max = None
+        # Внеочередной запуск (кнопка «Run» в боте, core/task_notify.py)
+        self.run_requested = False
+
         # Эти поля будут заполняться в сканере
         self.source_table = None # база данных, откуда берем данные
         self.target_table = None # база данных, откуда берем данные
@@ -51,29 +146,128 @@ class Task:
         self.source_doc_id = None
         self.target_doc_id = None
         self.raw_values_json = None  # Данные из сканирования
+        self._values_hash = None  # (values_json, hash), посчитанный вместе с обработкой
+        self.serialized_values = None  # values_json строкой после хэширования (для текстовой колонки)
+        self.hash_upgraded = 0  # Флаг, что старый MD5 заменён на BLAKE2b без изменения данных
 
         self.scanned = 0  # Флаг, что задача была просканирована
         self.proceed = 0  # Флаг, что задача была обработана
         self.changed = 0  # Флаг, что задача была изменена
         self.uploaded = 0  # Флаг, что задача была выгружена
 
+    @classmethod
+    def from_row(cls, row, source_table=None):
+        """Задача из строки RotationsInfo/SheetsInfo: только колонки TASK_COLUMNS, которые есть в строке."""
+        task = cls({column: getattr(row, column) for column in TASK_COLUMNS if hasattr(row, column)})
+        task.source_table = source_table
+        return task
+
+    @property
+    def values_json(self):
+        # Большинство задач цикла не наступили, и их сохранённые значения не читаются
+        raw = self._values_json_raw
+        if raw is NOT_LOADED:
+            raw = self._fetch_stored_values()
+            if not isinstance(raw, str):
+                self._values_json = raw
+                self._values_json_raw = None
+                return raw
+        if raw is not None:
+            try:
+                self._values_json = json.loads(raw)
+            except json.JSONDecodeError:
+                self._values_json = None  # или [] если нужно по умолчанию
+            self._values_json_raw = None
+        return self._values_json
+
+    def _fetch_stored_values(self):
+        if self.id is None or not self.source_table:
+            return None
+        from utils.db_orm import fetch_task_values_json
+        return fetch_task_values_json(self.id, self.source_table)
+
+    @values_json.setter
+    def values_json(self, value):
+        self._values_json = value
+        self._values_json_raw = None
+
+    def set_stored_values(self, raw):
+        """values_json в том виде, в каком он лежит в БД (строка разбирается при первом обращении)."""
+        if isinstance(raw, str):
+            self._values_json = None
+            self._values_json_raw = raw
+        else:
+            self._values_json = raw
+            self._values_json_raw = None
+
     def _parse_datetime(self, value):
         if not value:
             return None
         if isinstance(value, datetime):
-            return value.replace(tzinfo=ZoneInfo(TIMEZONE)) if value.tzinfo is None else value
+            return value.replace(tzinfo=_TZ) if value.tzinfo is None else value
         try:
             dt = datetime.fromisoformat(value)
-            return dt.replace(tzinfo=ZoneInfo(TIMEZONE)) if dt.tzinfo is None else dt
+            return dt.replace(tzinfo=_TZ) if dt.tzinfo is None else dt
         except Exception:
             return None
 
+    def current_scan_interval(self):
+        """Действующий интервал: адаптивный, если у шаблона есть границы и он посчитан, иначе scan_interval."""
+        if self.is_adaptive() and self.effective_scan_interval:
+            return self.effective_scan_interval
+        return self.scan_interval
+
     def is_ready_to_scan(self):
-        if not self.last_scan:
+        if self.run_requested or not self.last_scan:
             return True
-        next_scan_time = self.last_scan + timedelta(seconds=self.scan_interval)
+        next_scan_time = self.last_scan + timedelta(seconds=self.current_scan_interval())
         return TimeProvider.now() >= next_scan_time
 
+    def set_interval_bounds(self, scan_interval_min=None, scan_interval_max=None):
+        self.scan_interval_min = scan_interval_min
+        self.scan_interval_max = scan_interval_max
+        if self.effective_scan_interval and self.is_adaptive():
+            lo, hi = self._interval_bounds()
+            self.effective_scan_interval = min(max(self.effective_scan_interval, lo), hi)
+
+    def is_adaptive(self):
+        return bool(self.scan_interval_min or self.scan_interval_max)
+
+    def _interval_bounds(self):
+        lo = self.scan_interval_min or self.scan_interval
+        hi = self.scan_interval_max or self.scan_interval
+        return min(lo, hi), max(lo, hi)
+
+    def adapt_scan_interval(self):
+        """
+        Подстраивает интервал по истории изменений hash: EWMA промежутка между изменениями,
+        опрос примерно ADAPTIVE_INTERVAL_FRACTION этого промежутка в границах шаблона.
+        После изменения — сразу минимальный интервал (частый опрос).
+        """
+        if not self.is_adaptive() or not self.proceed:
+            return
+        now = TimeProvider.now()
+        lo, hi = self._interval_bounds()
+
+        if self.changed:
+            if self.last_change:
+                gap = (now - self.last_change).total_seconds()
+                if self.change_interval_ewma is None:
+                    self.change_interval_ewma = gap
+                else:
+                    self.change_interval_ewma = ADAPTIVE_EWMA_ALPHA * gap + (1 - ADAPTIVE_EWMA_ALPHA) * self.change_interval_ewma
+            self.last_change = now
+            self.effective_scan_interval = lo
+            return
+
+        # Без изменений: ожидаемый промежуток не меньше уже прошедшего с последнего изменения
+        quiet = (now - self.last_change).total_seconds() if self.last_change else 0
+        expected = max(self.change_interval_ewma or 0, quiet)
+        target = min(max(int(expected * ADAPTIVE_INTERVAL_FRACTION), lo), hi)
+        # Растягиваем плавно — не больше чем вдвое за скан
+        current = self.effective_scan_interval or lo
+        self.effective_scan_interval = min(target, current * 2) if target > current else target
+
     def assign_doc_ids(self, doc_id_map, log_file=None):
         from utils.logger import log_warning
         self.source_doc_id = None
@@ -107,9 +301,8 @@ class Task:
             return
 
         method_name = self.process_data_method or "process_default"
-        process_func = PROCESSORS.get(method_name)
 
-        if not process_func:
+        if method_name not in PROCESSORS:
             error_msg = f"❌ Неизвестный метод обработки: {method_name}"
             if log_file:
                 from utils.logger import log_error
@@ -117,8 +310,8 @@ class Task:
             raise ValueError(error_msg)
 
         try:
-            processed_values = process_func(self.raw_values_json, self.source_page_area)
-            self.values_json = processed_values
+            processed_values, values_hash = process_values(method_name, self.raw_values_json, self.source_page_area)
+            self.set_processed_values(processed_values, values_hash)
         except Exception as e:
             import traceback
             if log_file:
@@ -133,6 +326,23 @@ class Task:
                 )
             raise ValueError(f"❌ Ошибка при вызове {method_name}: {e}\n{traceback.format_exc()}")
             
+    def reset_run_state(self):
+        """Сброс флагов прогона: задача живёт в планировщике между запусками."""
+        self.raw_values_json = None
+        self._values_hash = None
+        self.serialized_values = None
+        self.hash_upgraded = 0
+        self.scanned = 0
+        self.proceed = 0
+        self.changed = 0
+        self.uploaded = 0
+
+    def set_processed_values(self, values, values_hash=None):
+        """values_json после обработки; values_hash — хэш, уже посчитанный в пуле процессов."""
+        self.values_json = values
+        self._values_hash = (values, values_hash) if values_hash else None
+        self.serialized_values = None
+
     def update_after_scan(self, success: bool):
         if success:
             self.last_scan = TimeProvider.now()
@@ -149,18 +359,29 @@ class Task:
             self.changed = 0
             return
 
+        legacy = is_legacy_hash(self.hash)
+        legacy_hash = None
         try:
-            # 🔒 Стабильная сериализация
-            serialized = json.dumps(self.values_json, separators=(",", ":"), ensure_ascii=False)
-            processed = serialized.encode("utf-8")
-            new_hash = hashlib.md5(processed).hexdigest()
+            if not legacy and self._values_hash and self._values_hash[0] is self.values_json:
+                new_hash = self._values_hash[1]
+            else:
+                # Текст сериализации нужен только для RotationsInfo (values_json — Text), JSONB кодирует драйвер
+                new_hash, legacy_hash, self.serialized_values = hash_values(
+                    self.values_json, with_legacy=legacy, keep_serialized=self.source_table == "RotationsInfo"
+                )
         except Exception:
             # Если что-то пошло не так — безопасно пропустить
             self.proceed = 0
             self.changed = 0
             return
 
-        if new_hash != self.hash:
+        if legacy and legacy_hash == self.hash:
+            # Данные те же, сохранён старый MD5 — только переводим хэш на BLAKE2b
+            self.hash = new_hash
+            self.hash_upgraded = 1
+            self.proceed = 1
+            self.changed = 0
+        elif new_hash != self.hash:
             self.hash = new_hash
             self.proceed = 1
             self.changed = 1
@@ -168,6 +389,12 @@ class Task:
             self.proceed = 1
             self.changed = 0
 
+        if not self.changed:
+            # Текст нужен только для записи изменённых данных — не держим его в планировщике
+            self.serialized_values = None
+
+        self.adapt_scan_interval()
+
     def update_after_upload(self, success: bool):
         self.last_update = datetime.utcnow()
         self.update_quantity = (self.update_quantity or 0) + 1
@@ -0,0 +1,116 @@
+# core/task_notify.py
+
+"""
+Внеочередной запуск задачи через Postgres LISTEN/NOTIFY.
+
+Бот (кнопка «🔄Run») делает pg_notify(TASK_RUN_CHANNEL, {"table": ..., "id": ...}).
+Поток TaskRunListener в процессе сканеров слушает канал и будит планировщик нужного
+сканера: задача помечается run_requested и выполняется сразу — scan/process/update
+без ожидания scan_interval. NOTIFY получают все процессы сканеров; выполнит задачу
+тот, кто первым возьмёт её аренду (core/task_lease.py).
+"""
+
+import json
+import select
+import threading
+
+from sqlalchemy import text
+
+from core.config import TASK_RUN_CHANNEL, MAIN_LOG
+from core.scheduler import wake_scheduler
+from utils.logger import log_info, log_warning, log_error
+
+# Таблица задачи -> имя планировщика сканера (DueScheduler)
+SCHEDULER_BY_TABLE = {
+    "RotationsInfo": "rotations_scanner",
+    "SheetsInfo": "sheets_scanner",
+}
+
+
+def notify_task_run(session, table_name, task_id):
+    """Отправляет запрос на немедленный запуск задачи (доставляется после commit)."""
+    if table_name not in SCHEDULER_BY_TABLE:
+        raise ValueError(f"Неизвестная таблица задач: {table_name}")
+    payload = json.dumps({"table": table_name, "id": int(task_id)})
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": TASK_RUN_CHANNEL, "payload": payload})
+    session.commit()
+
+
+def dispatch_task_run(payload, log_file=MAIN_LOG):
+    """Будит планировщик сканера под задачу из payload. Returns: True, если задача найдена в планировщике."""
+    try:
+        request = json.loads(payload)
+        table_name, task_id = request["table"], int(request["id"])
+        scheduler_name = SCHEDULER_BY_TABLE[table_name]
+    except (ValueError, KeyError, TypeError) as e:
+        log_warning(log_file, "task_run", None, "bad_payload", f"⚠️ Некорректный запрос запуска: {payload!r} ({e})")
+        return False
+
+    matched = []
+
+    def task_filter(task):
+        if task.id == task_id:
+            matched.append(task)
+            return True
+        return False
+
+    wake_scheduler(scheduler_name, task_filter=task_filter)
+    if matched:
+        log_info(log_file, "task_run", matched[0].name_of_process, "wake",
+                 f"⚡ Внеочередной запуск {table_name}#{task_id}")
+        return True
+
+    # Задачи нет в куче: выполняется прямо сейчас или ещё не загружена — запоминаем запрос
+    # и перечитываем задачи; запуск применится, когда задача вернётся в кучу
+    wake_scheduler(scheduler_name, reload=True, run_ids=[task_id])
+    log_info(log_file, "task_run", None, "reload",
+             f"🔄 {table_name}#{task_id} нет в планировщике — запуск отложен до перечитывания задач")
+    return False
+
+
+class TaskRunListener(threading.Thread):
+    """Поток LISTEN на отдельном соединении psycopg2; при обрыве переподключается."""
+
+    def __init__(self, engine, stop_event, log_file=MAIN_LOG, poll_timeout=1.0, reconnect_delay=5.0):
+        super().__init__(name="task-run-listener", daemon=True)
+        self.engine = engine
+        self.stop_event = stop_event
+        self.log_file = log_file
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+
+    def _connect(self):
+        raw = self.engine.raw_connection()
+        # Соединение живёт всё время работы — не держим его в пуле
+        raw.detach()
+        conn = getattr(raw, "driver_connection", None) or raw.connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{TASK_RUN_CHANNEL}"')
+        return conn
+
+    def _listen(self, conn):
+        while not self.stop_event.is_set():
+            if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                dispatch_task_run(notify.payload, self.log_file)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                log_info(self.log_file, "task_run", None, "listen", f"👂 LISTEN {TASK_RUN_CHANNEL}")
+                self._listen(conn)
+            except Exception as e:
+                log_error(self.log_file, "task_run", None, "listen_fail", "❌ Ошибка LISTEN, переподключение", exc=e)
+                self.stop_event.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
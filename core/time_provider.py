@@ -19,6 +19,24 @@ class _ThreadLocalTimeProvider:
     def now(self):
         return getattr(self._local, 'now', datetime.now(self.timezone()))
 
+    def override(self):
+        """Фиксированное время текущего потока или None — для передачи в рабочие потоки."""
+        return getattr(self._local, 'now', None)
+
+    def bind(self, func):
+        """Оборачивает func для рабочего потока: внутри действует время вызывающего потока."""
+        frozen = self.override()
+        if frozen is None:
+            return func
+
+        def wrapper(*args, **kwargs):
+            self.set_time(frozen)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.reset()
+        return wrapper
+
     def reset(self):
         if hasattr(self._local, 'now'):
             del self._local.now
@@ -1,7 +1,7 @@
 # ✅ Обновлённый файл db_models.py
 
 from sqlalchemy import (
-    Column, Integer, String, Text, Boolean, Date, Time, DateTime,
+    Column, Integer, String, Text, Boolean, Date, Time, DateTime, Float,
     UniqueConstraint, Enum, BigInteger, ForeignKey, Index
 )
 import enum
@@ -298,6 +298,9 @@ class TaskTemplate(Base):
     source_page_area = Column(String)
     scan_group = Column(String)
     scan_interval = Column(Integer)
+    # Границы адаптивного интервала сканирования (NULL — интервал фиксированный)
+    scan_interval_min = Column(Integer)
+    scan_interval_max = Column(Integer)
     process_data_method = Column(String)
     target_table_type = Column(String)
     target_page_name = Column(String)
@@ -337,6 +340,13 @@ class RotationsInfo(Base):
     last_update = Column(DateTime(timezone=True))
     update_quantity = Column(Integer)
     update_failures = Column(Integer)
+    # Адаптивный интервал: последнее изменение hash, EWMA промежутка между изменениями (сек.)
+    last_change = Column(DateTime(timezone=True))
+    change_interval_ewma = Column(Float)
+    effective_scan_interval = Column(Integer)
+    # Аренда задачи воркером сканера (core/task_lease.py)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
 
     __table_args__ = (
         UniqueConstraint("related_month", "name_of_process", "source_page_name", name="uq_rotations_month_name_page"),
@@ -368,7 +378,33 @@ class SheetsInfo(Base):
     last_update = Column(DateTime(timezone=True))
     update_quantity = Column(Integer)
     update_failures = Column(Integer)
+    # Адаптивный интервал: последнее изменение hash, EWMA промежутка между изменениями (сек.)
+    last_change = Column(DateTime(timezone=True))
+    change_interval_ewma = Column(Float)
+    effective_scan_interval = Column(Integer)
+    # Аренда задачи воркером сканера (core/task_lease.py)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
 
     __table_args__ = (
         UniqueConstraint("related_month", "name_of_process", name="uq_sheets_month_name"),
     )
+
+
+class WrittenRange(Base):
+    """Последняя успешная запись в диапазон Google Sheets (общая для всех воркеров сканеров)."""
+    __tablename__ = 'WrittenRanges'
+
+    spreadsheet_id = Column(Text, primary_key=True)
+    sheet_name = Column(Text, primary_key=True)
+    start_row = Column(Integer, primary_key=True)
+    start_col = Column(Integer, primary_key=True)
+    # Размер записанных данных: до него дополняется следующая запись вместо batchClear
+    rows = Column(Integer)
+    cols = Column(Integer)
+    # Хэш записанных данных: по нему воркер проверяет, что его копия в памяти не устарела
+    hash = Column(String)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Последняя полная запись: diff_only пишет диапазон целиком не реже GRID_DIFF_FULL_WRITE_INTERVAL,
+    # чтобы ручные правки на листе не жили вечно
+    full_written_at = Column(DateTime(timezone=True))
@@ -0,0 +1,231 @@
+# scanners/fetch_planner.py
+
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+
+from core.config import (
+    MAX_RANGES_PER_BATCH_GET,
+    MAX_BATCH_GET_URL_CHARS,
+    SCAN_FETCH_WORKERS,
+    WINDOWED_FETCH_ROWS,
+    WINDOWED_FETCH_WORKERS,
+)
+from core.methods import STREAMING_PROCESSORS
+from core.time_provider import TimeProvider
+from utils.credential_pool import token_names
+from utils.rate_limiter import rate_limiter
+from utils.logger import log_info, log_success, log_warning, log_error
+from utils.utils import check_sheet_exists, batch_get, iter_range_rows
+from utils.a1_notation import parse_range, sheet_range
+
+# Статусы задачи после выполнения плана
+FETCH_OK = "ok"
+FETCH_SHEET_MISSING = "sheet_missing"
+FETCH_NOT_FOUND = "not_found"
+FETCH_FAILED = "failed"
+
+# Значения, прочитанные заранее одним планом (ретро-прогон: вкладки всех дат месяца);
+# у каждого потока свои — как часы TimeProvider
+_prefetched = threading.local()
+
+
+def build_fetch_plan(tasks):
+    """Группирует задачи по документу и диапазону: doc_id -> {range_str: [tasks]}."""
+    plan = defaultdict(lambda: defaultdict(list))
+    for task in tasks:
+        range_str = sheet_range(task.source_page_name, task.source_page_area)
+        plan[task.source_doc_id][range_str].append(task)
+    return plan
+
+
+def split_ranges(ranges, max_ranges=MAX_RANGES_PER_BATCH_GET, max_chars=MAX_BATCH_GET_URL_CHARS):
+    """Делит диапазоны на порции под ограничения batchGet (число диапазонов и длина URL)."""
+    chunks = []
+    current, current_len = [], 0
+    for range_str in ranges:
+        # ranges=<range>& — с запасом на URL-кодирование
+        size = len(range_str) * 3 + 8
+        if current and (len(current) >= max_ranges or current_len + size > max_chars):
+            chunks.append(current)
+            current, current_len = [], 0
+        current.append(range_str)
+        current_len += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _is_streamed(range_str, range_tasks):
+    """
+    Открытый по строкам диапазон одной задачи с потоковым обработчиком
+    читается окнами и отдаётся обработчику генератором.
+    """
+    if not WINDOWED_FETCH_ROWS or len(range_tasks) != 1:
+        return False
+    if range_tasks[0].process_data_method not in STREAMING_PROCESSORS:
+        return False
+    try:
+        return parse_range(range_str).end_row is None
+    except ValueError:
+        return False
+
+
+def _fetch_streamed(service, doc_id, range_str, task, log_file, token_name, phase):
+    """Читает первое окно сразу (пустой диапазон / ошибка видны в scan_phase), остальное — лениво."""
+    rows = iter_range_rows(service, doc_id, range_str, task.scan_group, log_file, token_name,
+                           WINDOWED_FETCH_ROWS, WINDOWED_FETCH_WORKERS)
+    try:
+        first_row = next(rows, None)
+    except Exception as e:
+        log_warning(log_file, phase, task.name_of_process, "windowed_fail", f"⚠️ Не удалось прочитать {range_str} окнами: {e}")
+        return task, FETCH_FAILED, None
+    if first_row is None:
+        return task, FETCH_NOT_FOUND, None
+    return task, FETCH_OK, chain([first_row], rows)
+
+
+def _fetch_document(service, doc_id, range_map, log_file, token_name, phase):
+    """Один документ: проверка листов, batchGet по порциям и раскладка ответа по задачам."""
+    results = []
+    doc_tasks = [task for range_tasks in range_map.values() for task in range_tasks]
+    log_info(log_file, phase, None, "doc", f"🗂️ Документ {doc_tasks[0].source_table_type}: {len(doc_tasks)} задач, {len(range_map)} диапазонов")
+
+    # ✅ Проверка наличия листов (метаданные документа берутся из кэша)
+    unique_sheet_names = set(task.source_page_name for task in doc_tasks)
+    exists_map = {
+        sheet_name: check_sheet_exists(service, doc_id, sheet_name, log_file, token_name)
+        for sheet_name in unique_sheet_names
+    }
+    for sheet_name, exists in exists_map.items():
+        log_info(log_file, phase, None, "sheet_exists", f"Лист '{sheet_name}' {'существует' if exists else 'не найден'}")
+
+    valid_ranges = {}
+    for range_str, range_tasks in range_map.items():
+        if not exists_map.get(range_tasks[0].source_page_name):
+            results.extend((task, FETCH_SHEET_MISSING, None) for task in range_tasks)
+        elif _is_streamed(range_str, range_tasks):
+            results.append(_fetch_streamed(service, doc_id, range_str, range_tasks[0], log_file, token_name, phase))
+        else:
+            valid_ranges[range_str] = range_tasks
+
+    if not valid_ranges:
+        log_info(log_file, phase, None, "empty", "Все задачи документа отфильтрованы. Пропуск batchGet.")
+        return results
+
+    for chunk in split_ranges(list(valid_ranges)):
+        chunk_tasks = [task for range_str in chunk for task in valid_ranges[range_str]]
+        log_info(log_file, phase, None, "batch_get", f"Отправка batchGet на документ {chunk_tasks[0].source_table_type} с {len(chunk)} диапазонами")
+
+        # Ответ по запрошенным диапазонам (valueRanges идут в порядке запроса): диапазоны
+        # с общим левым верхним углом (A1:Z и A1:C) не путаются
+        response_data = batch_get(service, doc_id, chunk, chunk_tasks[0].scan_group, log_file, token_name, by_request=True)
+        if not response_data:
+            log_warning(log_file, phase, None, "empty", "Пустой ответ от batchGet. Все задачи порции будут отмечены как неудачные.")
+            results.extend((task, FETCH_FAILED, None) for task in chunk_tasks)
+            continue
+
+        for range_str in chunk:
+            values = response_data.get(range_str)
+            for task in valid_ranges[range_str]:
+                if values:
+                    results.append((task, FETCH_OK, values))
+                else:
+                    results.append((task, FETCH_NOT_FOUND, None))
+
+    return results
+
+
+def _worker_count(service, token_name, doc_count, max_workers):
+    """Размер пула: не больше документов и не больше запросов, доступных токенам без ожидания."""
+    available = rate_limiter.available(token_names(service, token_name))
+    return max(1, min(max_workers, doc_count, available))
+
+
+def _fetch_key(task):
+    return task.source_doc_id, sheet_range(task.source_page_name, task.source_page_area)
+
+
+def prefetch_values(service, tasks, log_file, token_name, phase="prefetch"):
+    """
+    Читает значения задач одним планом для последующих fetch_tasks_values под use_prefetched.
+
+    Returns:
+        dict: {(doc_id, range_str): (status, values)}. Ошибки и потоковые (оконные)
+            значения не сохраняются — такие диапазоны перечитываются при скане.
+    """
+    cache = {}
+    for task, status, values in fetch_tasks_values(service, tasks, log_file, token_name, phase):
+        if status != FETCH_FAILED and (values is None or isinstance(values, list)):
+            cache[_fetch_key(task)] = (status, values)
+    return cache
+
+
+@contextmanager
+def use_prefetched(cache):
+    """fetch_tasks_values в этом потоке берёт диапазоны из cache и читает из API только остальные."""
+    _prefetched.cache = cache
+    try:
+        yield
+    finally:
+        _prefetched.cache = None
+
+
+def _take_prefetched(tasks):
+    cache = getattr(_prefetched, "cache", None)
+    if not cache:
+        return [], list(tasks)
+    results, pending = [], []
+    for task in tasks:
+        hit = cache.get(_fetch_key(task))
+        if hit is None:
+            pending.append(task)
+        else:
+            status, values = hit
+            # Одни значения раздаются задачам нескольких слотов: обработка не должна менять общий список
+            results.append((task, status, [list(row) for row in values] if values else values))
+    return results, pending
+
+
+def fetch_tasks_values(service, tasks, log_file, token_name, phase="scan_phase", max_workers=SCAN_FETCH_WORKERS):
+    """
+    Выполняет один batchGet на документ (с делением только по лимитам API)
+    для всех переданных задач и раскладывает ответ по задачам.
+    Документы читаются параллельно ограниченным пулом потоков.
+    Под use_prefetched уже прочитанные диапазоны берутся из кэша.
+
+    Returns:
+        list: [(task, status, values)]: сначала взятые из кэша, дальше в порядке обхода документов.
+    """
+    cached_results, tasks = _take_prefetched(tasks)
+    if cached_results:
+        log_info(log_file, phase, None, "prefetched", f"📦 Из заранее прочитанных: {len(cached_results)} диапазонов")
+        if not tasks:
+            return cached_results
+    plan = build_fetch_plan(tasks)
+    workers = _worker_count(service, token_name, len(plan), max_workers)
+
+    # Рабочий поток видит то же время, что и сканер (ретро-прогоны)
+    @TimeProvider.bind
+    def fetch(item):
+        doc_id, range_map = item
+        try:
+            return _fetch_document(service, doc_id, range_map, log_file, token_name, phase)
+        except Exception as e:
+            log_error(log_file, phase, None, "doc_fail", f"❌ Ошибка чтения документа {doc_id}", exc=e)
+            return [(task, FETCH_FAILED, None) for range_tasks in range_map.values() for task in range_tasks]
+
+    if workers == 1:
+        doc_results = [fetch(item) for item in plan.items()]
+    else:
+        log_info(log_file, phase, None, "parallel", f"🧵 Чтение {len(plan)} документов в {workers} потоков")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-fetch") as executor:
+            # map сохраняет порядок документов — результаты сливаются до process_phase
+            doc_results = list(executor.map(fetch, plan.items()))
+
+    results = [result for doc_result in doc_results for result in doc_result]
+    ok_count = sum(1 for _, status, _ in results if status == FETCH_OK)
+    log_success(log_file, phase, None, "fetched", f"📥 Получено {ok_count} из {len(tasks)} диапазонов, документов: {len(plan)}")
+    return cached_results + results
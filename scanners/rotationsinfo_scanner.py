@@ -8,23 +8,33 @@ from core.data import load_rotationsinfo_tasks
 from utils.logger import (
     log_info, log_success, log_warning, log_error, log_section, log_separator
 )
-from utils.formatting_utils import format_sheet
+from utils.formatting_utils import format_sheet, retry_deferred_formats
 from database.session import get_session
 from database.db_models import RotationsInfo
+from utils.a1_notation import format_range, sheet_range, col_to_index
+from .fetch_planner import fetch_tasks_values, FETCH_OK, FETCH_SHEET_MISSING, FETCH_NOT_FOUND
 
 from core.config import (
     ROTATIONSINFO_LOG,
     ROTATIONSINFO_INTERVAL,
+    SCHEDULER_RELOAD_INTERVAL,
+    TASK_LEASING,
     ROTATION_ORDER
 )
 from utils.db_orm import (
     update_task_scan_fields,
     update_task_process_fields,
-    update_task_update_fields
+    update_task_hash_field,
+    update_task_schedule_fields,
+    update_task_update_fields,
+    fetch_tasks_values_json,
+    TaskWriteBuffer
 )
+from utils.credential_pool import CredentialPool
+from core.scheduler import DueScheduler
+from core.task_lease import claim_tasks, release_tasks
+from core.process_pool import process_values
 from utils.utils import (
-    load_credentials,
-    check_sheet_exists,
     batch_get,
     batch_update,
 )
@@ -35,41 +45,24 @@ class RotationsInfoScanner:
         self.token_map = token_map
         self.log_file = log_file if log_file else (ROTATIONSINFO_LOG if ROTATIONSINFO_LOG else "logs/scanner_rotationsinfo.log")
         self.tasks = []
+        self.service = None
 
     def run(self):
+        # Интервал сканера теперь — пауза перед повтором неудачной задачи
+        self.scheduler = DueScheduler("rotations_scanner", SCHEDULER_RELOAD_INTERVAL, max(ROTATIONSINFO_INTERVAL, 3))
         while True:
             if not is_scanner_enabled("rotations_scanner"):
                 time.sleep(10)
                 continue
             try:
-                log_separator(self.log_file, "run")
-                log_section(self.log_file, "run", "▶️ RotationsInfo Активен. Новый цикл сканирования\n")
+                if self.scheduler.needs_reload():
+                    self.reload_schedule()
 
-                token_name = list(self.token_map.keys())[0]
-                token_path = self.token_map[token_name]
-                self.token_name = token_name
-
-                with get_session() as session:
-                    self.service = load_credentials(token_path, self.log_file)
-                    log_info(self.log_file, "run", None, "token", f"Используется токен: {self.token_name}")
-
-                    from core.data import return_tracked_tables
-                    self.doc_id_map = return_tracked_tables(session)
-                    
-                    for phase_name, method in [
-                        ("load_tasks", lambda: self.load_tasks(session)),
-                        ("scan_phase", lambda: self.scan_phase(session)),
-                        ("process_phase", lambda: self.process_phase(session)),
-                        ("update_phase", lambda: self.update_phase(session)),
-                    ]:
-                        log_separator(self.log_file, phase_name)
-                        try:
-                            log_info(self.log_file, phase_name, None, "start", f"Старт этапа {phase_name}")
-                            method()
-                            log_success(self.log_file, phase_name, None, "finish", f"Этап {phase_name} завершён\n")
-                        except Exception as e:
-                            log_error(self.log_file, phase_name, None, "fail", "Ошибка на этапе", exc=e)
-                            raise
+                due_tasks = self.scheduler.pop_due()
+                if due_tasks:
+                    log_separator(self.log_file, "run")
+                    log_section(self.log_file, "run", f"▶️ RotationsInfo Активен. Готовых задач: {len(due_tasks)}\n")
+                    self.run_tasks(due_tasks)
 
             except Exception as e:
                 log_error(self.log_file, "run", None, "fail", "Критическая ошибка в основном цикле", exc=e)
@@ -78,9 +71,89 @@ class RotationsInfoScanner:
                 time.sleep(interval)
                 break
 
-            # Гарантированная задержка между циклами (не менее 3 секунд)
-            interval = max(ROTATIONSINFO_INTERVAL, 3)
-            time.sleep(interval)
+            self.scheduler.wait()
+
+    def reload_schedule(self):
+        """Пул токенов (при первом вызове), doc_id_map и активные задачи текущих смен -> куча планировщика."""
+        if self.service is None:
+            # Пул создаётся один раз: паузы токенов после 429 переживают перезагрузку задач
+            self.service = CredentialPool(self.token_map, self.log_file)
+            self.token_name = "+".join(self.service.names)
+            log_info(self.log_file, "run", None, "token", f"Используются токены: {self.token_name}")
+
+        with get_session() as session:
+            from core.data import return_tracked_tables
+            self.doc_id_map = return_tracked_tables(session)
+            self.load_tasks(session)
+        self.scheduler.rebuild(self.tasks)
+        log_info(self.log_file, "run", None, "schedule", f"🗓️ Задач в планировщике: {len(self.scheduler)}, ближайшая через {self.scheduler.seconds_until_next():.0f} сек.")
+
+    def run_tasks(self, tasks):
+        """Прогоняет готовые задачи через фазы и возвращает их в планировщик."""
+        skipped = []
+        if TASK_LEASING:
+            with get_session() as session:
+                tasks, skipped = claim_tasks(session, tasks, RotationsInfo.__tablename__, self.log_file)
+        for task in tasks:
+            task.reset_run_state()
+        self.tasks = tasks
+
+        try:
+            if not tasks:
+                return
+            with get_session() as session:
+                # Страница пересобирается целиком: нужны все её задачи, а не только наступившие
+                self.tasks = tasks + self.page_companions(tasks, session)
+                for phase_name, method in [
+                    ("scan_phase", lambda: self.scan_phase(session)),
+                    ("process_phase", lambda: self.process_phase(session)),
+                    ("update_phase", lambda: self.update_phase(session)),
+                ]:
+                    log_separator(self.log_file, phase_name)
+                    try:
+                        log_info(self.log_file, phase_name, None, "start", f"Старт этапа {phase_name}")
+                        with TaskWriteBuffer(session, self.log_file):
+                            method()
+                        log_success(self.log_file, phase_name, None, "finish", f"Этап {phase_name} завершён\n")
+                    except Exception as e:
+                        log_error(self.log_file, phase_name, None, "fail", "Ошибка на этапе", exc=e)
+                        raise
+        finally:
+            if TASK_LEASING and tasks:
+                with get_session() as session:
+                    release_tasks(session, tasks, RotationsInfo.__tablename__, self.log_file)
+            for task in tasks:
+                task.run_requested = False
+            for task in tasks + skipped:
+                self.scheduler.reschedule(task)
+
+    def page_companions(self, tasks, session):
+        """
+        Ненаступившие задачи из планировщика с тех же страниц update_main и из тех же shuffle-групп.
+
+        Они не сканируются (не готовы), но участвуют в update_phase своими значениями из БД —
+        иначе import_main_data сотрёт строки остальных ротаций, а shuffle посчитает сдвиги без них.
+        """
+        main_pages = {task.target_page_name for task in tasks if task.update_group == "update_main"}
+        shuffle_groups = {task.update_group for task in tasks if "shuffle" in task.update_group}
+        if not main_pages and not shuffle_groups:
+            return []
+
+        def same_page(task):
+            if task.update_group == "update_main":
+                return task.target_page_name in main_pages
+            return task.update_group in shuffle_groups
+
+        companions = self.scheduler.peek(same_page)
+        # Значения могли обновить другие воркеры: читаем свежие одним запросом
+        stored = fetch_tasks_values_json(session, [task.id for task in companions], RotationsInfo.__tablename__)
+        for task in companions:
+            task.reset_run_state()
+            task.set_stored_values(stored.get(task.id))
+        if companions:
+            log_info(self.log_file, "run", None, "companions",
+                     f"📄 Задач с тех же страниц (без сканирования): {len(companions)}")
+        return companions
 
 #############################################################################################
 # загрузка задач из БД
@@ -124,79 +197,27 @@ class RotationsInfoScanner:
         if not ready_tasks:
             log_info(self.log_file, phase, None, "empty", "Нет задач, готовых к сканированию")
             return
-        scan_groups = defaultdict(list)
+        mapped_tasks = []
         for task in ready_tasks:
             if not task.assign_doc_ids(self.doc_id_map, self.log_file):
                 log_warning(self.log_file, phase, getattr(task, 'name_of_process', None), "skipped", f"Не удалось сопоставить doc_id для задачи: {task}. Пропуск.")
                 continue
-            scan_groups[task.scan_group].append(task)
-        for scan_group, group_tasks in scan_groups.items():
-            log_section(self.log_file, phase, f"\n🗂️ Обработка scan_group: {scan_group} ({len(group_tasks)} задач)\n")
-            if not group_tasks:
-                continue
-            doc_id = group_tasks[0].source_doc_id
-            unique_sheet_names = set(task.source_page_name for task in group_tasks)
-            exists_map = {
-                sheet_name: check_sheet_exists(self.service, doc_id, sheet_name, self.log_file, self.token_name)
-                for sheet_name in unique_sheet_names
-            }
-            for sheet_name, exists in exists_map.items():
-                log_info(self.log_file, phase, None, "sheet_exists", f"Лист '{sheet_name}' {'существует' if exists else 'не найден'}")
-            valid_tasks = []
-            for task in group_tasks:
-                sheet_name = task.source_page_name
-                if exists_map.get(sheet_name):
-                    valid_tasks.append(task)
-                else:
-                    log_warning(self.log_file, phase, task.name_of_process, "skipped", f"Лист '{sheet_name}' не найден")
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
-            if not valid_tasks:
-                log_info(self.log_file, phase, None, "empty", f"Все задачи группы {scan_group} отфильтрованы. Пропуск batchGet.")
-                continue
-            range_to_tasks = defaultdict(list)
-            for task in valid_tasks:
-                range_str = f"{task.source_page_name}!{task.source_page_area}"
-                range_to_tasks[range_str].append(task)
-            ranges = list(range_to_tasks.keys())
-            log_info(self.log_file, phase, None, "batch_get", f"Отправка batchGet на документ {task.source_table_type} с {len(ranges)} диапазонами")
-            response_data = batch_get(
-                self.service,
-                doc_id,
-                ranges,
-                scan_group,
-                self.log_file,
-                self.token_name
-            )
-            if not response_data:
-                for task in valid_tasks:
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
-                log_warning(self.log_file, phase, None, "empty", "Пустой ответ от batchGet. Все задачи будут отмечены как неудачные.")
-                continue
-            normalized_response = {}
-            for k, v in response_data.items():
-                clean_key = k.replace("'", "")
-                if "!" in clean_key:
-                    sheet_name, cells_range = clean_key.split("!", 1)
-                    normalized_response[(sheet_name.strip(), cells_range.strip())] = v
-            for task in valid_tasks:
-                expected_sheet = task.source_page_name.strip()
-                expected_area_start = task.source_page_area.split(":")[0].strip()
-                matched_values = None
-                for (sheet_name, cells_range), values in normalized_response.items():
-                    if sheet_name == expected_sheet and cells_range.startswith(expected_area_start):
-                        matched_values = values
-                        break
-                if matched_values:
-                    task.raw_values_json = matched_values
-                    task.update_after_scan(success=True)
-                    update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
-                    log_success(self.log_file, phase, task.name_of_process, "found", f"Найден диапазон {sheet_name}!{cells_range}, строк: {len(matched_values)}")
-                else:
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
-                    log_warning(self.log_file, phase, task.name_of_process, "not_found", f"Диапазон {expected_sheet}!{task.source_page_area} не найден или пуст.")
+            mapped_tasks.append(task)
+        # Один batchGet на документ для всех готовых задач
+        results = fetch_tasks_values(self.service, mapped_tasks, self.log_file, self.token_name, phase)
+        for task, status, values in results:
+            if status == FETCH_OK:
+                task.raw_values_json = values
+                task.update_after_scan(success=True)
+                update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
+                log_success(self.log_file, phase, task.name_of_process, "found", f"Найден диапазон {task.source_page_name}!{task.source_page_area}, строк: {len(values)}")
+            else:
+                task.update_after_scan(success=False)
+                update_task_scan_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
+                if status == FETCH_SHEET_MISSING:
+                    log_warning(self.log_file, phase, task.name_of_process, "skipped", f"Лист '{task.source_page_name}' не найден")
+                elif status == FETCH_NOT_FOUND:
+                    log_warning(self.log_file, phase, task.name_of_process, "not_found", f"Диапазон {task.source_page_name}!{task.source_page_area} не найден или пуст.")
         log_info(self.log_file, phase, None, "summary", "\n".join(
             [f"• {task.name_of_process} {task.source_page_name}: scanned={task.scanned}, processed={task.proceed}, changed={task.changed}, uploaded={task.uploaded}"
              for task in self.tasks]
@@ -208,7 +229,6 @@ class RotationsInfoScanner:
     #############################################################################################
 
     def process_phase(self, session):
-        from core.methods import process_full_rotation, process_full_turkish_rotation
         log_section(self.log_file, "process_phase", "🛠️ Фаза обработки")
         if not self.tasks:
             log_info(self.log_file, "process_phase", None, "empty", "Нет задач для обработки")
@@ -219,28 +239,37 @@ class RotationsInfoScanner:
             try:
                 # Выбор нужного процессора
                 if getattr(task, 'name_of_process', None) == "TURKISH Main":
-                    processor = process_full_turkish_rotation
+                    processor = "process_full_turkish_rotation"
                 else:
-                    processor = process_full_rotation
-                # 1. Обработка сырых данных через нужный процессор
+                    processor = "process_full_rotation"
+                # 1. Обработка сырых данных через нужный процессор (в пуле процессов, если включён)
                 try:
-                    processed_full = processor(task.raw_values_json, task.source_page_area)
+                    processed_full, values_hash = process_values(processor, task.raw_values_json, task.source_page_area)
                 except Exception as e:
-                    log_error(self.log_file, "process_phase", task.name_of_process, "fail", f"Ошибка в {processor.__name__}", exc=e)
+                    log_error(self.log_file, "process_phase", task.name_of_process, "fail", f"Ошибка в {processor}", exc=e)
                     continue
                 # 2. Проверка изменений и сохранение в БД, если нужно
-                task.values_json = processed_full
+                task.set_processed_values(processed_full, values_hash)
                 try:
                     task.check_for_update()
                 except Exception as e:
                     log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка в check_for_update", exc=e)
                     continue
+                try:
+                    update_task_schedule_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
+                except Exception as e:
+                    log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении интервала сканирования", exc=e)
                 if task.changed:
                     try:
                         update_task_process_fields(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
-                        log_success(self.log_file, "process_phase", task.name_of_process, "changed", f"Данные изменены и сохранены ({processor.__name__})")
+                        log_success(self.log_file, "process_phase", task.name_of_process, "changed", f"Данные изменены и сохранены ({processor})")
                     except Exception as e:
                         log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении изменений в БД", exc=e)
+                elif task.hash_upgraded:
+                    try:
+                        update_task_hash_field(session, task, self.log_file, table_name=RotationsInfo.__tablename__)
+                    except Exception as e:
+                        log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении hash", exc=e)
                 # 3. Обычная обработка для логики (не сохраняется в БД)
                 try:
                     task.process_raw_value()
@@ -288,6 +317,9 @@ class RotationsInfoScanner:
             except Exception as e:
                 log_error(self.log_file, "update_phase", None, "shuffle_fail", "Ошибка при обновлении update_shuffle", exc=e)
 
+        # Форматирование, отложенное в прошлых циклах из-за лимита API
+        retry_deferred_formats(self.service, self.token_name, self.log_file, session)
+
         log_info(self.log_file, "update_phase", None, "summary", "\n".join(
             [f"• {task.name_of_process} {task.source_page_name}: scanned={task.scanned}, processed={task.proceed}, changed={task.changed}, uploaded={task.uploaded}"
              for task in self.tasks]
@@ -366,7 +398,7 @@ class RotationsInfoScanner:
                     reference_task = sorted_tasks[0]
                     spreadsheet_id = reference_task.target_doc_id
                     target_page_area = reference_task.target_page_area
-                    insert_range = f"{page_name}!{target_page_area}"
+                    insert_range = sheet_range(page_name, target_page_area)
 
                     batch_data = [{
                         "range": insert_range,
@@ -380,7 +412,8 @@ class RotationsInfoScanner:
                             batch_data=batch_data,
                             token_name=self.token_name,
                             update_group=reference_task.update_group,
-                            log_file=self.log_file
+                            log_file=self.log_file,
+                            diff_only=True
                         )
                         if success:
                             log_success(self.log_file, "import_main_data", page_name, "uploaded", "Вставка смены завершена успешно")
@@ -443,7 +476,7 @@ class RotationsInfoScanner:
                     raw = batch_get(
                         service=self.service,
                         spreadsheet_id=spreadsheet_id,
-                        ranges=[f"{page_name}!D1:AC200"],
+                        ranges=[format_range(page_name, col_to_index("D"), 1, col_to_index("AC"), 200)],
                         scan_group=update_group,
                         log_file=self.log_file,
                         token_name=self.token_name
@@ -505,7 +538,7 @@ class RotationsInfoScanner:
 
                     start_row = shift_row_index + 1
                     end_row = start_row + len(all_values) - 1
-                    insert_range = f"{page_name}!D{start_row}:AC{end_row}"
+                    insert_range = format_range(page_name, col_to_index("D"), start_row, col_to_index("AC"), end_row)
 
                     batch_data = [{
                         "range": insert_range,
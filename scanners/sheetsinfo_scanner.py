@@ -1,6 +1,7 @@
 # scanners/sheetsinfo_scanner.py
 
 import time
+import threading
 from datetime import datetime, timedelta, date
 from collections import defaultdict
 import traceback
@@ -24,19 +25,32 @@ from database.db_models import GamingTable, ScheduleOT
 from core.config import (
     SHEETSINFO_LOG,
     SHEETINFO_INTERVAL,
+    SCHEDULER_RELOAD_INTERVAL,
+    SCANNER_PIPELINE,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_FETCH_WORKERS,
+    PIPELINE_PROCESS_WORKERS,
+    PIPELINE_UPLOAD_WORKERS,
+    TASK_LEASING,
     FLOORS
 )
 from utils.db_orm import (
     update_task_scan_fields,
     update_task_process_fields,
-    update_task_update_fields
+    update_task_hash_field,
+    update_task_schedule_fields,
+    update_task_update_fields,
+    TaskWriteBuffer
 )
+from utils.credential_pool import CredentialPool
+from core.scheduler import DueScheduler
+from core.task_lease import claim_tasks, release_tasks
+from core.pipeline import StagedPipeline
 from utils.utils import (
-    load_credentials,
-    check_sheet_exists,
-    batch_get,
     batch_update,
 )
+from utils.a1_notation import sheet_range
+from .fetch_planner import fetch_tasks_values, FETCH_OK, FETCH_SHEET_MISSING, FETCH_NOT_FOUND
 from .sheetsinfo_imports import (
     import_mistakes_to_update,
     import_feedbacks_to_update,
@@ -53,65 +67,163 @@ class SheetsInfoScanner:
         self.token_map = token_map
         self.log_file = log_file if log_file else (SHEETSINFO_LOG if SHEETSINFO_LOG else "logs/scanner_sheetsinfo.log")
         self.tasks = []
+        self.service = None
 
     def run(self):
         """
-        Основной цикл работы сканера: загрузка задач, сканирование, обработка, обновление.
+        Основной цикл работы сканера: планировщик будит сканер к ближайшей задаче,
+        готовые задачи проходят сканирование, обработку и обновление.
         Каждая фаза работает в отдельной сессии, чтобы ошибки не влияли на остальные фазы.
         """
+        # Интервал сканера теперь — пауза перед повтором неудачной задачи
+        self.scheduler = DueScheduler("sheets_scanner", SCHEDULER_RELOAD_INTERVAL, max(SHEETINFO_INTERVAL, 3))
         while True:
             if not is_scanner_enabled("sheets_scanner"):
                 time.sleep(10)
                 continue
             try:
-                log_separator(self.log_file, "run")
-                log_section(self.log_file, "run", "▶️ SheetsInfo Активен. Новый цикл сканирования\n")
+                if self.scheduler.needs_reload():
+                    self.reload_schedule()
 
-                token_name = list(self.token_map.keys())[0]
-                token_path = self.token_map[token_name]
-                self.token_name = token_name
-
-                # Сервис и doc_id_map инициализируем один раз
-                with get_session() as session:
-                    self.service = load_credentials(token_path, self.log_file)
-                    log_info(self.log_file, "run", None, "token", f"Используется токен: {self.token_name}")
-                    from core.data import return_tracked_tables
-                    self.doc_id_map = return_tracked_tables(session)
-
-                # Каждая фаза — отдельная сессия
-                for phase_name, method in [
-                    ("load_tasks", self.load_tasks),
-                    ("scan_phase", self.scan_phase),
-                    ("process_phase", self.process_phase),
-                    ("update_phase", self.update_phase),
-                ]:
-                    log_separator(self.log_file, phase_name)
-                    try:
-                        log_info(self.log_file, phase_name, None, "start", f"Старт этапа {phase_name}")
-                        with get_session() as session:
-                            method(session)
-                        log_success(self.log_file, phase_name, None, "finish", f"Этап {phase_name} завершён\n")
-                    except Exception as e:
-                        log_error(self.log_file, phase_name, None, "fail", f"Ошибка на этапе {phase_name}", exc=e)
-                        # Не прерываем цикл, просто логируем ошибку
+                due_tasks = self.scheduler.pop_due()
+                if due_tasks:
+                    log_separator(self.log_file, "run")
+                    log_section(self.log_file, "run", f"▶️ SheetsInfo Активен. Готовых задач: {len(due_tasks)}\n")
+                    self.run_tasks(due_tasks)
 
             except Exception as e:
                 log_error(self.log_file, "run", None, "fail", "Критическая ошибка в основном цикле", exc=e)
                 time.sleep(10)
 
-            # Гарантированная задержка между циклами (не менее 3 секунд)
-            interval = max(SHEETINFO_INTERVAL, 3)
-            time.sleep(interval)
+            self.scheduler.wait()
+
+    def reload_schedule(self):
+        """Пул токенов (при первом вызове), doc_id_map и полный список активных задач -> куча планировщика."""
+        if self.service is None:
+            # Пул по всем токенам из token_map: запросы распределяются между ними.
+            # Создаётся один раз — иначе каждая перезагрузка сбрасывала бы паузы токенов после 429
+            self.service = CredentialPool(self.token_map, self.log_file)
+            self.token_name = "+".join(self.service.names)
+            log_info(self.log_file, "run", None, "token", f"Используются токены: {self.token_name}")
+
+        with get_session() as session:
+            from core.data import return_tracked_tables
+            self.doc_id_map = return_tracked_tables(session)
+
+        with get_session() as session:
+            self.load_tasks(session, only_ready=False)
+        self.scheduler.rebuild(self.tasks)
+        log_info(self.log_file, "run", None, "schedule", f"🗓️ Задач в планировщике: {len(self.scheduler)}, ближайшая через {self.scheduler.seconds_until_next():.0f} сек.")
+
+    def run_tasks(self, tasks):
+        """Прогоняет готовые задачи через фазы и возвращает их в планировщик."""
+        skipped = []
+        if TASK_LEASING:
+            with get_session() as session:
+                tasks, skipped = claim_tasks(session, tasks, "SheetsInfo", self.log_file)
+        for task in tasks:
+            task.reset_run_state()
+        self.tasks = tasks
+
+        try:
+            if not tasks:
+                return
+            if SCANNER_PIPELINE:
+                self.run_pipeline(tasks)
+            else:
+                self.run_phases()
+        finally:
+            if TASK_LEASING and tasks:
+                with get_session() as session:
+                    release_tasks(session, tasks, "SheetsInfo", self.log_file)
+            for task in tasks:
+                task.run_requested = False
+            for task in tasks + skipped:
+                self.scheduler.reschedule(task)
+
+    def run_phases(self):
+        # Каждая фаза — отдельная сессия
+        for phase_name, method in [
+            ("scan_phase", self.scan_phase),
+            ("process_phase", self.process_phase),
+            ("update_phase", self.update_phase),
+        ]:
+            log_separator(self.log_file, phase_name)
+            try:
+                log_info(self.log_file, phase_name, None, "start", f"Старт этапа {phase_name}")
+                with get_session() as session, TaskWriteBuffer(session, self.log_file):
+                    method(session)
+                log_success(self.log_file, phase_name, None, "finish", f"Этап {phase_name} завершён\n")
+            except Exception as e:
+                log_error(self.log_file, phase_name, None, "fail", f"Ошибка на этапе {phase_name}", exc=e)
+                # Не прерываем цикл, просто логируем ошибку
+
+    def run_pipeline(self, tasks):
+        """
+        Конвейер: документы читаются по одному — одним batchGet на документ для всех задач
+        цикла, как в scan_phase; update_group обрабатывается и выгружается, как только
+        прочитаны все её документы, пока остальные документы ещё читаются.
+        Элемент после чтения — список групп, которые этот документ завершил. Каждый этап — своя сессия.
+        """
+        docs, groups = defaultdict(list), defaultdict(list)
+        for task in tasks:
+            docs[task.source_doc_id].append(task)
+            groups[task.update_group].append(task)
+        # Сколько документов каждой группы ещё не прочитано
+        pending_docs = {group: len({task.source_doc_id for task in group_tasks}) for group, group_tasks in groups.items()}
+        pending_lock = threading.Lock()
+        log_info(self.log_file, "pipeline", None, "start",
+                 f"🚚 Конвейер: {len(tasks)} задач, документов {len(docs)}, групп {len(groups)}")
+
+        def scan(doc_tasks):
+            try:
+                with get_session() as session, TaskWriteBuffer(session, self.log_file):
+                    self.scan_phase(session, doc_tasks)
+            except Exception as e:
+                # Задачи документа останутся с scanned=0; группы не должны ждать его вечно
+                log_error(self.log_file, "pipeline", None, "scan_phase_fail", "❌ Ошибка чтения документа", exc=e)
+            ready_groups = []
+            with pending_lock:
+                for group in {task.update_group for task in doc_tasks}:
+                    pending_docs[group] -= 1
+                    if not pending_docs[group]:
+                        ready_groups.append(groups[group])
+            return ready_groups or None
+
+        def process(ready_groups):
+            with get_session() as session, TaskWriteBuffer(session, self.log_file):
+                self.process_phase(session, [task for group_tasks in ready_groups for task in group_tasks])
+            return ready_groups
+
+        def upload(ready_groups):
+            with get_session() as session, TaskWriteBuffer(session, self.log_file):
+                return self.update_phase(session, [task for group_tasks in ready_groups for task in group_tasks],
+                                         refresh_views=False)
+
+        pipeline = StagedPipeline(
+            [
+                ("scan_phase", scan, PIPELINE_FETCH_WORKERS),
+                ("process_phase", process, PIPELINE_PROCESS_WORKERS),
+                ("update_phase", upload, PIPELINE_UPLOAD_WORKERS),
+            ],
+            PIPELINE_QUEUE_SIZE, self.log_file, "pipeline"
+        )
+        updated_groups = set().union(*pipeline.run(docs.values()))
+
+        # Материализованные вью — один раз после всех групп
+        with get_session() as session:
+            refresh_materialized_views(session, updated_groups, self.log_file)
+        log_success(self.log_file, "pipeline", None, "finish", f"🚚 Конвейер завершён, обновлено групп: {len(updated_groups)}\n")
 
 #############################################################################################
 # загрузка задач из БД
 #############################################################################################
 
-    def load_tasks(self, session):
+    def load_tasks(self, session, only_ready=True):
         log_section(self.log_file, "load_tasks", "📥 Загрузка задач из SheetsInfo")
 
         # Загружаем с передачей doc_id_map
-        self.tasks = load_sheetsinfo_tasks(session, self.log_file)
+        self.tasks = load_sheetsinfo_tasks(session, self.log_file, only_ready=only_ready)
 
         if not self.tasks:
             log_info(self.log_file, "load_tasks", None, "empty", "Нет активных задач для сканирования")
@@ -136,110 +248,36 @@ class SheetsInfoScanner:
 # Фаза сканирования
 #############################################################################################
 
-    def scan_phase(self, session):
+    def scan_phase(self, session, tasks=None):
         log_section(self.log_file, "scan_phase", "🔍 Фаза сканирования")
+        tasks = self.tasks if tasks is None else tasks
 
-        if not self.tasks:
+        if not tasks:
             log_info(self.log_file, "scan_phase", None, "empty", "Нет задач для сканирования")
             return
 
-        # 🧩 Группировка по scan_group
-        scan_groups = defaultdict(list)
-        for task in self.tasks:
-            scan_groups[task.scan_group].append(task)
-
-        # 📦 Обработка каждой группы
-        for scan_group, group_tasks in scan_groups.items():
-            log_section(self.log_file, "scan_phase", f"\n🗂️ Обработка scan_group: {scan_group} ({len(group_tasks)} задач)\n")
-            if not group_tasks:
-                continue
-
-            doc_id = group_tasks[0].source_doc_id
-            unique_sheet_names = set(task.source_page_name for task in group_tasks)
-
-            # ✅ Проверка наличия листов (первая работа с API)
-            exists_map = {
-                sheet_name: check_sheet_exists(self.service, doc_id, sheet_name, self.log_file, self.token_name)
-                for sheet_name in unique_sheet_names
-            }
-
-            for sheet_name, exists in exists_map.items():
-                log_info(self.log_file, "scan_phase", None, "sheet_exists", f"Лист '{sheet_name}' {'существует' if exists else 'не найден'}")
-
-            # 🧾 Фильтрация валидных задач
-            valid_tasks = []
-            for task in group_tasks:
-                if exists_map.get(task.source_page_name):
-                    valid_tasks.append(task)
-                else:
+        # 📥 Один batchGet на документ для всех задач цикла
+        results = fetch_tasks_values(self.service, tasks, self.log_file, self.token_name, "scan_phase")
+
+        # 📤 Назначение значений задачам
+        for task, status, values in results:
+            if status == FETCH_OK:
+                task.raw_values_json = values
+                task.update_after_scan(success=True)
+                update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
+                log_success(self.log_file, "scan_phase", task.name_of_process, "found", f"Найден диапазон {task.source_page_name}!{task.source_page_area}, строк: {len(values) if isinstance(values, list) else 'читается окнами'}")
+            else:
+                task.update_after_scan(success=False)
+                update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
+                if status == FETCH_SHEET_MISSING:
                     log_warning(self.log_file, "scan_phase", task.name_of_process, "skipped", f"Лист '{task.source_page_name}' не найден")
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
-
-            if not valid_tasks:
-                log_info(self.log_file, "scan_phase", None, "empty", f"Все задачи группы {scan_group} отфильтрованы. Пропуск batchGet.")
-                continue
-
-            # 🔗 Группировка по диапазонам
-            range_to_tasks = defaultdict(list)
-            for task in valid_tasks:
-                range_str = f"{task.source_page_name}!{task.source_page_area}"
-                range_to_tasks[range_str].append(task)
-
-            ranges = list(range_to_tasks.keys())
-            log_info(self.log_file, "scan_phase", None, "batch_get", f"Отправка batchGet на документ {task.source_table_type} с {len(ranges)} диапазонами")
-
-            # 📥 batchGet запрос
-            response_data = batch_get(
-                self.service,
-                doc_id,
-                ranges,
-                scan_group,
-                self.log_file,
-                self.token_name
-            )
-
-            # ❌ Ошибка запроса — все задачи failed
-            if not response_data:
-                for task in valid_tasks:
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
-                log_warning(self.log_file, "scan_phase", None, "empty", "Пустой ответ от batchGet. Все задачи будут отмечены как неудачные.")
-                continue
-
-            # ✅ Очистка ключей от кавычек
-            normalized_response = {}
-            for k, v in response_data.items():
-                clean_key = k.replace("'", "")
-                if "!" in clean_key:
-                    sheet_name, cells_range = clean_key.split("!", 1)
-                    normalized_response[(sheet_name.strip(), cells_range.strip())] = v
-
-            # 📤 Назначение значений задачам
-            for task in valid_tasks:
-                expected_sheet = task.source_page_name.strip()
-                expected_area_start = task.source_page_area.split(":")[0].strip()
-                matched_values = None
-
-                for (sheet_name, cells_range), values in normalized_response.items():
-                    if sheet_name == expected_sheet and cells_range.startswith(expected_area_start):
-                        matched_values = values
-                        break
-
-                if matched_values:
-                    task.raw_values_json = matched_values
-                    task.update_after_scan(success=True)
-                    update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
-                    log_success(self.log_file, "scan_phase", task.name_of_process, "found", f"Найден диапазон {sheet_name}!{cells_range}, строк: {len(matched_values)}")
-                else:
-                    task.update_after_scan(success=False)
-                    update_task_scan_fields(session, task, self.log_file, table_name="SheetsInfo")
-                    log_warning(self.log_file, "scan_phase", task.name_of_process, "not_found", f"Диапазон {expected_sheet}!{task.source_page_area} не найден или пуст.")
+                elif status == FETCH_NOT_FOUND:
+                    log_warning(self.log_file, "scan_phase", task.name_of_process, "not_found", f"Диапазон {task.source_page_name}!{task.source_page_area} не найден или пуст.")
 
         # 🧾 Финальный отчёт
         log_info(self.log_file, "scan_phase", None, "summary", "\n".join(
             [f"• {task.name_of_process} {task.source_page_name}: scanned={task.scanned}, processed={task.proceed}, changed={task.changed}, uploaded={task.uploaded}"
-            for task in self.tasks]
+            for task in tasks]
         ) + "\n")
 
         log_success(self.log_file, "scan_phase", None, "finish", "Фаза сканирования завершена\n")
@@ -248,12 +286,13 @@ class SheetsInfoScanner:
 # Фаза обработки
 #############################################################################################
 
-    def process_phase(self, session):
+    def process_phase(self, session, tasks=None):
         log_section(self.log_file, "process_phase", "🛠️ Фаза обработки")
-        if not self.tasks:
+        tasks = self.tasks if tasks is None else tasks
+        if not tasks:
             log_info(self.log_file, "process_phase", None, "empty", "Нет задач для обработки")
             return
-        for task in self.tasks:
+        for task in tasks:
             if task.scanned == 0:
                 continue
             try:
@@ -267,19 +306,27 @@ class SheetsInfoScanner:
                 except Exception as e:
                     log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка в check_for_update", exc=e)
                     continue
+                # Запись копится в TaskWriteBuffer фазы и уходит одним пакетом в конце
+                try:
+                    update_task_schedule_fields(session, task, self.log_file, table_name="SheetsInfo")
+                except Exception as e:
+                    log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении интервала сканирования", exc=e)
                 if task.changed:
                     try:
                         update_task_process_fields(session, task, self.log_file, table_name="SheetsInfo")
-                        session.commit()  # коммитим изменения по задаче
                         log_success(self.log_file, "process_phase", task.name_of_process, "changed", "Данные изменены и сохранены")
                     except Exception as e:
-                        session.rollback()  # откатываем только изменения по этой задаче
                         log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении изменений в БД", exc=e)
+                elif task.hash_upgraded:
+                    try:
+                        update_task_hash_field(session, task, self.log_file, table_name="SheetsInfo")
+                    except Exception as e:
+                        log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Ошибка при сохранении hash", exc=e)
             except Exception as e:
                 log_error(self.log_file, "process_phase", task.name_of_process, "fail", "Неизвестная ошибка при обработке", exc=e)
         log_info(self.log_file, "process_phase", None, "summary", "\n".join(
             [f"• {task.name_of_process} {task.source_page_name}: scanned={task.scanned}, processed={task.proceed}, changed={task.changed}, uploaded={task.uploaded}"
-            for task in self.tasks]
+            for task in tasks]
         ) + "\n")
         log_success(self.log_file, "process_phase", None, "finish", "Фаза обработки завершена\n")
 
@@ -287,37 +334,38 @@ class SheetsInfoScanner:
 # Фаза обновления
 #############################################################################################
 
-    def update_phase(self, session):
+    def update_phase(self, session, tasks=None, refresh_views=True):
         log_section(self.log_file, "update_phase", "🔼 Фаза обновления")
+        tasks = self.tasks if tasks is None else tasks
 
         grouped_tasks = defaultdict(list)
         updated_groups = set()
 
         # Группировка задач по update_group
-        for t in self.tasks:
-            if not (t.values_json and t.changed):
+        for t in tasks:
+            # changed — первым: values_json задач без скана читался бы из БД отдельным запросом
+            if not (t.changed and t.values_json):
                 log_warning(self.log_file, "update_phase", t.name_of_process, "skipped", f"Пропуск задачи {t.name_of_process}: нет изменений или пустой values_json")
                 continue
             grouped_tasks[t.update_group].append(t)
 
         # Основной импорт — одной функцией
-        for group_name, tasks in grouped_tasks.items():
-            time.sleep(5)  # Задержка для избежания перегрузки API
-            log_info(self.log_file, "update_phase", None, group_name, f"🔼 Обновление {group_name}: {len(tasks)}")
+        for group_name, group_tasks in grouped_tasks.items():
+            log_info(self.log_file, "update_phase", None, group_name, f"🔼 Обновление {group_name}: {len(group_tasks)}")
             try:
-                self.import_tasks_to_update(tasks, session)
+                self.import_tasks_to_update(group_tasks, session)
                 updated_groups.add(group_name)
             except Exception as e:
                 session.rollback()
                 log_error(self.log_file, "update_phase", None, f"{group_name}_fail", f"❌ Ошибка при обновлении группы: {e}")
-            time.sleep(3)
 
-        # Обновление материализованных вью
-        refresh_materialized_views(session, updated_groups, self.log_file)
+        # Обновление материализованных вью (в конвейере — один раз после всех групп)
+        if refresh_views:
+            refresh_materialized_views(session, updated_groups, self.log_file)
 
         # Статистика
         log_info(self.log_file, "update_phase", None, "summary", "🔼 Итоговая статистика по задачам:")
-        for task in self.tasks:
+        for task in tasks:
             log_info(
                 self.log_file,
                 "update_phase",
@@ -329,6 +377,7 @@ class SheetsInfoScanner:
             )
 
         log_section(self.log_file, "update_phase", "🔼 Обновление завершено.\n")
+        return updated_groups
 
 ##############################################################################################
 # Импорт Обычных задач 
@@ -356,12 +405,12 @@ class SheetsInfoScanner:
                 continue
 
             batch_data = [{
-                "range": f"{task.target_page_name}!{task.target_page_area}",
+                "range": sheet_range(task.target_page_name, task.target_page_area),
                 "values": values
             } for task, values in valid_tasks.items()]
 
             try:
-                success, error = self._try_batch_update(doc_id, batch_data, update_group)
+                success, error = self._try_batch_update(doc_id, batch_data, update_group, diff_only=True)
                 if success:
                     log_success(self.log_file, "import_tasks_to_update", None, "batch_update", f"✅ Пакетное обновление успешно для группы {update_group}")
                     self._commit_task_updates(valid_tasks.keys(), session, success=True)
@@ -415,7 +464,7 @@ class SheetsInfoScanner:
         for task, values in valid_tasks.items():
             try:
                 single_data = [{
-                    "range": f"{task.target_page_name}!{task.target_page_area}",
+                    "range": sheet_range(task.target_page_name, task.target_page_area),
                     "values": values
                 }]
                 success, error = self._try_batch_update(doc_id, single_data, update_group)
@@ -431,22 +480,20 @@ class SheetsInfoScanner:
                 session.rollback()
                 log_error(self.log_file, "import_tasks_to_update", task.name_of_process, "single_update_exception", f"❌ Исключение при поштучном обновлении: {e}")
 
-    def _try_batch_update(self, doc_id, batch_data, update_group, retries=3):
-        last_error = None
-        for attempt in range(retries):
-            try:
-                return batch_update(
-                    service=self.service,
-                    spreadsheet_id=doc_id,
-                    batch_data=batch_data,
-                    token_name=self.token_name,
-                    update_group=update_group,
-                    log_file=self.log_file
-                )
-            except Exception as e:
-                last_error = e
-                time.sleep(2 ** attempt)
-        return False, last_error
+    def _try_batch_update(self, doc_id, batch_data, update_group, diff_only=False):
+        # Повторы выполняются внутри batch_update по общей политике (utils.retry_policy)
+        try:
+            return batch_update(
+                service=self.service,
+                spreadsheet_id=doc_id,
+                batch_data=batch_data,
+                token_name=self.token_name,
+                update_group=update_group,
+                log_file=self.log_file,
+                diff_only=diff_only
+            )
+        except Exception as e:
+            return False, e
 
     def _commit_task_updates(self, tasks, session, success):
         try:
@@ -14,6 +14,7 @@ from tg_bot.utils.utils import day_or_night
 import httpx
 import json
 from tg_bot.handlers.common_callbacks import check_stranger_callback
+from core.task_notify import notify_task_run
 
 router = Router()
 PAGE_SIZE = 5
@@ -186,7 +187,17 @@ async def toggle_task_status(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("task:run:"))
 async def task_run(callback: CallbackQuery):
     if await check_stranger_callback(callback): return
-    await callback.answer("🚧 Manual run not implemented yet", show_alert=True)
+    _, _, table_name, task_id = callback.data.split(":")
+    model = SheetsInfo if table_name == "sheets" else RotationsInfo
+
+    try:
+        with get_session() as session:
+            notify_task_run(session, model.__tablename__, int(task_id))
+    except Exception as e:
+        await callback.answer(f"❌ Run request failed: {e}", show_alert=True)
+        return
+
+    await callback.answer("⚡ Run requested, the scanner will pick it up in a few seconds")
 
 @router.callback_query(F.data == "return_shift")
 async def proxy_return_shift(callback: CallbackQuery, state: FSMContext, bot):
@@ -0,0 +1,121 @@
+# utils/a1_notation.py
+
+import re
+from typing import NamedTuple, Optional
+
+_CELL_RE = re.compile(r"^\$?([A-Za-z]*)\$?(\d*)$")
+_PLAIN_SHEET_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class A1Range(NamedTuple):
+    """Диапазон в A1-нотации. Колонки — с 0, строки — с 1; None — открытая граница."""
+    sheet: Optional[str]
+    start_col: Optional[int]
+    start_row: Optional[int]
+    end_col: Optional[int]
+    end_row: Optional[int]
+
+    @property
+    def rows(self):
+        if self.end_row is None:
+            return None
+        return self.end_row - (self.start_row or 1) + 1
+
+    @property
+    def cols(self):
+        if self.end_col is None or self.start_col is None:
+            return None
+        return self.end_col - self.start_col + 1
+
+    @property
+    def anchor(self):
+        """Ключ левого верхнего угла: (лист, колонка, строка)."""
+        return self.sheet, self.start_col or 0, self.start_row or 1
+
+
+def col_to_index(letters):
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index - 1
+
+
+def index_to_col(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def quote_sheet_name(sheet):
+    if _PLAIN_SHEET_RE.match(sheet) and not re.match(r"^[A-Za-z]{1,3}\d+$", sheet):
+        return sheet
+    return "'" + sheet.replace("'", "''") + "'"
+
+
+def _split_sheet(range_str):
+    range_str = range_str.strip()
+    if range_str.startswith("'"):
+        # 'Лист с ''кавычкой'''!A1:B2
+        i = 1
+        while i < len(range_str):
+            if range_str[i] == "'":
+                if i + 1 < len(range_str) and range_str[i + 1] == "'":
+                    i += 2
+                    continue
+                break
+            i += 1
+        sheet = range_str[1:i].replace("''", "'")
+        rest = range_str[i + 1:]
+        return sheet, rest[1:] if rest.startswith("!") else rest
+    if "!" in range_str:
+        sheet, cells = range_str.rsplit("!", 1)
+        return sheet.strip(), cells
+    return None, range_str
+
+
+def _parse_cell(cell):
+    match = _CELL_RE.match(cell.strip())
+    if not match:
+        raise ValueError(f"Некорректная ячейка A1: '{cell}'")
+    letters, digits = match.groups()
+    return (col_to_index(letters) if letters else None), (int(digits) if digits else None)
+
+
+def parse_range(range_str):
+    """'DAY 1'!D1:AC100, Лист!A:Z, Лист!A2:Z, Лист!B5 -> A1Range."""
+    sheet, cells = _split_sheet(range_str)
+    if not cells:
+        return A1Range(sheet, None, None, None, None)
+    start, sep, end = cells.partition(":")
+    start_col, start_row = _parse_cell(start)
+    if not sep:
+        return A1Range(sheet, start_col, start_row, start_col, start_row)
+    end_col, end_row = _parse_cell(end)
+    return A1Range(sheet, start_col, start_row, end_col, end_row)
+
+
+def format_range(sheet, start_col, start_row, end_col=None, end_row=None):
+    """Собирает строку диапазона; None в конце — открытая граница."""
+    start = f"{index_to_col(start_col)}{start_row or ''}"
+    cells = start
+    if end_col is not None or end_row is not None:
+        end = f"{index_to_col(end_col) if end_col is not None else ''}{end_row or ''}"
+        cells = f"{start}:{end}"
+    return f"{quote_sheet_name(sheet)}!{cells}" if sheet else cells
+
+
+def sheet_range(sheet, area):
+    """Лист + область ('D1:AC100') -> строка диапазона с корректными кавычками."""
+    return f"{quote_sheet_name(sheet)}!{area.strip()}"
+
+
+def canonical_key(range_str):
+    """Нормализованный ключ диапазона для сравнения (кавычки, $, регистр — не важны)."""
+    return tuple(parse_range(range_str))
+
+
+def same_range(a, b):
+    return canonical_key(a) == canonical_key(b)
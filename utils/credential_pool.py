@@ -0,0 +1,92 @@
+# utils/credential_pool.py
+
+import threading
+import time
+
+from core.config import TOKEN_COOLDOWN_SECONDS
+from utils.rate_limiter import rate_limiter, PRIORITY_HIGH
+from utils.logger import log_info, log_warning, log_error
+
+
+class CredentialPool:
+    """
+    Пул сервисов Google Sheets API по всем токенам из token_map.
+    Токен под запрос выбирает rate_limiter: наименьший расход за сутки при свободном
+    минутном бюджете; токен, получивший 429, пропускается на время cooldown.
+    """
+
+    def __init__(self, token_map, log_file, cooldown=TOKEN_COOLDOWN_SECONDS):
+        from utils.utils import load_credentials
+
+        self.log_file = log_file
+        self.cooldown = cooldown
+        self._services = {}
+        self._cooldown_until = {}
+        self._lock = threading.Lock()
+
+        for token_name, token_path in token_map.items():
+            try:
+                self._services[token_name] = load_credentials(token_path, log_file)
+                self._cooldown_until[token_name] = 0.0
+            except Exception as e:
+                log_error(log_file, "credential_pool", token_name, "load_fail", f"❌ Токен {token_name} не загружен, пропуск", exc=e)
+
+        if not self._services:
+            raise RuntimeError("❌ Ни один токен из token_map не загружен")
+
+        log_info(log_file, "credential_pool", None, "ready", f"🔑 Пул токенов: {', '.join(self._services)}")
+
+    @property
+    def names(self):
+        return list(self._services)
+
+    def acquire(self, priority=PRIORITY_HIGH):
+        """
+        Возвращает (service, token_name) токена вне cooldown с бюджетом в rate_limiter.
+        (None, None) — дневной бюджет исчерпан у всех токенов пула.
+        """
+        with self._lock:
+            now = time.monotonic()
+            ready = [n for n in self._services if self._cooldown_until[n] <= now]
+            cooling = sorted((n for n in self._services if self._cooldown_until[n] > now),
+                             key=lambda n: self._cooldown_until[n])
+        token_name = rate_limiter.acquire_any(ready, priority) if ready else None
+        # Свободные токены без бюджета или на паузе все — берём тот, что освободится раньше
+        for candidate in cooling:
+            if token_name is not None:
+                break
+            token_name = rate_limiter.acquire_any([candidate], priority)
+        if token_name is None:
+            return None, None
+        return self._services[token_name], token_name
+
+    def mark_rate_limited(self, token_name):
+        with self._lock:
+            if token_name not in self._services:
+                return
+            self._cooldown_until[token_name] = time.monotonic() + self.cooldown
+        log_warning(self.log_file, "credential_pool", token_name, "cooldown", f"⏸️ Токен {token_name} получил 429, пауза {self.cooldown} сек.")
+
+
+def resolve_service(service, token_name, priority=PRIORITY_HIGH):
+    """
+    Сервис и токен под запрос с учётом rate_limiter: для пула — любой токен с бюджетом,
+    одиночный сервис — как есть. (None, None) — запрос нужно отложить.
+    """
+    if isinstance(service, CredentialPool):
+        return service.acquire(priority)
+    if rate_limiter.acquire(token_name, priority):
+        return service, token_name
+    return None, None
+
+
+def report_rate_limited(service, token_name):
+    if isinstance(service, CredentialPool):
+        service.mark_rate_limited(token_name)
+
+
+def token_names(service, token_name):
+    """Имена токенов, по которым может уйти запрос через service."""
+    if isinstance(service, CredentialPool):
+        return service.names
+    return [token_name]
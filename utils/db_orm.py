@@ -1,8 +1,11 @@
 # utils/db_orm.py
 
 import json
-from sqlalchemy import func
-from database.db_models import SheetsInfo, RotationsInfo
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import func, update, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from database.db_models import SheetsInfo, RotationsInfo, WrittenRange
 from utils.logger import (
     log_info, log_success, log_error, log_section, log_separator
 )
@@ -19,10 +22,90 @@ def get_model_by_table_name(table_name: str):
     return model
 
 
+class TaskWriteBuffer:
+    """
+    Отложенная запись состояния задач на время фазы.
+
+    Пока буфер открыт (with TaskWriteBuffer(session):), update_task_*_fields не выполняют
+    UPDATE сразу, а складывают значения по (таблица, id); повторные записи одной задачи
+    сливаются. flush() пишет их одним executemany UPDATE ... WHERE id = :id на таблицу
+    и набор колонок и делает один commit — число запросов за фазу не зависит от числа задач.
+    Если пакет не прошёл, строки пишутся поштучно, чтобы одна задача не откатила остальные.
+    """
+
+    SESSION_KEY = "task_write_buffer"
+
+    def __init__(self, session, log_file=None):
+        self.session = session
+        self.log_file = log_file
+        self._pending = {}  # (model, id) -> {колонка: значение}
+
+    def stage(self, model, task_id, values):
+        self._pending.setdefault((model, task_id), {}).update(values)
+
+    def flush(self):
+        if not self._pending:
+            return
+        batches = defaultdict(list)
+        for (model, task_id), values in self._pending.items():
+            batches[(model, tuple(sorted(values)))].append({"id": task_id, **values})
+        self._pending = {}
+
+        try:
+            for (model, _), rows in batches.items():
+                self.session.execute(update(model), rows)
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            log_error(self.log_file, "task_write_buffer", None, "batch_fail", "❌ Пакетная запись задач не удалась, пишем поштучно", exc=e)
+            for (model, _), rows in batches.items():
+                for row in rows:
+                    try:
+                        self.session.execute(update(model), [row])
+                        self.session.commit()
+                    except Exception as row_error:
+                        self.session.rollback()
+                        log_error(self.log_file, "task_write_buffer", None, "row_fail", f"❌ Не удалось сохранить задачу {model.__tablename__}#{row['id']}", exc=row_error)
+
+    def __enter__(self):
+        self.session.info[self.SESSION_KEY] = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.session.info.pop(self.SESSION_KEY, None)
+        self.flush()
+        return False
+
+
+def _write_task_fields(session, model, task_id, values):
+    buffer = session.info.get(TaskWriteBuffer.SESSION_KEY)
+    if buffer is not None:
+        buffer.stage(model, task_id, values)
+    else:
+        session.query(model).filter(model.id == task_id).update(values)
+
+
+def fetch_task_values_json(task_id, table_name: str = "SheetsInfo"):
+    """Сохранённый values_json одной задачи (колонка не выбирается при загрузке задач)."""
+    from database.session import get_session
+    model = get_model_by_table_name(table_name)
+
+    with get_session() as session:
+        return session.query(model.values_json).filter(model.id == task_id).scalar()
+
+
+def fetch_tasks_values_json(session, task_ids, table_name: str = "SheetsInfo"):
+    """Сохранённые values_json нескольких задач одним запросом: {id: values_json}."""
+    if not task_ids:
+        return {}
+    model = get_model_by_table_name(table_name)
+    return dict(session.query(model.id, model.values_json).filter(model.id.in_(task_ids)).all())
+
+
 def update_task_scan_fields(session, task, log_file=None, table_name: str = "SheetsInfo"):
     model = get_model_by_table_name(table_name)
 
-    session.query(model).filter(model.id == task.id).update({
+    _write_task_fields(session, model, task.id, {
         "last_scan": task.last_scan.isoformat() if task.last_scan else None,
         "scan_quantity": task.scan_quantity,
         "scan_failures": task.scan_failures
@@ -41,23 +124,111 @@ def update_task_process_fields(session, task, log_file=None, table_name: str = "
     if table_name == "SheetsInfo":
         values_json_value = values_json_data if values_json_data else None
     else:
-        values_json_value = json.dumps(values_json_data) if values_json_data else None
+        # Сериализация, уже построенная при хэшировании в check_for_update
+        serialized = getattr(task, "serialized_values", None)
+        values_json_value = (serialized or json.dumps(values_json_data)) if values_json_data else None
 
-    session.query(model).filter(model.id == task.id).update({
+    _write_task_fields(session, model, task.id, {
         "hash": task.hash,
         "values_json": values_json_value
     })
 
 
+def update_task_hash_field(session, task, log_file=None, table_name: str = "SheetsInfo"):
+    """Сохраняет только hash: старый MD5 заменён на BLAKE2b, данные не менялись."""
+    model = get_model_by_table_name(table_name)
+
+    _write_task_fields(session, model, task.id, {
+        "hash": task.hash
+    })
+
+
+def update_task_schedule_fields(session, task, log_file=None, table_name: str = "SheetsInfo"):
+    """Сохраняет состояние адаптивного интервала (только для задач с границами в шаблоне)."""
+    if not task.is_adaptive():
+        return
+    model = get_model_by_table_name(table_name)
+
+    _write_task_fields(session, model, task.id, {
+        "last_change": task.last_change.isoformat() if task.last_change else None,
+        "change_interval_ewma": task.change_interval_ewma,
+        "effective_scan_interval": task.effective_scan_interval
+    })
+
 def update_task_update_fields(session, task, log_file=None, table_name: str = "SheetsInfo"):
     model = get_model_by_table_name(table_name)
 
-    session.query(model).filter(model.id == task.id).update({
+    _write_task_fields(session, model, task.id, {
         "last_update": task.last_update.isoformat() if task.last_update else None,
         "update_quantity": task.update_quantity,
         "update_failures": task.update_failures
     })
 
+_WRITTEN_RANGE_KEY = (WrittenRange.spreadsheet_id, WrittenRange.sheet_name, WrittenRange.start_row, WrittenRange.start_col)
+
+
+def _query_written_ranges(session, keys, for_update=False, full_write_interval=None):
+    if full_write_interval:
+        full_fresh = WrittenRange.full_written_at > func.now() - timedelta(seconds=full_write_interval)
+    else:
+        full_fresh = WrittenRange.full_written_at.isnot(None)
+    query = session.query(WrittenRange, full_fresh).filter(tuple_(*_WRITTEN_RANGE_KEY).in_(list(keys)))
+    if for_update:
+        # Один порядок блокировки у всех воркеров — без взаимных блокировок
+        query = query.order_by(*_WRITTEN_RANGE_KEY).with_for_update(of=WrittenRange)
+    return {
+        (row.spreadsheet_id, row.sheet_name, row.start_row, row.start_col): (row.rows, row.cols, row.hash, bool(fresh))
+        for row, fresh in query.all()
+    }
+
+
+def read_written_ranges(session, keys, full_write_interval=None):
+    """
+    Размер и хэш последней записи по ключам (spreadsheet_id, лист, строка, колонка), без блокировки.
+
+    Returns:
+        dict: {key: (rows, cols, hash, full_fresh)} для уже записанных диапазонов;
+            full_fresh — последняя полная запись моложе full_write_interval сек.
+    """
+    if not keys:
+        return {}
+    return _query_written_ranges(session, keys, full_write_interval=full_write_interval)
+
+
+def lock_written_ranges(session, keys):
+    """
+    То же, что read_written_ranges, но строки берутся под FOR UPDATE до конца транзакции.
+    Строки новых диапазонов сначала вставляются пустыми (ON CONFLICT DO NOTHING) —
+    иначе первую запись в диапазон нечем заблокировать.
+    """
+    if not keys:
+        return {}
+    session.execute(insert(WrittenRange).values([
+        {"spreadsheet_id": spreadsheet_id, "sheet_name": sheet_name, "start_row": start_row, "start_col": start_col}
+        for spreadsheet_id, sheet_name, start_row, start_col in sorted(keys)
+    ]).on_conflict_do_nothing(index_elements=["spreadsheet_id", "sheet_name", "start_row", "start_col"]))
+    return _query_written_ranges(session, keys, for_update=True)
+
+
+def save_written_ranges(session, written):
+    """Сохраняет размер и хэш записанных данных: {key: (rows, cols, hash, полная ли запись)}."""
+    if not written:
+        return
+    stmt = insert(WrittenRange).values([
+        {"spreadsheet_id": spreadsheet_id, "sheet_name": sheet_name, "start_row": start_row, "start_col": start_col,
+         "rows": rows, "cols": cols, "hash": grid_hash, "full_written_at": func.now() if full else None}
+        for (spreadsheet_id, sheet_name, start_row, start_col), (rows, cols, grid_hash, full) in written.items()
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["spreadsheet_id", "sheet_name", "start_row", "start_col"],
+        set_={
+            "rows": stmt.excluded.rows, "cols": stmt.excluded.cols, "hash": stmt.excluded.hash, "updated_at": func.now(),
+            # Запись изменённых ячеек не продлевает срок полной записи
+            "full_written_at": func.coalesce(stmt.excluded.full_written_at, WrittenRange.full_written_at),
+        },
+    ))
+
+
 def get_max_last_row(session, table_name: str) -> int:
     """
     Возвращает максимальный last_row из MistakeStorage для заданной таблицы.
@@ -0,0 +1,413 @@
+# utils/fake_sheets_server.py
+
+"""
+Локальная замена Google Sheets API v4 для нагрузочных прогонов и профилирования
+сканеров без расхода квоты.
+
+Поддерживаются эндпоинты, которые использует проект:
+    GET  v4/spreadsheets/{id}                      (spreadsheets.get)
+    GET  v4/spreadsheets/{id}/values:batchGet      (values.batchGet)
+    POST v4/spreadsheets/{id}/values:batchClear    (values.batchClear)
+    POST v4/spreadsheets/{id}/values:batchUpdate   (values.batchUpdate)
+    POST v4/spreadsheets/{id}:batchUpdate          (spreadsheets.batchUpdate, repeatCell)
+
+Запуск:
+    python -m utils.fake_sheets_server --port 8765 --seed workbook.json --latency 0.05 --error-429 0.02
+и SHEETS_API_ENDPOINT=http://127.0.0.1:8765 для сканеров — load_credentials
+будет строить сервисы на этот адрес.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from utils.a1_notation import parse_range, format_range
+
+DEFAULT_ROWS = 1000
+DEFAULT_COLS = 26
+
+_PATH_RE = re.compile(r"/v4/spreadsheets/([^/:]+)(/values:(batchGet|batchClear|batchUpdate)|:(batchUpdate))?$")
+
+
+##################################################################################
+# Модель книги в памяти
+##################################################################################
+
+class FakeSheet:
+    def __init__(self, sheet_id, title, rows=DEFAULT_ROWS, cols=DEFAULT_COLS):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}  # (row0, col0) -> value
+        self.formats = Counter()  # число применённых repeatCell по диапазонам
+
+    def _bounds(self, parsed):
+        r0 = (parsed.start_row or 1) - 1
+        c0 = parsed.start_col or 0
+        r1 = (parsed.end_row or self.row_count) - 1
+        c1 = parsed.end_col if parsed.end_col is not None else self.col_count - 1
+        return r0, c0, min(r1, self.row_count - 1), min(c1, self.col_count - 1)
+
+    def read(self, parsed):
+        """Значения диапазона без хвостовых пустых строк и колонок, как отдаёт API."""
+        r0, c0, r1, c1 = self._bounds(parsed)
+        rows = []
+        for r in range(r0, r1 + 1):
+            row = [self.cells.get((r, c), "") for c in range(c0, c1 + 1)]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return format_range(self.title, c0, r0 + 1, c1, r1 + 1), rows
+
+    def write(self, parsed, values):
+        r0 = (parsed.start_row or 1) - 1
+        c0 = parsed.start_col or 0
+        updated = 0
+        for dr, row in enumerate(values):
+            for dc, value in enumerate(row):
+                r, c = r0 + dr, c0 + dc
+                if value == "" or value is None:
+                    self.cells.pop((r, c), None)
+                else:
+                    self.cells[(r, c)] = value if isinstance(value, str) else str(value)
+                updated += 1
+        self.row_count = max(self.row_count, r0 + len(values))
+        self.col_count = max(self.col_count, c0 + max((len(row) for row in values), default=0))
+        last_row = r0 + max(len(values), 1)
+        last_col = c0 + max((len(row) for row in values), default=1)
+        return format_range(self.title, c0, r0 + 1, last_col - 1, last_row), updated
+
+    def clear(self, parsed):
+        r0, c0, r1, c1 = self._bounds(parsed)
+        for key in [k for k in self.cells if r0 <= k[0] <= r1 and c0 <= k[1] <= c1]:
+            del self.cells[key]
+        return format_range(self.title, c0, r0 + 1, c1, r1 + 1)
+
+
+class FakeWorkbook:
+    """Набор таблиц: spreadsheet_id -> {title: FakeSheet}."""
+
+    def __init__(self):
+        self.spreadsheets = {}
+        self._next_sheet_id = 1
+        self.lock = threading.RLock()
+
+    def add_sheet(self, spreadsheet_id, title, values=None, rows=DEFAULT_ROWS, cols=DEFAULT_COLS):
+        with self.lock:
+            sheets = self.spreadsheets.setdefault(spreadsheet_id, {})
+            sheet = sheets.get(title)
+            if sheet is None:
+                sheet = FakeSheet(self._next_sheet_id, title, rows, cols)
+                self._next_sheet_id += 1
+                sheets[title] = sheet
+            if values:
+                sheet.write(parse_range("A1"), values)
+            return sheet
+
+    def load(self, data):
+        """{"spreadsheet_id": {"Лист": [[...], ...]}} -> книга."""
+        for spreadsheet_id, sheets in data.items():
+            for title, values in sheets.items():
+                self.add_sheet(spreadsheet_id, title, values)
+
+    def sheet(self, spreadsheet_id, parsed):
+        sheets = self.spreadsheets.get(spreadsheet_id, {})
+        if parsed.sheet is None:
+            return next(iter(sheets.values()), None)
+        return sheets.get(parsed.sheet)
+
+
+##################################################################################
+# HTTP-сервер
+##################################################################################
+
+class FakeApiError(Exception):
+    def __init__(self, status, message, reason="", details=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.details = details or []
+
+    def body(self):
+        return {"error": {"code": self.status, "message": str(self), "status": self.reason, "details": self.details}}
+
+
+class FakeSheetsServer:
+    """
+    Сервер поверх FakeWorkbook с настраиваемой задержкой, квотой и внедрением ошибок.
+
+    Args:
+        latency: Задержка ответа в секундах или (min, max).
+        quota_per_minute: Лимит запросов в минуту на токен (заголовок Authorization); None — без лимита.
+        error_rates: {429: p, 500: p, "ssl": p} — вероятность ошибки на запрос.
+            "ssl" обрывает соединение без ответа.
+    """
+
+    def __init__(self, workbook=None, host="127.0.0.1", port=0, latency=0.0,
+                 quota_per_minute=None, error_rates=None, seed=None):
+        self.workbook = workbook or FakeWorkbook()
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.error_rates = error_rates or {}
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self._calls = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-sheets", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- имитация сети и квоты ---
+
+    def _sleep(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _check_quota(self, token):
+        if not self.quota_per_minute:
+            return
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls[token]
+            while calls and now - calls[0] >= 60:
+                calls.popleft()
+            if len(calls) >= self.quota_per_minute:
+                raise FakeApiError(429, "Quota exceeded for quota metric 'Read requests'", "RESOURCE_EXHAUSTED")
+            calls.append(now)
+
+    def _injected_error(self):
+        """Возвращает "ssl", код HTTP-ошибки или None."""
+        with self._lock:
+            for kind, rate in self.error_rates.items():
+                if rate and self.random.random() < rate:
+                    return kind
+        return None
+
+    # --- обработчики эндпоинтов ---
+
+    def _get_spreadsheet(self, spreadsheet_id, query, body):
+        sheets = self.workbook.spreadsheets.get(spreadsheet_id)
+        if sheets is None:
+            raise FakeApiError(404, "Requested entity was not found.", "NOT_FOUND")
+        return {
+            "spreadsheetId": spreadsheet_id,
+            "properties": {"title": spreadsheet_id},
+            "sheets": [
+                {"properties": {
+                    "sheetId": sheet.sheet_id,
+                    "title": sheet.title,
+                    "index": index,
+                    "gridProperties": {"rowCount": sheet.row_count, "columnCount": sheet.col_count},
+                }}
+                for index, sheet in enumerate(sheets.values())
+            ],
+        }
+
+    def _resolve(self, spreadsheet_id, range_str):
+        if spreadsheet_id not in self.workbook.spreadsheets:
+            raise FakeApiError(404, "Requested entity was not found.", "NOT_FOUND")
+        try:
+            parsed = parse_range(range_str)
+        except ValueError:
+            raise FakeApiError(400, f"Unable to parse range: {range_str}", "INVALID_ARGUMENT")
+        sheet = self.workbook.sheet(spreadsheet_id, parsed)
+        if sheet is None:
+            raise FakeApiError(400, f"Unable to parse range: {range_str}", "INVALID_ARGUMENT")
+        return sheet, parsed
+
+    def _batch_get(self, spreadsheet_id, query, body):
+        value_ranges = []
+        for range_str in query.get("ranges", []):
+            sheet, parsed = self._resolve(spreadsheet_id, range_str)
+            response_range, values = sheet.read(parsed)
+            item = {"range": response_range, "majorDimension": "ROWS"}
+            if values:
+                item["values"] = values
+            value_ranges.append(item)
+        return {"spreadsheetId": spreadsheet_id, "valueRanges": value_ranges}
+
+    def _batch_clear(self, spreadsheet_id, query, body):
+        cleared = []
+        for range_str in body.get("ranges", []):
+            sheet, parsed = self._resolve(spreadsheet_id, range_str)
+            cleared.append(sheet.clear(parsed))
+        return {"spreadsheetId": spreadsheet_id, "clearedRanges": cleared}
+
+    def _batch_update_values(self, spreadsheet_id, query, body):
+        responses, total = [], 0
+        for item in body.get("data", []):
+            sheet, parsed = self._resolve(spreadsheet_id, item["range"])
+            updated_range, updated = sheet.write(parsed, item.get("values", []))
+            total += updated
+            responses.append({"spreadsheetId": spreadsheet_id, "updatedRange": updated_range, "updatedCells": updated})
+        return {"spreadsheetId": spreadsheet_id, "totalUpdatedCells": total, "responses": responses}
+
+    def _batch_update(self, spreadsheet_id, query, body):
+        sheets = self.workbook.spreadsheets.get(spreadsheet_id)
+        if sheets is None:
+            raise FakeApiError(404, "Requested entity was not found.", "NOT_FOUND")
+        by_id = {sheet.sheet_id: sheet for sheet in sheets.values()}
+        replies = []
+        for request in body.get("requests", []):
+            repeat = request.get("repeatCell")
+            if repeat:
+                grid = repeat.get("range", {})
+                sheet = by_id.get(grid.get("sheetId"))
+                if sheet is None:
+                    raise FakeApiError(400, f"No grid with id: {grid.get('sheetId')}", "INVALID_ARGUMENT")
+                key = (grid.get("startRowIndex"), grid.get("endRowIndex"), grid.get("startColumnIndex"), grid.get("endColumnIndex"))
+                sheet.formats[key] += 1
+            replies.append({})
+        return {"spreadsheetId": spreadsheet_id, "replies": replies}
+
+    def dispatch(self, method, path, query, body, token):
+        """Обрабатывает запрос и возвращает (status, payload); payload None — оборвать соединение."""
+        match = _PATH_RE.search(unquote(path))
+        if not match:
+            return 404, FakeApiError(404, f"Unknown path: {path}", "NOT_FOUND").body()
+
+        spreadsheet_id, values_op, sheet_op = match.group(1), match.group(3), match.group(4)
+        handlers = {
+            ("GET", None, None): ("spreadsheets.get", self._get_spreadsheet),
+            ("GET", "batchGet", None): ("values.batchGet", self._batch_get),
+            ("POST", "batchClear", None): ("values.batchClear", self._batch_clear),
+            ("POST", "batchUpdate", None): ("values.batchUpdate", self._batch_update_values),
+            ("POST", None, "batchUpdate"): ("spreadsheets.batchUpdate", self._batch_update),
+        }
+        name, handler = handlers.get((method, values_op, sheet_op), (None, None))
+        if handler is None:
+            return 405, FakeApiError(405, f"Method not allowed: {method} {path}", "METHOD_NOT_ALLOWED").body()
+
+        self._sleep()
+        with self._lock:
+            self.stats[name] += 1
+
+        try:
+            injected = self._injected_error()
+            if injected == "ssl":
+                with self._lock:
+                    self.stats["injected_ssl"] += 1
+                return None, None
+            if injected == 429:
+                with self._lock:
+                    self.stats["injected_429"] += 1
+                raise FakeApiError(429, "Rate limit exceeded", "RESOURCE_EXHAUSTED",
+                                   [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}])
+            if injected:
+                with self._lock:
+                    self.stats[f"injected_{injected}"] += 1
+                raise FakeApiError(int(injected), "Internal error encountered.", "INTERNAL")
+
+            self._check_quota(token)
+            with self.workbook.lock:
+                return 200, handler(spreadsheet_id, query, body)
+        except FakeApiError as e:
+            with self._lock:
+                self.stats[f"status_{e.status}"] += 1
+            return e.status, e.body()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else {}
+                except json.JSONDecodeError:
+                    body = {}
+                token = self.headers.get("Authorization", "")
+
+                status, payload = server.dispatch(method, parsed.path, parse_qs(parsed.query), body, token)
+                if status is None:
+                    # Имитация обрыва TLS: закрываем соединение без ответа
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальный фейковый Google Sheets API v4")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", help="JSON-файл с содержимым книги: {spreadsheet_id: {лист: [[...]]}}")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=None, help="Запросов в минуту на токен")
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-500", type=float, default=0.0)
+    parser.add_argument("--error-ssl", type=float, default=0.0)
+    args = parser.parse_args()
+
+    workbook = FakeWorkbook()
+    if args.seed:
+        with open(args.seed, encoding="utf-8") as f:
+            workbook.load(json.load(f))
+
+    fake = FakeSheetsServer(
+        workbook, args.host, args.port, args.latency, args.quota,
+        {429: args.error_429, 500: args.error_500, "ssl": args.error_ssl},
+    )
+    print(f"🧪 Fake Sheets API: {fake.endpoint}")
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        fake._httpd.server_close()
+        print("📊 Статистика:", dict(fake.stats))
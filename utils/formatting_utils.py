@@ -1,7 +1,10 @@
 # utils/formatting_utils.py
 
-import time
 import socket
+import threading
+from utils.sheets_metadata import metadata_cache
+from utils.rate_limiter import PRIORITY_LOW
+from utils.retry_policy import execute_sheets_request, QuotaExhaustedError, CircuitOpenError
 # from utils.db_orm import insert_usage
 from utils.logger import (
     log_info, log_success, log_warning, log_error, log_section, log_separator
@@ -406,6 +409,29 @@ def build_formatting_requests(values, sheet_id, start_row=0, start_col=3, log_fi
     # log_to_file(log_file, f"✅ Сформировано {len(requests)} форматирующих запросов.")
     return requests
 
+# ⏸️ Форматирование, не выполненное из-за лимита API: (spreadsheet_id, лист) -> аргументы
+# последнего вызова. Повторяется на следующем цикле сканера (retry_deferred_formats).
+_deferred_formats = {}
+_deferred_lock = threading.Lock()
+
+
+def _defer_format(spreadsheet_id, sheet_title, **kwargs):
+    with _deferred_lock:
+        _deferred_formats[(spreadsheet_id, sheet_title)] = kwargs
+
+
+def retry_deferred_formats(service, token_name, log_file, session=None):
+    """Повторяет отложенное форматирование; снова упёршееся в лимит опять откладывается."""
+    with _deferred_lock:
+        pending = list(_deferred_formats.items())
+        _deferred_formats.clear()
+    for (spreadsheet_id, sheet_title), kwargs in pending:
+        log_info(log_file, "format_sheet", None, "retry_deferred", f"🔁 Повтор отложенного форматирования '{sheet_title}'")
+        try:
+            format_sheet(service, spreadsheet_id, sheet_title, token_name=token_name, log_file=log_file, session=session, **kwargs)
+        except Exception as e:
+            log_error(log_file, "format_sheet", None, "retry_fail", f"❌ Ошибка повтора форматирования '{sheet_title}'", exc=e)
+
 # 🚀 Полный цикл применения форматирования по значениям
 def format_sheet(
     service,
@@ -420,6 +446,10 @@ def format_sheet(
     start_col=3,
     chunk_size=1500
 ):
+    # Свежие значения заменяют отложенное форматирование того же листа
+    with _deferred_lock:
+        _deferred_formats.pop((spreadsheet_id, sheet_title), None)
+
     try:
         log_section(log_file, "format_sheet", f"🎨 Подготовка форматирования листа '{sheet_title}'")
         
@@ -428,17 +458,14 @@ def format_sheet(
             log_error(log_file, "format_sheet", None, "invalid_data", "❌ Некорректные входные данные для форматирования.")
             return
 
-        sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheet_id = next(
-            (s["properties"]["sheetId"] for s in sheet_metadata["sheets"]
-             if s["properties"]["title"] == sheet_title),
-            None
-        )
+        sheet_id = metadata_cache.get_sheet_id(service, spreadsheet_id, sheet_title, log_file, token_name)
         if sheet_id is None:
             raise ValueError(f"❌ Лист '{sheet_title}' не найден")
 
         try:
-            formatting_requests = build_formatting_requests(values, sheet_id, start_row, start_col, log_file)
+            # Большие листы собираются в пуле процессов (core.process_pool), если он включён
+            from core.process_pool import build_formatting_requests as build_requests
+            formatting_requests = build_requests(values, sheet_id, start_row, start_col)
         except Exception as e:
             log_error(log_file, "format_sheet", None, "build_requests_fail", f"❌ Ошибка при создании запросов форматирования: {e}")
             return
@@ -447,20 +474,26 @@ def format_sheet(
 
         for i in range(0, len(formatting_requests), chunk_size):
             chunk = formatting_requests[i:i + chunk_size]
-            for attempt in range(3):
-                try:
-                    service.spreadsheets().batchUpdate(
+            try:
+                # Форматирование — низкий приоритет: при приближении к лимиту откладываем
+                execute_sheets_request(
+                    service, token_name, spreadsheet_id,
+                    lambda client: client.spreadsheets().batchUpdate(
                         spreadsheetId=spreadsheet_id,
                         body={"requests": chunk}
-                    ).execute()
-                    log_info(log_file, "format_sheet", None, "batch", f"✅ Отправлена порция форматирования {i}–{i + len(chunk)}.")
-                    break
-                except (socket.timeout, Exception) as e:
-                    log_error(log_file, "format_sheet", None, "fail", f"❌ Попытка {attempt + 1} — ошибка в порции {i}–{i + len(chunk)}", exc=e)
-                    if attempt < 2:
-                        time.sleep(5)
-                    else:
-                        success = False
+                    ),
+                    log_file, "format_sheet", priority=PRIORITY_LOW
+                )
+                log_info(log_file, "format_sheet", None, "batch", f"✅ Отправлена порция форматирования {i}–{i + len(chunk)}.")
+            except (QuotaExhaustedError, CircuitOpenError) as e:
+                # Лист форматируется целиком заново: порции идемпотентны
+                _defer_format(spreadsheet_id, sheet_title, values=values, update_group=update_group,
+                              start_row=start_row, start_col=start_col, chunk_size=chunk_size)
+                log_warning(log_file, "format_sheet", None, "deferred", f"⏸️ Форматирование '{sheet_title}' отложено до следующего цикла: {e}")
+                return
+            except (socket.timeout, Exception) as e:
+                log_error(log_file, "format_sheet", None, "fail", f"❌ Ошибка в порции {i}–{i + len(chunk)}", exc=e)
+                success = False
 
         if success:
             log_success(log_file, "format_sheet", None, "done", f"✅ Форматирование листа '{sheet_title}' завершено успешно.")
@@ -0,0 +1,81 @@
+# utils/grid_diff.py
+
+from core.config import GRID_DIFF_MAX_RATIO, GRID_DIFF_MAX_RANGES
+
+
+def _cell(row, c):
+    if c >= len(row):
+        return ""
+    value = row[c]
+    return "" if value is None else str(value)
+
+
+def _raw_cell(row, c):
+    if c >= len(row) or row[c] is None:
+        return ""
+    return row[c]
+
+
+def diff_rectangles(old, new, max_ratio=GRID_DIFF_MAX_RATIO, max_ranges=GRID_DIFF_MAX_RANGES):
+    """
+    Сравнивает две таблицы (списки списков) и возвращает минимальный набор
+    изменённых прямоугольников: [(row, col, values)], где row/col — смещения от
+    левого верхнего угла, values — новые значения (хвост, вышедший из новой таблицы,
+    затирается пустыми строками).
+
+    Returns:
+        list | None: Прямоугольники, [] если изменений нет, None если выгоднее полная запись.
+    """
+    rows = max(len(old), len(new))
+    cols = max(max((len(r) for r in old), default=0), max((len(r) for r in new), default=0))
+    total = rows * cols
+    if not total:
+        return []
+
+    empty = []
+    changed_cells = 0
+    # Открытые прямоугольники: (c0, c1) -> [r0, r1]
+    open_rects = {}
+    rects = []
+
+    for r in range(rows):
+        old_row = old[r] if r < len(old) else empty
+        new_row = new[r] if r < len(new) else empty
+
+        # Отрезки изменённых колонок в строке
+        spans = []
+        c = 0
+        while c < cols:
+            if _cell(old_row, c) != _cell(new_row, c):
+                start = c
+                while c < cols and _cell(old_row, c) != _cell(new_row, c):
+                    c += 1
+                spans.append((start, c - 1))
+                changed_cells += c - start
+            else:
+                c += 1
+
+        # Продлеваем прямоугольники с тем же отрезком колонок, остальные закрываем
+        next_open = {}
+        for span in spans:
+            if span in open_rects and open_rects[span][1] == r - 1:
+                open_rects[span][1] = r
+                next_open[span] = open_rects.pop(span)
+            else:
+                next_open[span] = [r, r]
+        rects.extend((bounds[0], bounds[1], span) for span, bounds in open_rects.items())
+        open_rects = next_open
+
+        if changed_cells > total * max_ratio or len(rects) + len(open_rects) > max_ranges:
+            return None
+
+    rects.extend((bounds[0], bounds[1], span) for span, bounds in open_rects.items())
+
+    result = []
+    for r0, r1, (c0, c1) in sorted(rects):
+        values = [
+            [_raw_cell(new[r] if r < len(new) else empty, c) for c in range(c0, c1 + 1)]
+            for r in range(r0, r1 + 1)
+        ]
+        result.append((r0, c0, values))
+    return result
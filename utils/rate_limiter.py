@@ -0,0 +1,111 @@
+# utils/rate_limiter.py
+
+import threading
+import time
+from datetime import date
+
+from core.config import API_LIMIT_PER_DAY, THRESHOLD, API_LIMIT_PER_MINUTE
+
+PRIORITY_HIGH = "high"  # чтение/запись данных
+PRIORITY_LOW = "low"    # форматирование и прочая необязательная работа
+
+
+class _TokenBudget:
+    """Бюджет одного токена: token bucket на минуту + счётчик за сутки."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+        self.day = date.today()
+        self.day_count = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.day_count = 0
+
+
+class RateLimiter:
+    """
+    Общий для процесса лимитер запросов к Sheets API по токенам.
+    acquire() блокирует до появления минутного бюджета и возвращает False,
+    если запрос нужно отложить: дневной лимит исчерпан, либо достигнут THRESHOLD
+    и запрос низкоприоритетный. acquire_any() — то же для набора токенов пула.
+    """
+
+    def __init__(self, per_minute=API_LIMIT_PER_MINUTE, per_day=API_LIMIT_PER_DAY, threshold=THRESHOLD):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.threshold = threshold
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, token_name):
+        budget = self._budgets.get(token_name)
+        if budget is None:
+            budget = self._budgets[token_name] = _TokenBudget(self.per_minute)
+        return budget
+
+    def _exhausted(self, budget, priority):
+        if budget.day_count >= self.per_day:
+            return True
+        return priority == PRIORITY_LOW and budget.day_count >= self.threshold
+
+    def acquire(self, token_name, priority=PRIORITY_HIGH):
+        return self.acquire_any([token_name], priority) is not None
+
+    def acquire_any(self, token_names, priority=PRIORITY_HIGH):
+        """
+        Берёт запрос из бюджета одного из токенов: с минутным бюджетом, наименьшим расходом
+        за сутки, среди равных — с наибольшим запасом на минуту. Ждёт, только если минутный
+        бюджет пуст у всех токенов с дневным запасом.
+
+        Returns:
+            str | None: имя токена; None — запрос нужно отложить у всех токенов.
+        """
+        while True:
+            with self._lock:
+                candidates = []
+                for token_name in token_names:
+                    budget = self._budget(token_name)
+                    budget.refill()
+                    if not self._exhausted(budget, priority):
+                        candidates.append((token_name, budget))
+                if not candidates:
+                    return None
+                ready = [(name, budget) for name, budget in candidates if budget.tokens >= 1]
+                if ready:
+                    token_name, budget = min(ready, key=lambda item: (item[1].day_count, -item[1].tokens))
+                    budget.tokens -= 1
+                    budget.day_count += 1
+                    return token_name
+                wait = min((1 - budget.tokens) / budget.rate for _, budget in candidates)
+            time.sleep(wait)
+
+    def available(self, token_names):
+        """Сколько запросов токены могут выполнить прямо сейчас без ожидания."""
+        with self._lock:
+            total = 0
+            for token_name in token_names:
+                budget = self._budget(token_name)
+                budget.refill()
+                if budget.day_count < self.per_day:
+                    total += int(budget.tokens)
+            return total
+
+    def usage(self, token_name):
+        """Возвращает (израсходовано за сутки, дневной лимит) для токена."""
+        with self._lock:
+            budget = self._budget(token_name)
+            budget.refill()
+            return budget.day_count, self.per_day
+
+
+# Общий лимитер для всех сканеров процесса
+rate_limiter = RateLimiter()
@@ -0,0 +1,166 @@
+# utils/retry_policy.py
+
+import json
+import random
+import re
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from core.config import (
+    RETRIES,
+    DELAY_SECONDS,
+    RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_COOLDOWN_SECONDS,
+)
+from utils.credential_pool import resolve_service, report_rate_limited, token_names
+from utils.rate_limiter import PRIORITY_HIGH
+from utils.logger import log_warning
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+TRANSIENT_ERROR_TERMS = ("ssl", "handshake", "decryption", "timed out", "connection reset", "remote end closed")
+
+
+class QuotaExhaustedError(RuntimeError):
+    """Лимитер не выдал бюджет: дневной лимит исчерпан или низкоприоритетный запрос отложен."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Таблица временно отклоняет запросы — вызов не выполняется до конца паузы."""
+
+
+def error_status(error):
+    return getattr(getattr(error, "resp", None), "status", None)
+
+
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        return error_status(error) in RETRYABLE_STATUSES
+    msg = str(error).lower()
+    return any(term in msg for term in TRANSIENT_ERROR_TERMS)
+
+
+def retry_after_seconds(error):
+    """Подсказка сервера о паузе: заголовок Retry-After или RetryInfo.retryDelay в теле ошибки."""
+    resp = getattr(error, "resp", None)
+    header = resp.get("retry-after") if hasattr(resp, "get") else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+
+    content = getattr(error, "content", None)
+    if not content:
+        return None
+    try:
+        payload = json.loads(content.decode("utf-8") if isinstance(content, bytes) else content)
+        for detail in payload.get("error", {}).get("details", []):
+            delay = detail.get("retryDelay")
+            if delay:
+                match = re.match(r"^([\d.]+)s$", str(delay))
+                if match:
+                    return float(match.group(1))
+    except Exception:
+        return None
+    return None
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза с полным джиттером; подсказка сервера имеет приоритет."""
+
+    def __init__(self, retries=RETRIES, base_delay=DELAY_SECONDS, max_delay=RETRY_MAX_DELAY):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error=None):
+        hint = retry_after_seconds(error) if error is not None else None
+        if hint is not None:
+            return min(hint, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Размыкатель по spreadsheet_id: после threshold ошибок подряд запросы к таблице
+    сразу отклоняются на cooldown секунд.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_until = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            return self._opened_until.get(key, 0.0) <= time.monotonic()
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_until.pop(key, None)
+
+    def record_failure(self, key):
+        """Возвращает True, если после этой ошибки цепь разомкнулась."""
+        with self._lock:
+            self._failures[key] = self._failures.get(key, 0) + 1
+            if self._failures[key] >= self.threshold:
+                self._failures[key] = 0
+                self._opened_until[key] = time.monotonic() + self.cooldown
+                return True
+            return False
+
+
+default_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
+
+
+def execute_sheets_request(service, token_name, spreadsheet_id, make_request, log_file=None,
+                           phase="sheets_request", priority=PRIORITY_HIGH, policy=None):
+    """
+    Единая точка выполнения запроса к Sheets API: выбор токена из пула, лимитер,
+    повторы по политике и размыкатель по таблице.
+
+    Args:
+        make_request: Функция client -> HttpRequest (без .execute()).
+
+    Raises:
+        CircuitOpenError, QuotaExhaustedError или исходная ошибка после исчерпания попыток.
+    """
+    policy = policy or default_policy
+    attempt = 0
+
+    while True:
+        if not circuit_breaker.allow(spreadsheet_id):
+            raise CircuitOpenError(f"❌ Таблица {spreadsheet_id} временно отклоняет запросы")
+
+        client, used_token = resolve_service(service, token_name, priority)
+        if client is None:
+            raise QuotaExhaustedError(f"❌ Нет бюджета API ни у одного токена: {', '.join(map(str, token_names(service, token_name)))}")
+
+        try:
+            result = make_request(client).execute()
+            circuit_breaker.record_success(spreadsheet_id)
+            return result
+        except Exception as e:
+            if error_status(e) == 429:
+                report_rate_limited(service, used_token)
+            if not is_retryable(e):
+                raise
+
+            attempt += 1
+            opened = circuit_breaker.record_failure(spreadsheet_id)
+            if opened and log_file:
+                log_warning(log_file, phase, None, "circuit_open", f"⛔ Таблица {spreadsheet_id}: пауза {circuit_breaker.cooldown} сек. после серии ошибок")
+            if opened or attempt >= policy.retries:
+                raise
+
+            delay = policy.delay(attempt, e)
+            if log_file:
+                log_warning(log_file, phase, None, "retry", f"🔁 Попытка {attempt}/{policy.retries} не удалась ({error_status(e) or type(e).__name__}), пауза {delay:.1f} сек.")
+            time.sleep(delay)
@@ -0,0 +1,211 @@
+# utils/service_registry.py
+
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+import httplib2
+
+from core.config import (
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_CHECK_INTERVAL,
+    SHEETS_API_ENDPOINT,
+    SHEETS_CASSETTE_MODE,
+    SHEETS_CASSETTE_PATH,
+    SHEETS_CASSETTE_REALTIME,
+)
+from utils.logger import log_info, log_success, log_error
+
+DEFAULT_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+def _parse_expiry(value):
+    """Срок действия из токен-файла -> naive UTC datetime (формат google-auth)."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).rstrip("Z"))
+        return dt.replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def read_credentials(token_path, log_file):
+    if not os.path.exists(token_path):
+        log_error(log_file, "load_credentials", None, "file_not_found", f"❌ Файл токена не найден: {token_path}")
+        raise FileNotFoundError(f"❌ Файл токена не найден: {token_path}")
+
+    try:
+        with open(token_path, encoding="utf-8") as f:
+            token = json.load(f)
+    except json.JSONDecodeError as e:
+        log_error(log_file, "load_credentials", None, "json_decode_error", f"❌ Ошибка чтения токена: {token_path}", exc=e)
+        raise RuntimeError(f"❌ Ошибка чтения токена: {token_path}") from e
+
+    try:
+        creds = Credentials(
+            # access_token — исходный формат файла, token — формат Credentials.to_json()
+            token=token.get("access_token") or token.get("token"),
+            refresh_token=token.get("refresh_token"),
+            token_uri=token.get("token_uri"),
+            client_id=token.get("client_id"),
+            client_secret=token.get("client_secret"),
+            scopes=token.get("scopes", DEFAULT_SCOPES),
+            expiry=_parse_expiry(token.get("expiry"))
+        )
+    except Exception as e:
+        log_error(log_file, "load_credentials", None, "credentials_creation_error", f"❌ Ошибка создания объекта Credentials: {token_path}", exc=e)
+        raise RuntimeError(f"❌ Ошибка создания объекта Credentials: {token_path}") from e
+
+    return creds
+
+
+def save_credentials(creds, token_path):
+    """Атомарная запись токена: временный файл в той же папке + os.replace."""
+    directory = os.path.dirname(os.path.abspath(token_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".token_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(creds.to_json())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, token_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _thread_local_request_builder(creds, wrap_http=None):
+    """
+    requestBuilder для googleapiclient: httplib2.Http не потокобезопасен, поэтому
+    каждый поток получает свой авторизованный транспорт (с переиспользованием
+    соединения внутри потока), а общий сервис можно вызывать из пула потоков.
+    """
+    local = threading.local()
+
+    def thread_http():
+        http = getattr(local, "http", None)
+        if http is None:
+            base = httplib2.Http()
+            http = local.http = AuthorizedHttp(creds, http=wrap_http(base) if wrap_http else base)
+        return http
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(thread_http(), *args, **kwargs)
+
+    return build_request, thread_http
+
+
+def build_sheets_service(creds, api_endpoint=SHEETS_API_ENDPOINT):
+    # Статический discovery-документ из пакета googleapiclient: без HTTP-запроса за схемой
+    client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+    wrap_http = None
+    if SHEETS_CASSETTE_MODE in ("record", "replay"):
+        from utils.sheets_cassette import CassetteHttp, get_cassette
+
+        cassette = get_cassette(SHEETS_CASSETTE_MODE, SHEETS_CASSETTE_PATH, SHEETS_CASSETTE_REALTIME)
+        wrap_http = lambda base: CassetteHttp(cassette, base)
+
+    build_request, thread_http = _thread_local_request_builder(creds, wrap_http)
+    return build("sheets", "v4", http=thread_http(), requestBuilder=build_request,
+                 static_discovery=True, cache_discovery=False, client_options=client_options)
+
+
+class ServiceRegistry:
+    """
+    Долгоживущий реестр сервисов Sheets API по файлам токенов.
+    Сервис строится один раз на токен; фоновый поток обновляет access token
+    за TOKEN_REFRESH_MARGIN секунд до истечения и атомарно сохраняет его в файл.
+    """
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN, check_interval=TOKEN_REFRESH_CHECK_INTERVAL):
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._entries = {}  # token_path -> {"creds", "service", "log_file", "lock"}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher = None
+
+    def get_service(self, token_path, log_file):
+        key = os.path.abspath(token_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry:
+            return entry["service"]
+
+        token_name = os.path.basename(token_path).replace("_token.json", "")
+        if SHEETS_API_ENDPOINT or SHEETS_CASSETTE_MODE == "replay":
+            # Локальный сервер или кассета: файл токена не нужен, имя токена уходит в Authorization для учёта квоты
+            creds = Credentials(token=f"fake-{token_name}")
+            entry = {"creds": creds, "log_file": log_file, "path": token_path, "lock": threading.Lock()}
+        else:
+            creds = read_credentials(token_path, log_file)
+            entry = {"creds": creds, "log_file": log_file, "path": token_path, "lock": threading.Lock()}
+            self._refresh_entry(entry, force=creds.expired)
+
+        try:
+            entry["service"] = build_sheets_service(creds)
+            log_success(log_file, "load_credentials", None, "auth", f"✅ Авторизация выполнена: {token_name}")
+        except Exception as e:
+            log_error(log_file, "load_credentials", None, "auth_fail", f"❌ Ошибка авторизации: {token_name}", exc=e)
+            raise RuntimeError(f"❌ Ошибка создания службы Google Sheets API: {token_name}") from e
+
+        with self._lock:
+            # Параллельный вызов мог успеть раньше — оставляем первый сервис
+            entry = self._entries.setdefault(key, entry)
+            self._ensure_refresher()
+        return entry["service"]
+
+    def get_credentials(self, token_path):
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(token_path))
+        return entry["creds"] if entry else None
+
+    def _needs_refresh(self, creds):
+        if not creds.refresh_token:
+            return False
+        if not creds.token or creds.expiry is None:
+            return not creds.token
+        return creds.expiry - datetime.utcnow() <= timedelta(seconds=self.refresh_margin)
+
+    def _refresh_entry(self, entry, force=False):
+        creds, log_file = entry["creds"], entry["log_file"]
+        with entry["lock"]:
+            if not (force or self._needs_refresh(creds)) or not creds.refresh_token:
+                return
+            try:
+                creds.refresh(Request())
+                log_info(log_file, "load_credentials", None, "token_refresh", "🔁 Токен успешно обновлён")
+                save_credentials(creds, entry["path"])
+                log_success(log_file, "load_credentials", None, "token_saved", "💾 Новый токен сохранён в файл")
+            except Exception as e:
+                log_error(log_file, "load_credentials", None, "refresh_fail", f"❌ Ошибка при обновлении токена", exc=e)
+                if force:
+                    raise RuntimeError("❌ Ошибка обновления токена") from e
+
+    def _ensure_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.check_interval):
+            with self._lock:
+                entries = list(self._entries.values())
+            for entry in entries:
+                self._refresh_entry(entry)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# Общий реестр процесса
+service_registry = ServiceRegistry()
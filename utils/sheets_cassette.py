@@ -0,0 +1,167 @@
+# utils/sheets_cassette.py
+
+"""
+Запись и воспроизведение HTTP-трафика Sheets API на уровне транспорта httplib2.
+
+SHEETS_CASSETTE_MODE=record — каждый запрос к v4/spreadsheets уходит в сеть как обычно,
+а пара запрос/ответ дописывается в SHEETS_CASSETTE_PATH (gzip, JSON по строке).
+SHEETS_CASSETTE_MODE=replay — ответы отдаются из кассеты без сети, в порядке записи
+для каждого запроса; с SHEETS_CASSETTE_REALTIME=1 повторяется и записанная задержка.
+
+Перехватываются все вызовы через сервис из load_credentials: batch_get, batch_update,
+check_sheet_exists (метаданные), format_sheet. Заголовки авторизации не сохраняются,
+токены в query и JSON-телах заменяются на "<redacted>".
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import httplib2
+
+REDACTED = "<redacted>"
+SECRET_KEYS = {"access_token", "refresh_token", "client_secret", "id_token", "key", "token"}
+RECORDED_PATH = "/v4/spreadsheets"
+# Заголовки ответа, которые влияют на поведение клиента (ретраи, разбор тела)
+KEPT_RESPONSE_HEADERS = ("content-type", "retry-after")
+
+
+class CassetteMissError(RuntimeError):
+    """В кассете нет ответа на запрос — прогон отличается от записанного."""
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if k in SECRET_KEYS else _redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _redact_uri(uri):
+    parts = urlsplit(uri)
+    query = [(k, REDACTED if k in SECRET_KEYS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return parts._replace(scheme="", netloc="", query=urlencode(query)).geturl()
+
+
+def _decode_body(body):
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    try:
+        return _redact(json.loads(body))
+    except ValueError:
+        return body
+
+
+def request_key(method, uri, body):
+    """Ключ запроса без хоста и секретов: одинаков при записи и воспроизведении."""
+    payload = json.dumps([method.upper(), _redact_uri(uri), _decode_body(body)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path, mode, realtime=False):
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._responses = defaultdict(list)
+        self._cursor = defaultdict(int)
+        if mode == "replay":
+            self._load()
+        elif mode == "record":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"❌ Кассета не найдена: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    self._responses[interaction["key"]].append(interaction)
+
+    def record(self, method, uri, body, response, content, elapsed):
+        interaction = {
+            "key": request_key(method, uri, body),
+            "method": method.upper(),
+            "uri": _redact_uri(uri),
+            "body": _decode_body(body),
+            "status": response.status,
+            "headers": {h: response[h] for h in KEPT_RESPONSE_HEADERS if h in response},
+            "content": _decode_body(content),
+            "elapsed": round(elapsed, 4),
+        }
+        line = json.dumps(interaction, ensure_ascii=False) + "\n"
+        with self._lock:
+            # Дозапись отдельным gzip-членом: файл остаётся читаемым при аварийном выходе
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def replay(self, method, uri, body):
+        key = request_key(method, uri, body)
+        with self._lock:
+            interactions = self._responses.get(key)
+            if not interactions:
+                raise CassetteMissError(f"❌ Нет записи для {method} {_redact_uri(uri)}")
+            # Повторы одного запроса идут в порядке записи, последний ответ повторяется
+            index = min(self._cursor[key], len(interactions) - 1)
+            self._cursor[key] += 1
+            interaction = interactions[index]
+
+        if self.realtime and interaction.get("elapsed"):
+            time.sleep(interaction["elapsed"])
+
+        content = interaction["content"]
+        if content is not None and not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        response = httplib2.Response({"status": str(interaction["status"]), **interaction["headers"]})
+        return response, (content or "").encode("utf-8")
+
+
+class CassetteHttp:
+    """Обёртка над httplib2.Http с интерфейсом request(), которую ожидает googleapiclient."""
+
+    def __init__(self, cassette, http=None):
+        self.cassette = cassette
+        self.http = http or httplib2.Http()
+        self.timeout = getattr(self.http, "timeout", None)
+        self.redirect_codes = getattr(self.http, "redirect_codes", set())
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if RECORDED_PATH not in uri:
+            return self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+
+        if self.cassette.mode == "replay":
+            return self.cassette.replay(method, uri, body)
+
+        started = time.monotonic()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        self.cassette.record(method, uri, body, response, content, time.monotonic() - started)
+        return response, content
+
+    def close(self):
+        close = getattr(self.http, "close", None)
+        if close:
+            close()
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette(mode, path, realtime=False):
+    """Одна кассета на процесс: все сервисы пишут в один файл и читают из одного индекса."""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(path, mode, realtime)
+        return _cassette
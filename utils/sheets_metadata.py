@@ -0,0 +1,88 @@
+# utils/sheets_metadata.py
+
+import threading
+import time
+
+from core.config import METADATA_CACHE_TTL, METADATA_MISS_REFETCH_SECONDS
+from utils.retry_policy import execute_sheets_request
+
+# Запрашиваем только то, что нужно для сопоставления title -> sheetId и размера листа
+METADATA_FIELDS = "sheets.properties(title,sheetId,gridProperties.rowCount)"
+
+
+class SpreadsheetMetadataCache:
+    """
+    Кэш метаданных Google Sheets: spreadsheet_id -> {title: sheetId}.
+    Один лёгкий spreadsheets().get() на документ за TTL вместо полного запроса на каждый лист.
+    """
+
+    def __init__(self, ttl=METADATA_CACHE_TTL, miss_refetch=METADATA_MISS_REFETCH_SECONDS):
+        self.ttl = ttl
+        self.miss_refetch = miss_refetch
+        self._entries = {}  # spreadsheet_id -> (fetched_at, {title: sheetId})
+        self._row_counts = {}  # spreadsheet_id -> {title: rowCount}
+        self._lock = threading.Lock()
+
+    def _fetch(self, service, spreadsheet_id, log_file=None, token_name=None):
+        metadata = execute_sheets_request(
+            service, token_name, spreadsheet_id,
+            lambda client: client.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                fields=METADATA_FIELDS
+            ),
+            log_file, "sheets_metadata"
+        )
+        properties = [s["properties"] for s in metadata.get("sheets", []) if "properties" in s]
+        sheets = {p["title"]: p["sheetId"] for p in properties}
+        row_counts = {p["title"]: p.get("gridProperties", {}).get("rowCount") for p in properties}
+        with self._lock:
+            self._entries[spreadsheet_id] = (time.monotonic(), sheets)
+            self._row_counts[spreadsheet_id] = row_counts
+        return sheets
+
+    def _get(self, service, spreadsheet_id, log_file=None, token_name=None):
+        """Возвращает (sheets, age): age — сколько секунд назад данные получены из API."""
+        with self._lock:
+            entry = self._entries.get(spreadsheet_id)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                return entry[1], age
+        return self._fetch(service, spreadsheet_id, log_file, token_name), 0.0
+
+    def get_sheets(self, service, spreadsheet_id, log_file=None, token_name=None):
+        sheets, _ = self._get(service, spreadsheet_id, log_file, token_name)
+        return dict(sheets)
+
+    def get_sheet_id(self, service, spreadsheet_id, sheet_title, log_file=None, token_name=None):
+        """
+        Возвращает sheetId листа или None. Промах по кэшу — повторный запрос метаданных,
+        но не чаще miss_refetch сек. на документ: в этом окне промах считается отсутствием листа.
+        """
+        sheets, age = self._get(service, spreadsheet_id, log_file, token_name)
+        if sheet_title in sheets:
+            return sheets[sheet_title]
+        if age >= self.miss_refetch:
+            # Лист мог появиться после последнего запроса (например, новая смена)
+            sheets = self._fetch(service, spreadsheet_id, log_file, token_name)
+        return sheets.get(sheet_title)
+
+    def get_row_count(self, service, spreadsheet_id, sheet_title, log_file=None, token_name=None):
+        """Число строк листа (gridProperties.rowCount) или None, если лист не найден."""
+        if self.get_sheet_id(service, spreadsheet_id, sheet_title, log_file, token_name) is None:
+            return None
+        with self._lock:
+            return self._row_counts.get(spreadsheet_id, {}).get(sheet_title)
+
+    def invalidate(self, spreadsheet_id=None):
+        with self._lock:
+            if spreadsheet_id is None:
+                self._entries.clear()
+                self._row_counts.clear()
+            else:
+                self._entries.pop(spreadsheet_id, None)
+                self._row_counts.pop(spreadsheet_id, None)
+
+
+# Общий кэш для всех сканеров процесса
+metadata_cache = SpreadsheetMetadataCache()
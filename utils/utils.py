@@ -1,19 +1,26 @@
 # utils/utils.py
 
-import time
 import os
 import json
+import hashlib
 import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from core.time_provider import TimeProvider
-from core.config import RETRIES, DELAY_SECONDS
+from core.config import RETRIES, DELAY_SECONDS, GRID_DIFF_FULL_WRITE_INTERVAL
+from utils.sheets_metadata import metadata_cache
+from utils.service_registry import service_registry
+from utils.retry_policy import (
+    RetryPolicy, CircuitOpenError, QuotaExhaustedError, execute_sheets_request, is_retryable
+)
+from utils.grid_diff import diff_rectangles
+from utils.a1_notation import parse_range, format_range
 
 from utils.logger import (
-    log_info, log_success, log_warning, log_error, log_section, log_separator
+    log_info, log_warning, log_error, log_section, log_separator
 )
 
 ##################################################################################
@@ -67,62 +74,13 @@ from utils.logger import (
 #     return service
 
 def load_credentials(token_path, log_file):
-    if not os.path.exists(token_path):
-        log_error(log_file, "load_credentials", None, "file_not_found", f"❌ Файл токена не найден: {token_path}")
-        raise FileNotFoundError(f"❌ Файл токена не найден: {token_path}")
-
-    token_name = os.path.basename(token_path).replace("_token.json", "")
-
-    try:
-        with open(token_path, encoding="utf-8") as f:
-            token = json.load(f)
-    except json.JSONDecodeError as e:
-        log_error(log_file, "load_credentials", None, "json_decode_error", f"❌ Ошибка чтения токена: {token_path}", exc=e)
-        raise RuntimeError(f"❌ Ошибка чтения токена: {token_path}") from e
-
-    try:
-        creds = Credentials(
-            token=token.get("access_token"),
-            refresh_token=token.get("refresh_token"),
-            token_uri=token.get("token_uri"),
-            client_id=token.get("client_id"),
-            client_secret=token.get("client_secret"),
-            scopes=token.get("scopes", ["https://www.googleapis.com/auth/spreadsheets"])
-        )
-    except Exception as e:
-        log_error(log_file, "load_credentials", None, "credentials_creation_error", f"❌ Ошибка создания объекта Credentials: {token_path}", exc=e)
-        raise RuntimeError(f"❌ Ошибка создания объекта Credentials: {token_path}") from e
-
-    # Логирование информации о токене
-    log_info(log_file, "load_credentials", None, "token_info", f"🔍 Access Token: {creds.token}")
-    log_info(log_file, "load_credentials", None, "token_info", f"🔄 Refresh Token: {creds.refresh_token}")
-    log_info(log_file, "load_credentials", None, "token_info", f"🌐 Token URI: {creds.token_uri}")
-    log_info(log_file, "load_credentials", None, "token_info", f"🆔 Client ID: {creds.client_id}")
-    log_info(log_file, "load_credentials", None, "token_info", f"🔑 Client Secret: {creds.client_secret}")
-    log_info(log_file, "load_credentials", None, "token_info", f"📜 Scopes: {creds.scopes}")
-
-    # Попытка обновить access_token, если он просрочен
-    try:
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            log_info(log_file, "load_credentials", None, "token_refresh", "🔁 Токен успешно обновлён")
-            # Сохраняем обновлённый токен обратно в файл
-            with open(token_path, "w", encoding="utf-8") as f:
-                f.write(creds.to_json())
-            log_success(log_file, "load_credentials", None, "token_saved", "💾 Новый токен сохранён в файл")
-    except Exception as e:
-        log_error(log_file, "load_credentials", None, "refresh_fail", f"❌ Ошибка при обновлении токена", exc=e)
-        raise RuntimeError("❌ Ошибка обновления токена") from e
-
-    # Создание службы Google Sheets API
-    try:
-        service = build("sheets", "v4", credentials=creds)
-        log_success(log_file, "load_credentials", None, "auth", f"✅ Авторизация выполнена: {token_name}")
-    except Exception as e:
-        log_error(log_file, "load_credentials", None, "auth_fail", f"❌ Ошибка авторизации: {token_name}", exc=e)
-        raise RuntimeError(f"❌ Ошибка создания службы Google Sheets API: {token_name}") from e
+    """Возвращает сервис Google Sheets API для токена.
 
-    return service
+    Сервис и учётные данные кэшируются в utils.service_registry на всё время жизни
+    процесса: файл токена читается и сервис строится только при первом обращении,
+    обновление access token выполняет фоновый поток реестра.
+    """
+    return service_registry.get_service(token_path, log_file)
 
 ##################################################################################
 # Проверка существования листа
@@ -143,13 +101,10 @@ def check_sheet_exists(service, spreadsheet_id, sheet_name, log_file, token_name
     """
     success = False
     try:
-        metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheets = metadata.get('sheets', [])
-        for sheet in sheets:
-            title = sheet.get('properties', {}).get('title')
-            if title == sheet_name:
-                success = True
-                return True
+        # Метаданные берутся из общего кэша: один запрос на документ за TTL
+        if metadata_cache.get_sheet_id(service, spreadsheet_id, sheet_name, log_file, token_name) is not None:
+            success = True
+            return True
         return False
 
     except Exception as e:
@@ -163,59 +118,316 @@ def check_sheet_exists(service, spreadsheet_id, sheet_name, log_file, token_name
 # Получение данных из Google Sheets
 ##################################################################################
 
-def batch_get(service, spreadsheet_id, ranges, scan_group, log_file, token_name, retries=RETRIES, delay_seconds=DELAY_SECONDS):
+def batch_get(service, spreadsheet_id, ranges, scan_group, log_file, token_name, retries=RETRIES, delay_seconds=DELAY_SECONDS,
+              window_rows=None, window_workers=1, by_request=False):
     """Получает данные из указанных диапазонов таблицы Google Sheets.
-    """
-    attempt = 0
-    success = False
-    data = {}
 
-    while attempt < retries:
-        try:
-            response = service.spreadsheets().values().batchGet(
+    С window_rows значения каждого диапазона — ленивый генератор строк,
+    который читает лист окнами по window_rows строк (см. iter_range_rows).
+    С by_request ключи ответа — запрошенные диапазоны (valueRanges сопоставляются
+    с ranges по позиции), иначе — диапазоны в том виде, в каком их вернул API.
+    """
+    if window_rows:
+        return {
+            range_str: iter_range_rows(service, spreadsheet_id, range_str, scan_group, log_file, token_name,
+                                       window_rows, window_workers, retries, delay_seconds)
+            for range_str in ranges
+        }
+
+    policy = RetryPolicy(retries=retries, base_delay=delay_seconds)
+    try:
+        response = execute_sheets_request(
+            service, token_name, spreadsheet_id,
+            lambda client: client.spreadsheets().values().batchGet(
                 spreadsheetId=spreadsheet_id,
                 ranges=ranges,
                 majorDimension="ROWS"
-            ).execute()
-
-            value_ranges = response.get("valueRanges", [])
-            if not value_ranges:
-                log_warning(log_file, "batch_get", None, "empty", "⚠️ batchGet вернул пустые valueRanges.")
-                attempt += 1
-                time.sleep(delay_seconds)
-                continue
+            ),
+            log_file, "batch_get", policy=policy
+        )
+    except (CircuitOpenError, QuotaExhaustedError) as e:
+        log_warning(log_file, "batch_get", None, "skipped", f"⚠️ batchGet не выполнен: {e}")
+        return {}
+    except HttpError as e:
+        log_error(log_file, "batch_get", None, "http_error", f"❌ HttpError {e.resp.status} при batchGet", exc=e)
+        return {}
+    except Exception as e:
+        log_error(log_file, "batch_get", None, "fail", f"❌ Ошибка batchGet", exc=e)
+        return {}
+
+    value_ranges = response.get("valueRanges", [])
+    if not value_ranges:
+        log_warning(log_file, "batch_get", None, "empty", "⚠️ batchGet вернул пустые valueRanges.")
+        return {}
+
+    if by_request:
+        if len(value_ranges) != len(ranges):
+            log_warning(log_file, "batch_get", None, "mismatch",
+                        f"⚠️ batchGet вернул {len(value_ranges)} диапазонов вместо {len(ranges)}.")
+            return {}
+        return {range_str: vr.get("values", []) for range_str, vr in zip(ranges, value_ranges)}
+    return {vr.get("range", ""): vr.get("values", []) for vr in value_ranges}
+
+def _window_ranges(service, spreadsheet_id, parsed, window_rows, log_file, token_name):
+    """
+    Делит диапазон на окна строк; конец открытого диапазона — по rowCount листа.
 
-            data = {vr.get("range", ""): vr.get("values", []) for vr in value_ranges}
-            success = True
-            break
-
-        except HttpError as e:
-            status_code = e.resp.status
-            log_error(log_file, "batch_get", None, "http_error", f"❌ HttpError {status_code} при batchGet", exc=e)
-            if status_code in (429, 500, 503):
-                attempt += 1
-                time.sleep(delay_seconds)
-            elif status_code == 401:
+    rowCount берётся из кэша метаданных и может отставать от листа до METADATA_CACHE_TTL сек.:
+    строки, добавленные за это время, в окна не попадут до следующего скана.
+    Окна покрывают весь лист, а не только строки с данными.
+    """
+    row_count = metadata_cache.get_row_count(service, spreadsheet_id, parsed.sheet, log_file, token_name)
+    if row_count is None:
+        raise RuntimeError(f"❌ Лист '{parsed.sheet}' не найден")
+    first_row = parsed.start_row or 1
+    last_row = min(parsed.end_row or row_count, row_count)
+    return [
+        (format_range(parsed.sheet, parsed.start_col, start, parsed.end_col, min(start + window_rows - 1, last_row)),
+         min(window_rows, last_row - start + 1))
+        for start in range(first_row, last_row + 1, window_rows)
+    ]
+
+
+def iter_range_rows(service, spreadsheet_id, range_str, scan_group, log_file, token_name,
+                    window_rows, window_workers=1, retries=RETRIES, delay_seconds=DELAY_SECONDS):
+    """
+    Генератор строк большого диапазона: лист читается окнами по window_rows строк
+    (последовательно или window_workers окнами параллельно), строки отдаются по порядку.
+    В памяти одновременно не больше window_workers окон; пустые строки между окнами
+    сохраняются, хвостовые пустые строки отбрасываются, как в обычном batchGet.
+
+    Raises:
+        RuntimeError: Лист не найден или окно не удалось получить — поток обрывается,
+            чтобы обработчик не принял частичные данные за полные.
+    """
+    parsed = parse_range(range_str)
+    if parsed.sheet is None or parsed.start_col is None:
+        # Окна строятся только для диапазонов вида Лист!A2:Z — остальное читаем целиком
+        yield from batch_get(service, spreadsheet_id, [range_str], scan_group, log_file, token_name, retries, delay_seconds,
+                             by_request=True).get(range_str, [])
+        return
+
+    windows = _window_ranges(service, spreadsheet_id, parsed, window_rows, log_file, token_name)
+    log_info(log_file, "batch_get", None, "windowed", f"🪟 {range_str}: {len(windows)} окон по {window_rows} строк")
+
+    def fetch(window_range):
+        response = batch_get(service, spreadsheet_id, [window_range], scan_group, log_file, token_name, retries, delay_seconds)
+        if not response:
+            raise RuntimeError(f"❌ Не удалось получить окно {window_range}")
+        return next(iter(response.values()))
+
+    pending_empty = 0
+    with ThreadPoolExecutor(max_workers=max(1, window_workers), thread_name_prefix="batch-get-window") as executor:
+        fetch_bound = TimeProvider.bind(fetch)
+        queue = deque()
+        window_iter = iter(windows)
+        for window_range, size in window_iter:
+            queue.append((executor.submit(fetch_bound, window_range), size))
+            if len(queue) >= window_workers:
                 break
+        while queue:
+            future, size = queue.popleft()
+            rows = future.result()
+            next_window = next(window_iter, None)
+            if next_window:
+                queue.append((executor.submit(fetch_bound, next_window[0]), next_window[1]))
+            if rows:
+                for _ in range(pending_empty):
+                    yield []
+                yield from rows
+                pending_empty = size - len(rows)
             else:
-                break
+                pending_empty += size
+
+##################################################################################
+# Последние записанные данные: запись без batchClear и по изменённым ячейкам
+##################################################################################
+
+# (spreadsheet_id, лист, строка, колонка левого верхнего угла) -> (хэш, значения) последней
+# успешной записи этого процесса. Размер и хэш последней записи любого воркера лежат
+# в WrittenRanges: копия в памяти используется для diff, только если хэш совпадает с БД.
+_last_written_grids = {}
+_grids_lock = threading.Lock()
+
+
+def _grid_shape(values):
+    return len(values), max((len(row) for row in values), default=0)
+
+
+def _grid_hash(values):
+    data = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _parse_write_range(range_str):
+    """Диапазон записи -> A1Range с заданной начальной колонкой; None, если не разобрать."""
+    try:
+        parsed = parse_range(range_str)
+    except ValueError:
+        return None
+    if parsed.sheet is None or parsed.start_col is None:
+        return None
+    return parsed
+
+
+def _write_key(spreadsheet_id, parsed):
+    sheet, start_col, start_row = parsed.anchor
+    return spreadsheet_id, sheet, start_row, start_col
+
+
+def _valid_last_grid(key, stored):
+    """
+    Последняя запись этого процесса, если после неё в диапазон никто не писал и полная запись
+    была не раньше GRID_DIFF_FULL_WRITE_INTERVAL: diff сравнивает с прошлой записью, а не с листом.
+    """
+    if stored.get(key) is None or not stored[key][3]:
+        return None
+    with _grids_lock:
+        cached = _last_written_grids.get(key)
+    if cached is None or cached[0] != stored[key][2]:
+        return None
+    return cached[1]
 
-        except Exception as e:
-            msg = str(e).lower()
-            if any(term in msg for term in ["ssl", "handshake", "decryption", "timed out"]):
-                attempt += 1
-                time.sleep(delay_seconds)
-            else:
-                log_error(log_file, "batch_get", None, "fail", f"❌ Ошибка batchGet", exc=e)
-                break
 
-    return data if success else {}
+def _prepare_padded_entry(spreadsheet_id, entry, stored):
+    """
+    Дополняет значения пустыми ячейками до прежнего размера диапазона (из WrittenRanges),
+    чтобы хвост старых данных затирался в том же запросе без batchClear.
+
+    Returns:
+        tuple: (entry для отправки, нужна ли очистка, ключ и новые данные для кэша).
+    """
+    values = entry.get("values") or []
+    parsed = _parse_write_range(entry.get("range", ""))
+    if parsed is None:
+        return entry, True, None
+
+    key = _write_key(spreadsheet_id, parsed)
+    _, sheet, start_row, start_col = key
+    declared_rows, declared_cols = parsed.rows, parsed.cols
+    written = (key, [list(row) for row in values])
+    new_rows, new_cols = _grid_shape(values)
+
+    if stored.get(key) is not None and stored[key][0] is not None:
+        last_rows, last_cols = stored[key][:2]
+        rows, cols = max(new_rows, last_rows), max(new_cols, last_cols or 0)
+    elif declared_rows is not None and declared_cols is not None:
+        rows, cols = max(new_rows, declared_rows), max(new_cols, declared_cols)
+    else:
+        # Прежний размер неизвестен (открытый диапазон без записи в WrittenRanges) — нужна очистка
+        return entry, True, written
+
+    if not rows or not cols:
+        return entry, True, written
+    padded = [list(row) + [""] * (cols - len(row)) for row in values]
+    padded.extend([[""] * cols for _ in range(rows - new_rows)])
+
+    padded_range = format_range(sheet, start_col, start_row, start_col + cols - 1, start_row + rows - 1)
+    return {**entry, "range": padded_range, "values": padded}, False, written
+
+
+def _prepare_diff_entries(spreadsheet_id, entry, stored):
+    """
+    Сравнивает данные с последней записью по тому же адресу и возвращает записи
+    только для изменённых прямоугольников ([] — изменений нет).
+    None — актуальной копии прежних данных нет или изменений слишком много: нужна полная запись.
+    """
+    parsed = _parse_write_range(entry.get("range", ""))
+    if parsed is None:
+        return None
+    key = _write_key(spreadsheet_id, parsed)
+    _, sheet, start_row, start_col = key
+    last_grid = _valid_last_grid(key, stored)
+    if last_grid is None:
+        return None
+
+    rects = diff_rectangles(last_grid, entry.get("values") or [])
+    if rects is None:
+        return None
+
+    entries = []
+    for row_offset, col_offset, values in rects:
+        r0, c0 = start_row + row_offset, start_col + col_offset
+        r1, c1 = r0 + len(values) - 1, c0 + len(values[0]) - 1
+        entries.append({
+            "range": format_range(sheet, c0, r0, c1, r1),
+            "values": values
+        })
+    return entries
+
+
+def _prepare_entries(spreadsheet_id, batch_data, stored, pad_to_extent, diff_only):
+    """Returns: (записи для отправки, диапазоны для batchClear, [(ключ, новые данные, полная ли запись)])."""
+    prepared, clear_ranges, written_grids = [], [], []
+    for entry in batch_data:
+        if diff_only:
+            diff_entries = _prepare_diff_entries(spreadsheet_id, entry, stored)
+            if diff_entries is not None:
+                prepared.extend(diff_entries)
+                written_grids.append((*_prepare_padded_entry(spreadsheet_id, entry, stored)[2], False))
+                continue
+        padded_entry, needs_clear, written = _prepare_padded_entry(spreadsheet_id, entry, stored)
+        prepared.append(padded_entry if pad_to_extent else entry)
+        if (needs_clear or not pad_to_extent) and "range" in entry:
+            clear_ranges.append(entry["range"])
+        if written:
+            written_grids.append((*written, True))
+    return prepared, clear_ranges, written_grids
 
 ##################################################################################
 # Обновление данных в Google Sheets
 ##################################################################################
 
-def batch_update(service, spreadsheet_id, batch_data, token_name, update_group, log_file, retries=RETRIES, delay_seconds=DELAY_SECONDS):
+def _send_batch_update(service, spreadsheet_id, batch_data, clear_ranges, token_name, log_file, policy):
+    """batchClear (если нужен) и batchUpdate. Returns: (успех, ошибка или None)."""
+    # Предварительная очистка (только там, где прежний размер неизвестен)
+    try:
+        if clear_ranges:
+            execute_sheets_request(
+                service, token_name, spreadsheet_id,
+                lambda client: client.spreadsheets().values().batchClear(
+                    spreadsheetId=spreadsheet_id,
+                    body={"ranges": clear_ranges}
+                ),
+                log_file, "batch_update", policy=policy
+            )
+    except (CircuitOpenError, QuotaExhaustedError) as e:
+        log_warning(log_file, "batch_update", None, "skipped", f"⚠️ batchUpdate не выполнен: {e}")
+        return False, str(e)
+    except Exception as e:
+        log_warning(log_file, "batch_update", None, "clear_fail", f"⚠️ Ошибка очистки диапазонов: {str(e)}")
+
+    # Запись (повторы — по общей политике)
+    try:
+        response = execute_sheets_request(
+            service, token_name, spreadsheet_id,
+            lambda client: client.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={
+                    "valueInputOption": "USER_ENTERED",
+                    "data": batch_data
+                }
+            ),
+            log_file, "batch_update", policy=policy
+        )
+    except (CircuitOpenError, QuotaExhaustedError) as e:
+        log_warning(log_file, "batch_update", None, "skipped", f"⚠️ batchUpdate не выполнен: {e}")
+        return False, str(e)
+    except HttpError as e:
+        log_error(log_file, "batch_update", None, "http_error", f"❌ HttpError {e.resp.status} при batchUpdate", exc=e)
+        return False, "Превышено число попыток" if is_retryable(e) else "Ошибка запроса"
+    except Exception as e:
+        log_error(log_file, "batch_update", None, "fail", f"❌ Ошибка batchUpdate", exc=e)
+        return False, "Превышено число попыток" if is_retryable(e) else "Ошибка запроса"
+
+    if not (response and 'responses' in response):
+        log_warning(log_file, "batch_update", None, "empty", "⚠️ batchUpdate вернул пустой или некорректный ответ.")
+        return False, "Ошибка запроса"
+
+    return True, None
+
+
+def batch_update(service, spreadsheet_id, batch_data, token_name, update_group, log_file, retries=RETRIES, delay_seconds=DELAY_SECONDS, pad_to_extent=True, diff_only=False):
     """Обновляет данные в таблице Google Sheets, записывая их в указанные диапазоны.
 
     Args:
@@ -227,59 +439,97 @@ def batch_update(service, spreadsheet_id, batch_data, token_name, update_group,
         log_file (str): Путь к файлу журнала.
         retries (int): Количество попыток в случае ошибки (по умолчанию из конфигурации).
         delay_seconds (int): Задержка между попытками в секундах (по умолчанию из конфигурации).
+        pad_to_extent (bool): Дополнять данные пустыми ячейками до размера последней записи
+            в диапазон (WrittenRanges) вместо batchClear. Очистка остаётся только для диапазонов
+            с неизвестным размером.
+        diff_only (bool): Отправлять только изменённые прямоугольники относительно последней
+            записи по тому же адресу, если после неё в диапазон не писал другой воркер;
+            при большом объёме изменений — полная запись.
 
     Returns:
         tuple: Кортеж из двух элементов, где первый - булево значение успеха операции,
                а второй - сообщение об ошибке или None в случае успеха.
     """
-    success = False
-    attempt = 0
-
     token_name = os.path.basename(token_name).replace("_token.json", "")
-
-    # Предварительная очистка
+    policy = RetryPolicy(retries=retries, base_delay=delay_seconds)
+    if not batch_data:
+        log_info(log_file, "batch_update", None, "no_changes", f"⚪ Нет данных для записи в {update_group}")
+        return True, None
+    full_clear_ranges = [entry["range"] for entry in batch_data if "range" in entry]
+
+    if not (pad_to_extent or diff_only):
+        return _send_batch_update(service, spreadsheet_id, batch_data, full_clear_ranges, token_name, log_file, policy)
+
+    from database.session import get_session
+    from utils.db_orm import read_written_ranges
+
+    keys = set()
+    for entry in batch_data:
+        parsed = _parse_write_range(entry.get("range", ""))
+        if parsed is not None:
+            keys.add(_write_key(spreadsheet_id, parsed))
+
+    # Прежние размер и хэш — короткой транзакцией: HTTP-запись (с повторами и ожиданием
+    # rate_limiter) идёт без открытой транзакции и блокировок в БД
     try:
-        clear_ranges = [entry["range"] for entry in batch_data if "range" in entry]
-        if clear_ranges:
-            service.spreadsheets().values().batchClear(
-                spreadsheetId=spreadsheet_id,
-                body={"ranges": clear_ranges}
-            ).execute()
+        with get_session() as session:
+            stored = read_written_ranges(session, keys, GRID_DIFF_FULL_WRITE_INTERVAL)
     except Exception as e:
-        log_warning(log_file, "batch_update", None, "clear_fail", f"⚠️ Ошибка очистки диапазонов: {str(e)}")
+        log_warning(log_file, "batch_update", None, "written_ranges_fail", f"⚠️ WrittenRanges недоступна, запись с очисткой: {e}")
+        return _send_batch_update(service, spreadsheet_id, batch_data, full_clear_ranges, token_name, log_file, policy)
+
+    prepared, clear_ranges, written_grids = _prepare_entries(spreadsheet_id, batch_data, stored, pad_to_extent, diff_only)
+    if not prepared:
+        log_info(log_file, "batch_update", None, "no_changes", f"⚪ Изменённых ячеек нет, запись в {update_group} пропущена")
+        return True, None
+
+    success, error = _send_batch_update(service, spreadsheet_id, prepared, clear_ranges, token_name, log_file, policy)
+    if not success:
+        return success, error
+
+    written = {key: (grid, _grid_hash(grid), full) for key, grid, full in written_grids}
+    kept = _record_written_ranges(stored, written, log_file)
+    with _grids_lock:
+        for key, (grid, grid_hash, _) in written.items():
+            if key in kept:
+                _last_written_grids[key] = (grid_hash, grid)
+            else:
+                _last_written_grids.pop(key, None)
+    return True, None
 
-    # Попытки записи
-    while attempt < retries:
-        try:
-            response = service.spreadsheets().values().batchUpdate(
-                spreadsheetId=spreadsheet_id,
-                body={
-                    "valueInputOption": "USER_ENTERED",
-                    "data": batch_data
-                }
-            ).execute()
 
-            if response and 'responses' in response:
-                success = True
-                break
-            else:
-                log_warning(log_file, "batch_update", None, "empty", "⚠️ batchUpdate вернул пустой или некорректный ответ.")
-                attempt += 1
-                time.sleep(delay_seconds)
-
-        except HttpError as e:
-            status = e.resp.status
-            log_error(log_file, "batch_update", None, "http_error", f"❌ HttpError {status} при batchUpdate", exc=e)
-            if status in [429, 500, 503]:
-                attempt += 1
-                time.sleep(delay_seconds)
-            elif status == 401:
-                break
-            else:
-                break
+def _record_written_ranges(stored, written, log_file):
+    """
+    Вторая короткая транзакция после записи: строки адресов под FOR UPDATE, проверка,
+    что с момента чтения в диапазон не писал другой воркер, и сохранение размера и хэша.
+    Если писал — данные на листе смешаны: хэш сбрасывается (следующая запись полная),
+    размер берётся наибольший, чтобы дополнение затёрло хвосты обеих записей.
+
+    Returns:
+        set: ключи, чьи данные можно держать в памяти для следующего diff.
+    """
+    from database.session import get_session
+    from utils.db_orm import lock_written_ranges, save_written_ranges
+
+    if not written:
+        return set()
+    saved, conflicts = {}, {}
+    try:
+        with get_session() as session:
+            current = lock_written_ranges(session, set(written))
+            for key, (grid, grid_hash, full) in written.items():
+                rows, cols = _grid_shape(grid)
+                last_rows, last_cols, last_hash, _ = current.get(key) or (None, None, None, False)
+                if last_hash != (stored.get(key) or (None, None, None, False))[2]:
+                    conflicts[key] = (max(rows, last_rows or 0), max(cols, last_cols or 0), None, False)
+                else:
+                    saved[key] = (rows, cols, grid_hash, full)
+            save_written_ranges(session, {**saved, **conflicts})
+    except Exception as e:
+        log_warning(log_file, "batch_update", None, "written_ranges_fail", f"⚠️ Не удалось сохранить WrittenRanges: {e}")
+        return set()
 
-        except Exception as e:
-            log_error(log_file, "batch_update", None, "fail", f"❌ Ошибка batchUpdate", exc=e)
-            break
-    
-    return (True, None) if success else (False, "Превышено число попыток" if attempt == retries else "Ошибка запроса")
+    if conflicts:
+        log_warning(log_file, "batch_update", None, "written_ranges_conflict",
+                    f"⚠️ В {len(conflicts)} диапазонов одновременно писал другой воркер — следующая запись будет полной")
+    return set(saved)